@@ -0,0 +1,37 @@
+"""Add embedding cache
+
+Revision ID: a4c6e1f8b2d9
+Revises: f3b9d0c27a41
+Create Date: 2026-10-18 16:40:12.517903
+
+"""
+
+from typing import Sequence, Union
+
+import fastapi_users_db_sqlalchemy
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a4c6e1f8b2d9"
+down_revision: Union[str, None] = "f3b9d0c27a41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # content-addressed vectors, shared by all projects of a user
+    op.create_table(
+        "EmbeddingCache",
+        sa.Column("user_id", fastapi_users_db_sqlalchemy.generics.GUID(), nullable=False),
+        sa.Column("embedding_model", sa.String(), nullable=False),
+        sa.Column("content_hash", sa.String(length=64), nullable=False),
+        sa.Column("embedding", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "embedding_model", "content_hash"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("EmbeddingCache")
@@ -0,0 +1,32 @@
+"""Add embedding dtype
+
+Revision ID: c7e1d4a9f2b3
+Revises: b389592974f8
+Create Date: 2026-10-18 10:12:31.402115
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c7e1d4a9f2b3"
+down_revision: Union[str, None] = "b389592974f8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # existing rows are raw float32 vectors
+    with op.batch_alter_table("Embeddings") as batch_op:
+        batch_op.add_column(
+            sa.Column("dtype", sa.String(), nullable=False, server_default="float32")
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("Embeddings") as batch_op:
+        batch_op.drop_column("dtype")
@@ -0,0 +1,157 @@
+"""Normalize embeddings
+
+Revision ID: e5a2b8c61d07
+Revises: c7e1d4a9f2b3
+Create Date: 2026-10-18 11:40:02.918344
+
+"""
+
+import os
+from pathlib import Path
+from typing import Sequence, Union
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e5a2b8c61d07"
+down_revision: Union[str, None] = "c7e1d4a9f2b3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+BATCH_SIZE = 1000
+
+# exported matrices live under <uploads>/<user_id>/<doc_id>/embeddings/; the default is the backend's shared-data/uploads
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR") or Path(__file__).resolve().parents[2] / "shared-data" / "uploads").resolve()
+COMPACT_DTYPES = ("float16", "int8")
+
+embeddings = sa.table(
+    "Embeddings",
+    sa.column("embedding_id", sa.Integer),
+    sa.column("embedding", sa.LargeBinary),
+    sa.column("dtype", sa.String),
+    sa.column("normalized", sa.Boolean),
+)
+
+
+# Frozen copies of the storage routines as of this revision, so the migration does not follow later application code.
+def _decode(blob: bytes, dtype: str) -> np.ndarray:
+    if dtype == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if dtype == "int8":
+        # float32 scale, then the int8 codes
+        scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+        return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def _quantize(matrix: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        safe = np.where(scales == 0.0, 1.0, scales)
+        codes = np.clip(np.rint(matrix / safe[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return matrix.astype(np.float32), None
+
+
+def _encode(vector: np.ndarray, dtype: str) -> bytes:
+    codes, scales = _quantize(vector[None, :], dtype)
+    return codes[0].tobytes() if scales is None else scales[0].tobytes() + codes[0].tobytes()
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0.0)
+
+
+def _save(path: Path, array: np.ndarray) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+def normalize_legacy_matrices(uploads_dir: Path) -> int:
+    """
+    Rewrite exported matrices from before normalization as ".unit" files (float32 and compact), in place of the old ones.
+    Returns the number of converted exports.
+    """
+    converted = 0
+
+    for matrix_path in uploads_dir.glob("*/*/embeddings/*.npy"):
+        name = matrix_path.name
+        if ".unit" in name or name.endswith(".ids.npy") or name.count(".") != 1:
+            continue
+
+        stem = matrix_path.stem
+        ids_path = matrix_path.with_name(f"{stem}.ids.npy")
+
+        matrix = None
+        try:
+            matrix = _normalize_rows(np.load(matrix_path))
+            if matrix.ndim != 2 or matrix.shape[0] != np.load(ids_path).shape[0]:
+                matrix = None
+        except (FileNotFoundError, ValueError):
+            matrix = None
+
+        if matrix is not None:
+            _save(matrix_path.with_name(f"{stem}.unit.npy"), matrix)
+            converted += 1
+
+        # compact matrices are re-quantized from the normalized float32 rows
+        for dtype in COMPACT_DTYPES:
+            legacy_compact = matrix_path.with_name(f"{stem}.{dtype}.npy")
+            if matrix is not None and legacy_compact.exists():
+                _save(matrix_path.with_name(f"{stem}.unit.{dtype}.npy"), _quantize(matrix, dtype)[0])
+            legacy_compact.unlink(missing_ok=True)
+
+        matrix_path.unlink(missing_ok=True)
+
+    return converted
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("Embeddings") as batch_op:
+        batch_op.add_column(
+            sa.Column("normalized", sa.Boolean(), nullable=False, server_default=sa.false())
+        )
+
+    # Normalize the stored vectors in place: no re-embedding through the remote API
+    bind = op.get_bind()
+    last_id = 0
+
+    while True:
+        rows = bind.execute(
+            sa.select(embeddings.c.embedding_id, embeddings.c.embedding, embeddings.c.dtype)
+            .where(embeddings.c.normalized == sa.false(), embeddings.c.embedding_id > last_id)
+            .order_by(embeddings.c.embedding_id)
+            .limit(BATCH_SIZE)
+        ).all()
+
+        if not rows:
+            break
+
+        for embedding_id, blob, dtype in rows:
+            vector = _normalize_rows(_decode(blob, dtype)[None, :])[0]
+            bind.execute(
+                embeddings.update()
+                .where(embeddings.c.embedding_id == embedding_id)
+                .values(embedding=_encode(vector, dtype), normalized=True)
+            )
+
+        last_id = rows[-1][0]
+
+    # exported matrix files next to the uploads
+    normalize_legacy_matrices(UPLOADS_DIR)
+
+
+def downgrade() -> None:
+    # normalized vectors stay valid for cosine similarity
+    with op.batch_alter_table("Embeddings") as batch_op:
+        batch_op.drop_column("normalized")
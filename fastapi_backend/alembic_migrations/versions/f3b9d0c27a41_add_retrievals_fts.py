@@ -0,0 +1,40 @@
+"""Add retrievals FTS5 mirror
+
+Revision ID: f3b9d0c27a41
+Revises: e5a2b8c61d07
+Create Date: 2026-10-18 14:05:37.210418
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.rag_services.keyword_index import FTS_TABLE, FTS_STATEMENTS, DROP_FTS_STATEMENTS
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f3b9d0c27a41"
+down_revision: Union[str, None] = "e5a2b8c61d07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # FTS5 is SQLite only: other backends keep using the exported inverted index
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    for statement in FTS_STATEMENTS:
+        op.execute(statement)
+
+    # index the rows that already exist; the triggers keep it in sync afterwards
+    op.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    for statement in DROP_FTS_STATEMENTS:
+        op.execute(statement)
@@ -12,6 +12,9 @@ class Settings(BaseSettings):
     TEST_DATABASE_URL: str | None = None
     EXPIRE_ON_COMMIT: bool = False
 
+    # Vector search: "numpy" (in-process) or "sqlite-vec" (KNN inside SQLite, falls back to numpy if the extension can't load)
+    VECTOR_BACKEND: str = "numpy"
+
     # User
     ACCESS_SECRET_KEY: str
     RESET_PASSWORD_SECRET_KEY: str
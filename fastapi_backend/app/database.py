@@ -3,11 +3,14 @@
 from typing import AsyncGenerator
 from fastapi import Depends
 from fastapi_users.db import SQLAlchemyUserDatabase
-from sqlalchemy import event
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from .config import settings
 from .models import Base, User
+from app.rag_services.vector_store import set_sqlite_vec_loaded
+from app.rag_services.keyword_index import create_fts, DROP_FTS_STATEMENTS
+from loguru import logger as AgentLogger
 
 
 # --- Create async engine ---
@@ -18,16 +21,27 @@ engine = create_async_engine(
 
 
 
-# --- Load sqlite-vec on every connection ---
+# --- Load sqlite-vec on every connection (VECTOR_BACKEND="sqlite-vec") ---
 @event.listens_for(engine.sync_engine, "connect")
 def load_sqlite_vec(dbapi_connection, connection_record):
-    # unwrap aiosqlite → sqlite3.Connection
-    raw_conn = dbapi_connection._connection._conn
-    # load sqlite-vec via Python package
-    #sqlite_vec.load(raw_conn)
+    if settings.VECTOR_BACKEND != "sqlite-vec" or engine.dialect.name != "sqlite":
+        return
 
-    #raw_conn.enable_load_extension(True)
-    #raw_conn.load_extension(r"C:\Program Files\sqlite-vec\vec0.dll")
+    try:
+        import sqlite_vec
+
+        # aiosqlite owns the sqlite3.Connection in its worker thread, so go through the adapter
+        dbapi_connection.run_async(lambda conn: conn.enable_load_extension(True))
+        dbapi_connection.run_async(lambda conn: conn.load_extension(sqlite_vec.loadable_path()))
+        dbapi_connection.run_async(lambda conn: conn.enable_load_extension(False))
+
+    # package missing, or Python's sqlite3 built without extension support
+    except Exception as e:
+        AgentLogger.warning("sqlite-vec unavailable, using the NumPy vector search", extra={"error": repr(e)})
+        set_sqlite_vec_loaded(False)
+        return
+
+    set_sqlite_vec_loaded(True)
 
 
 
@@ -41,10 +55,15 @@ async_session_maker = async_sessionmaker(
 async def create_db_and_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # FTS5 mirror of Retrievals.content (SQLite only), create_all does not know virtual tables
+        await create_fts(conn)
 
 
 async def drop_tables():
     async with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            for statement in DROP_FTS_STATEMENTS:
+                await conn.execute(text(statement))
         await conn.run_sync(Base.metadata.drop_all)
 
 async def drop_specific_table(table_name: str):
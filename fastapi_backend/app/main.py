@@ -16,6 +16,7 @@ from app.routes.retrieval import router as retrieval_router
 from app.routes.chat import router as chat_router
 from app.config import settings
 from app.database import create_db_and_tables, drop_tables, drop_specific_table
+from app.rag_apis.http_clients import open_http_clients, close_http_clients
 
 
 
@@ -36,6 +37,12 @@ async def on_startup():
     print("DATABASE_URL =", settings.DATABASE_URL)
     print("CWD =", os.getcwd())
     await create_db_and_tables()
+    await open_http_clients()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_http_clients()
 
 
 # Middleware for CORS configuration
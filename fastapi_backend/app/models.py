@@ -8,6 +8,7 @@ import json
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import delete, insert
 from sqlalchemy.inspection import inspect
 from typing import TypeVar, Type, Dict, Any, Optional
 from sqlalchemy.types import TypeDecorator, UserDefinedType
@@ -38,6 +39,28 @@ class Base(DeclarativeBase):
 
         await db.commit()
 
+    @classmethod
+    async def bulk_delete_data(
+            cls: type[T],
+            where_dict: Dict[str, Any],
+            db: AsyncSession,
+    ) -> None:
+        """
+        Single set-based DELETE; list/tuple/set values become IN (...). Does not commit.
+        """
+        filters = []
+        for key, value in where_dict.items():
+            column = getattr(cls, key)
+
+            if value is None:
+                filters.append(column.is_(None))
+            elif isinstance(value, (list, tuple, set)):
+                filters.append(column.in_(value))
+            else:
+                filters.append(column == value)
+
+        await db.execute(delete(cls).where(and_(*filters)))
+
     @classmethod
     async def update_data(
             cls: type[T],
@@ -80,6 +103,38 @@ class Base(DeclarativeBase):
 
         return new_row
 
+    @classmethod
+    async def bulk_insert_data(
+            cls: type[T],
+            rows: list[Dict[str, Any]],
+            db: AsyncSession,
+    ) -> None:
+        """
+        Single executemany INSERT, without ORM objects. Does not commit.
+        """
+        if rows:
+            await db.execute(insert(cls), rows)
+
+    @classmethod
+    async def bulk_insert_ignore_data(
+            cls: type[T],
+            rows: list[Dict[str, Any]],
+            db: AsyncSession,
+    ) -> None:
+        """
+        Single executemany INSERT ... ON CONFLICT DO NOTHING: rows whose primary key already exists are skipped,
+        so concurrent writers of the same rows do not fail. Does not commit.
+        """
+        if not rows:
+            return
+
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        await db.execute(dialect_insert(cls).on_conflict_do_nothing(), rows)
+
     @classmethod
     async def get_all(
             cls: type[T],
@@ -173,6 +228,7 @@ class User(SQLAlchemyBaseUserTableUUID, Base):
     paragraphs = relationship("Paragraph", back_populates="user", cascade="all, delete-orphan")
     retrievals = relationship("Retrieval", back_populates="user", cascade="all, delete-orphan") # also used for table
     embeddings = relationship("Embedding", back_populates="user", cascade="all, delete-orphan")
+    embedding_cache = relationship("EmbeddingCache", back_populates="user", cascade="all, delete-orphan")
 
     # settings
     settings = relationship("Settings", back_populates="user", cascade="all, delete-orphan")
@@ -501,6 +557,8 @@ class Embedding(Base):
     level = Column(String, nullable=True)
 
     embedding = Column(LargeBinary, nullable=False)
+    dtype = Column(String, nullable=False, default="float32", server_default="float32")  # float32 | float16 | int8
+    normalized = Column(Boolean, nullable=False, server_default=false())  # L2-normalized before encoding
 
     user_id = Column(UUID(as_uuid=True), ForeignKey("user.id"), nullable=False)
 
@@ -508,6 +566,20 @@ class Embedding(Base):
 
 
 
+# Content-addressed: one vector per (user, embedding model, sha256 of the chunk content), shared by all projects and re-exports
+class EmbeddingCache(Base):
+    __tablename__ = "EmbeddingCache"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    embedding_model = Column(String, primary_key=True)
+    content_hash = Column(String(64), primary_key=True)
+
+    embedding = Column(LargeBinary, nullable=False)  # float32, L2-normalized: the storage mode only applies to Embeddings
+
+    user = relationship("User", back_populates="embedding_cache")
+
+
+
 # -------API KEYS------
 
 
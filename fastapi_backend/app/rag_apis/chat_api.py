@@ -1,12 +1,17 @@
 
+import os
 import time
+import asyncio
 
 from itertools import cycle
-from openai import OpenAI, APIError, RateLimitError, AuthenticationError, APITimeoutError
+from openai import AsyncOpenAI, APIError, RateLimitError, AuthenticationError, APITimeoutError
 
 from app.rag_apis.model_enums import CHAT_SUBCATEGORIES, MODEL_CONTEXT_LENGTHS, DEFAULT_CONTEXT_LENGTH, CONTEXT_RESERVE
 from loguru import logger as AgentLogger
 from app.rag_services.helpers import ExtractionError
+from app.rag_apis.http_clients import get_http_client
+from app.rag_apis.rate_limiter import acquire_rate_limit, select_key
+from app.rag_apis.model_health import acquire_model, get_model_health, rank_models, record_model_success, record_model_failure, record_model_latency
 
 
 # ============================================================
@@ -18,6 +23,23 @@ def _estimate_tokens(text: str) -> int:
     return max(1, len(text) // 3)
 
 
+def _truncate_to_tokens(text: str, max_tokens: int, suffix: str = "") -> str:
+    """Longest prefix of text that, followed by suffix, stays within max_tokens by _estimate_tokens."""
+    if _estimate_tokens(text + suffix) <= max_tokens:
+        return text + suffix
+
+    # the estimate grows with the length: binary search over the prefix length
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if _estimate_tokens(text[:mid] + suffix) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+
+    return text[:low] + suffix
+
+
 def _truncate_history(
     system_prompt: str,
     history: list[dict],
@@ -61,6 +83,12 @@ def _truncate_history(
     return kept
 
 
+def label_context_limit(label: str) -> int:
+    """Smallest context window among the models of a label: the prompt size every model of the label accepts."""
+    models = CHAT_SUBCATEGORIES.get(label, [])
+    return min((MODEL_CONTEXT_LENGTHS.get(model.value, DEFAULT_CONTEXT_LENGTH) for model in models), default=DEFAULT_CONTEXT_LENGTH)
+
+
 
 
 # # ============================================================
@@ -129,26 +157,37 @@ BASE_API = os.getenv("BASE_API", "https://chat-ai.academiccloud.de/v1/")
 
 MAX_RETRIES = 1  # reduced from 3 — fail fast and switch model/key sooner
 
+# Hedging (opt-in per orchestrator): once a call is slower than its model's observed p90,
+# the same request also goes to the next model (or another key) and the first answer wins.
+# Until a model has HEDGE_MIN_SAMPLES latencies the backup fires after HEDGE_DEFAULT_DELAY.
+HEDGE_PERCENTILE = 0.9
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 5))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 10.0))
+
 
 # ============================================================
 # Client Builder
 # ============================================================
-def make_client(api_key: str, base_api: str) -> OpenAI:
-    return OpenAI(api_key=api_key, base_url=base_api, timeout=60.0)
+def make_client(api_key: str, base_api: str) -> AsyncOpenAI:
+    # thin wrapper over the pooled transport: rebuilding it per call or key rotation opens no new connection
+    return AsyncOpenAI(api_key=api_key, base_url=base_api, timeout=60.0, http_client=get_http_client(base_api, api_key))
 
 
 # ============================================================
 # Chat Orchestrator
 # ============================================================
 class ChatOrchestrator:
-    def __init__(self, base_api: str, user_key_list: list[str]):
+    def __init__(self, base_api: str, user_key_list: list[str], hedge: bool = False):
+        self.keys = user_key_list
         self.key_cycle = cycle(user_key_list)
         self.base_api = base_api
         self.max_retries = MAX_RETRIES
-        AgentLogger.info("ChatOrchestrator initialized", extra={"available_keys": len(user_key_list)})
+        self.hedge = hedge
+        AgentLogger.info("ChatOrchestrator initialized", extra={"available_keys": len(user_key_list), "hedge": hedge})
 
-    def _safe_call(self, client, model, messages, model_queue, failure_count, retry_num=0):
+    async def _safe_call(self, client, model, messages, model_queue, failure_count, retry_num=0):
         """Execute one chat completion call safely with retry and rotation handling.
+        Awaits the request and every backoff, so the event loop keeps serving other requests meanwhile.
 
         Returns:
             str: model response content on success.
@@ -159,7 +198,10 @@ class ChatOrchestrator:
         AgentLogger.debug("Invoking model", extra={"model": model.value, "api_key": client.api_key[:6]})
 
         try:
-            response = client.chat.completions.create(
+            # paced by the key's shared limiter, which learns the limits from the response headers
+            await acquire_rate_limit(self.base_api, client.api_key)
+            started = time.monotonic()
+            response = await client.chat.completions.create(
                 model=model.value,
                 messages=messages,
                 temperature=0.05,
@@ -169,8 +211,10 @@ class ChatOrchestrator:
 
             if not response.choices or not response.choices[0].message:
                 AgentLogger.error("Empty or malformed response", extra={"model": model.value})
+                record_model_failure(self.base_api, model)
                 raise ExtractionError("Empty or malformed response", status_code=502)
 
+            record_model_success(self.base_api, model, time.monotonic() - started)
             return response.choices[0].message.content
 
         # -----------------------------
@@ -180,29 +224,29 @@ class ChatOrchestrator:
             AgentLogger.error("Unauthorized (401)", extra={"error": str(e), "api_key": client.api_key[:6]})
             failure_count[client.api_key] = failure_count.get(client.api_key, 0) + 1
 
-            if failure_count[client.api_key] >= 3:
-                AgentLogger.warning("Switching API key after repeated 401", extra={"api_key": client.api_key[:6]})
+            if failure_count[client.api_key] < 3:
+                AgentLogger.warning("Retrying same key once more", extra={"api_key": client.api_key[:6]})
+                await asyncio.sleep(1)
+                return await self._safe_call(client, model, messages, model_queue, failure_count, retry_num)
+
+            AgentLogger.warning("Switching API key after repeated 401", extra={"api_key": client.api_key[:6]})
+            # one pass over the cycle: keys that already failed three times are skipped, not retried
+            for _ in range(len(self.keys)):
+                next_key = next(self.key_cycle)
+                if failure_count.get(next_key, 0) >= 3:
+                    continue
                 try:
-                    next_key = next(self.key_cycle)
-                    return self._safe_call(
-                        make_client(next_key, self.base_api),
-                        model,
-                        messages,
-                        model_queue,
-                        failure_count,
-                        retry_num,
-                    )
-                except ExtractionError:
-                    raise
+                    next_client = make_client(next_key, self.base_api)
                 except Exception as inner_e:
                     AgentLogger.error("Failed to rotate key after auth error", extra={"error": str(inner_e)})
                     raise ExtractionError(
                         f"Failed to rotate key after auth error: {str(inner_e)}",
                         status_code=401,
                     ) from inner_e
-            else:
-                AgentLogger.warning("Retrying same key once more", extra={"api_key": client.api_key[:6]})
-                time.sleep(1)
+                return await self._safe_call(next_client, model, messages, model_queue, failure_count, retry_num)
+
+            AgentLogger.error("All API keys failed authentication", extra={"keys": len(self.keys)})
+            raise ExtractionError("All API keys failed authentication", status_code=401) from e
         # -----------------------------
         # RATE LIMITS
         # -----------------------------
@@ -213,12 +257,12 @@ class ChatOrchestrator:
             if model_queue:
                 next_model = model_queue.pop(0)
                 AgentLogger.warning("Switching to next model after rate limit", extra={"next_model": next_model.value})
-                return self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
+                return await self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
 
             # No more models — try rotating the API key as a last resort
             try:
                 next_key = next(self.key_cycle)
-                return self._safe_call(
+                return await self._safe_call(
                     make_client(next_key, self.base_api),
                     model,
                     messages,
@@ -240,18 +284,19 @@ class ChatOrchestrator:
         # -----------------------------
         except APITimeoutError as e:
             AgentLogger.warning("Timeout — switching model", extra={"model": model.value})
+            record_model_failure(self.base_api, model)
 
             if model_queue:
                 next_model = model_queue.pop(0)
                 AgentLogger.warning("Switching to next model after timeout", extra={"next_model": next_model.value})
-                return self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
+                return await self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
 
             # No more models — try once more with a key rotation
             if retry_num < self.max_retries:
-                time.sleep(2)
+                await asyncio.sleep(2)
                 try:
                     next_key = next(self.key_cycle)
-                    return self._safe_call(
+                    return await self._safe_call(
                         make_client(next_key, self.base_api),
                         model,
                         messages,
@@ -276,22 +321,25 @@ class ChatOrchestrator:
                 "API error — trying next model",
                 extra={"status": status, "model": model.value},
             )
+            if status != 401:
+                # a bad key says nothing about the model
+                record_model_failure(self.base_api, model)
 
             if status in (500, 502, 503, 504):
                 if retry_num < self.max_retries:
-                    time.sleep(2)
-                    return self._safe_call(client, model, messages, model_queue, failure_count, retry_num + 1)
+                    await asyncio.sleep(2)
+                    return await self._safe_call(client, model, messages, model_queue, failure_count, retry_num + 1)
                 elif model_queue:
                     next_model = model_queue.pop(0)
                     AgentLogger.warning("Switching to next model", extra={"next_model": next_model.value})
-                    return self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
+                    return await self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
                 else:
                     raise ExtractionError("All models returned server errors", status_code=502) from e
 
             elif status == 401:
                 try:
                     next_key = next(self.key_cycle)
-                    return self._safe_call(
+                    return await self._safe_call(
                         make_client(next_key, self.base_api),
                         model,
                         messages,
@@ -312,7 +360,7 @@ class ChatOrchestrator:
                         "Skipping unavailable model",
                         extra={"failed_model": model.value, "next_model": next_model.value, "status": status},
                     )
-                    return self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
+                    return await self._safe_call(client, next_model, messages, model_queue, failure_count, 0)
                 raise ExtractionError(f"All models exhausted (status {status})", status_code=status or 500) from e
 
         except ExtractionError:
@@ -320,28 +368,93 @@ class ChatOrchestrator:
 
         except Exception as e:
             AgentLogger.warning("Unexpected error — retrying", extra={"model": model.value})
+            record_model_failure(self.base_api, model)
 
             if retry_num < self.max_retries:
-                time.sleep(1)
-                return self._safe_call(client, model, messages, model_queue, failure_count, retry_num + 1)
+                await asyncio.sleep(1)
+                return await self._safe_call(client, model, messages, model_queue, failure_count, retry_num + 1)
 
             raise ExtractionError("Unexpected error — retries exhausted", status_code=500) from e
     # ========================================================
+    # Hedged Calls
+    # ========================================================
+    def _hedge_target(self, client, model, model_queue):
+        """Backup for a slow call: the next queued model without an open circuit, else the same model on another key."""
+        for i, next_model in enumerate(model_queue):
+            if acquire_model(self.base_api, next_model):
+                model_queue.pop(i)
+                return make_client(select_key(self.base_api, self.keys), self.base_api), next_model
+
+        other_keys = [key for key in self.keys if key != client.api_key]
+        if other_keys:
+            return make_client(select_key(self.base_api, other_keys), self.base_api), model
+        return None
+
+    async def _hedged_call(self, client, model, messages, model_queue, failure_count):
+        """
+        _safe_call with a backup request once the primary is slower than its model's p90 latency.
+        Each call falls back on its own copy of the queue; the first answer wins and the other call is cancelled.
+        Raises only when both fail.
+        """
+        delay = get_model_health(self.base_api, model).latency_percentile(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        delay = HEDGE_DEFAULT_DELAY if delay is None else delay
+        started = {}
+
+        def launch(call_client, call_model):
+            task = asyncio.create_task(self._safe_call(call_client, call_model, messages, list(model_queue), dict(failure_count)))
+            started[task] = (call_model, time.monotonic())
+            return task
+
+        pending = {launch(client, model)}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                backup = self._hedge_target(client, model, model_queue)
+                if backup is not None:
+                    AgentLogger.info(
+                        "Hedging slow call",
+                        extra={"model": model.value, "after_seconds": round(delay, 2), "backup_model": backup[1].value},
+                    )
+                    pending.add(launch(*backup))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+
+        finally:
+            for task in pending:
+                task.cancel()
+                # the cancelled call took at least this long: keeps a slow model's p90 honest. Shorter ones
+                # (a backup cancelled right after launch) would only drag the percentile down
+                call_model, start = started[task]
+                elapsed = time.monotonic() - start
+                if elapsed >= delay:
+                    record_model_latency(self.base_api, call_model, elapsed)
+
+    # ========================================================
     # User-Facing Methods
     # ========================================================
-    def call(self, label: str, system_prompt: str, user_prompt: str):
+    async def call(self, label: str, system_prompt: str, user_prompt: str, hedge: bool | None = None):
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
         AgentLogger.info("Starting chat", extra={"label": label})
-        return self._run(label, messages)
+        return await self._run(label, messages, hedge=hedge)
 
-    def call_with_history(self, label: str, system_prompt: str, history: list, user_prompt: str):
+    async def call_with_history(self, label: str, system_prompt: str, history: list, user_prompt: str, hedge: bool | None = None):
         AgentLogger.info("Starting chat with history", extra={"label": label, "history_len": len(history)})
-        return self._run(label, system_prompt=system_prompt, history=history, user_prompt=user_prompt)
+        return await self._run(label, system_prompt=system_prompt, history=history, user_prompt=user_prompt, hedge=hedge)
+
+    async def _run(self, label, messages=None, *, system_prompt=None, history=None, user_prompt=None, hedge=None):
+        # per-call override of the orchestrator's hedging
+        hedge = self.hedge if hedge is None else hedge
 
-    def _run(self, label, messages=None, *, system_prompt=None, history=None, user_prompt=None):
         if label not in CHAT_SUBCATEGORIES:
             AgentLogger.error("Unknown model label", extra={"label": label})
             raise ValueError(f"Unknown model label: {label}")
@@ -361,7 +474,13 @@ class ChatOrchestrator:
                     fallback_queue.append(model)
                     seen_models.add(model)
 
-        full_queue = primary_queue + fallback_queue
+        # fastest healthy models first; open circuits are skipped and only tried once everything else failed
+        primary_queue, primary_open = rank_models(self.base_api, primary_queue)
+        fallback_queue, fallback_open = rank_models(self.base_api, fallback_queue)
+        if primary_open:
+            AgentLogger.debug("Skipping models with open circuit", extra={"label": label, "models": [m.value for m in primary_open]})
+
+        full_queue = primary_queue + fallback_queue + primary_open + fallback_open
         current_model = full_queue.pop(0)
         failure_count = {}
 
@@ -386,39 +505,44 @@ class ChatOrchestrator:
                 + [{"role": "user", "content": user_prompt}]
             )
 
-        api_key = next(self.key_cycle)
+        api_key = select_key(self.base_api, self.keys)
         client = make_client(api_key, self.base_api)
         AgentLogger.debug(
             "Running model pipeline",
             extra={"label": label, "current_model": current_model.value,
-                   "total_candidates": len(full_queue) + 1}
+                   "total_candidates": len(full_queue) + 1, "hedge": hedge}
         )
-        return self._safe_call(client, current_model, final_messages, full_queue, failure_count)
+        if hedge:
+            return await self._hedged_call(client, current_model, final_messages, full_queue, failure_count)
+        return await self._safe_call(client, current_model, final_messages, full_queue, failure_count)
 
 
 # ============================================================
 # Example Usage
 # ============================================================
 if __name__ == "__main__":
-    orchestrator = ChatOrchestrator()
-
-    AgentLogger.info("=== Simple Reasoner Call (OpenAI client) ===")
-    result = orchestrator.call(
-        label="reasoner",
-        system_prompt="You are an HPC reasoning assistant.",
-        user_prompt="Explain how workspace allocation works on the cluster.",
-    )
-    print(result)
-
-    AgentLogger.info("=== Chat with History (OpenAI client) ===")
-    history = [
-        {"role": "user", "content": "Hi"},
-        {"role": "assistant", "content": "Hello! How can I help you today?"},
-    ]
-    result = orchestrator.call_with_history(
-        label="generator",
-        system_prompt="You are a helpful HPC assistant.",
-        history=history,
-        user_prompt="Generate a short guide on using SLURM partitions.",
-    )
-    print(result)
+    async def main():
+        orchestrator = ChatOrchestrator()
+
+        AgentLogger.info("=== Simple Reasoner Call (OpenAI client) ===")
+        result = await orchestrator.call(
+            label="reasoner",
+            system_prompt="You are an HPC reasoning assistant.",
+            user_prompt="Explain how workspace allocation works on the cluster.",
+        )
+        print(result)
+
+        AgentLogger.info("=== Chat with History (OpenAI client) ===")
+        history = [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello! How can I help you today?"},
+        ]
+        result = await orchestrator.call_with_history(
+            label="generator",
+            system_prompt="You are a helpful HPC assistant.",
+            history=history,
+            user_prompt="Generate a short guide on using SLURM partitions.",
+        )
+        print(result)
+
+    asyncio.run(main())
@@ -9,6 +9,8 @@ from typing import Any, Dict, Optional
 
 from loguru import logger as AgentLogger
 from app.rag_services.helpers import ExtractionError
+from app.rag_apis.http_clients import get_http_client
+from app.rag_apis.rate_limiter import MAX_RATE_LIMIT_WAIT, acquire_rate_limit, get_rate_limiter
 #from dotenv import load_dotenv
 
 
@@ -54,43 +56,6 @@ API_KEYS = [
 
 
 MAX_RETRIES = 5
-RATE_LIMIT_BEHAVIOR = {"minute": "sleep", "hour": "switch", "day": "switch"}
-
-# ───────────────────────────────────────────────
-# Helpers
-# ───────────────────────────────────────────────
-def parse_rate_headers(headers):
-    parsed = {}
-    for k, v in headers.items():
-        kl = k.lower()
-        if "ratelimit" in kl:
-            try:
-                parsed[kl] = int(v)
-            except ValueError:
-                continue
-    if "ratelimit-remaining" in parsed:
-        parsed["x-ratelimit-remaining-minute"] = parsed["ratelimit-remaining"]
-    if "ratelimit-reset" in parsed:
-        parsed["x-ratelimit-reset-minute"] = parsed["ratelimit-reset"]
-    return parsed
-
-
-def decide_action(rate_headers):
-    remaining = {
-        "minute": rate_headers.get("x-ratelimit-remaining-minute"),
-        "hour": rate_headers.get("x-ratelimit-remaining-hour"),
-        "day": rate_headers.get("x-ratelimit-remaining-day"),
-    }
-    reset = {
-        "minute": rate_headers.get("x-ratelimit-reset-minute", rate_headers.get("ratelimit-reset")),
-        "hour": rate_headers.get("x-ratelimit-reset-hour", rate_headers.get("ratelimit-reset")),
-        "day": rate_headers.get("x-ratelimit-reset-day", rate_headers.get("ratelimit-reset")),
-    }
-
-    for scope, remain in remaining.items():
-        if remain is not None and remain <= 0:
-            return scope, RATE_LIMIT_BEHAVIOR.get(scope, "sleep"), reset.get(scope, 60)
-    return None, None, None
 
 
 # ───────────────────────────────────────────────
@@ -121,37 +86,27 @@ class DoclingClient:
             for attempt in range(total_attempts):
                 key = self._current_key()
 
-                try:
-                    async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-                        resp, headers = await self._call_docling(
-                            client,
-                            key,
-                            file_path,
-                            response_type,
-                            extract_tables_as_images,
-                            image_resolution_scale,
-                        )
-
-                    # Handle rate limits
-                    rate_headers = parse_rate_headers(headers)
-                    scope, action, reset = decide_action(rate_headers)
-
-                    if action == "sleep":
-                        reset = min(reset or 60, 60)
-                        AgentLogger.warning(
-                            "Rate limit reached, sleeping",
-                            extra={"scope": scope, "seconds": reset, "key": key[:6], "attempt": attempt + 1},
-                        )
-                        await asyncio.sleep(reset)
+                if len(self.keys) > 1 and get_rate_limiter(self.base_api, key).wait_time() > MAX_RATE_LIMIT_WAIT:
+                    # out for longer than a pacing pause (hour/day limit): move on instead of waiting
+                    AgentLogger.warning(
+                        "Rate limit — switching key",
+                        extra={"key": key[:6], "attempt": attempt + 1},
+                    )
+                    self._mark_key_limited(key)
+                    self._rotate_key()
+                    continue
 
-                    elif action == "switch":
-                        AgentLogger.warning(
-                            "Rate limit — switching key",
-                            extra={"scope": scope, "key": key[:6], "attempt": attempt + 1},
-                        )
-                        self._mark_key_limited(key)
-                        self._rotate_key()
-                        continue
+                try:
+                    # paced by the key's shared limiter, which learns the limits from the response headers
+                    await acquire_rate_limit(self.base_api, key)
+                    resp, headers = await self._call_docling(
+                        get_http_client(self.base_api, key),
+                        key,
+                        file_path,
+                        response_type,
+                        extract_tables_as_images,
+                        image_resolution_scale,
+                    )
 
                     AgentLogger.success(
                         "Docling conversion successful",
@@ -264,10 +219,10 @@ class DoclingClient:
             "image_resolution_scale": image_resolution_scale,
         }
 
-        files = {"document": (os.path.basename(file_path), open(file_path, "rb"))}
-
         AgentLogger.debug("Calling Docling convert API", extra={"url": url, "key": key[:6]})
-        resp = await client.post(url, headers=headers, params=params, files=files)
+        with open(file_path, "rb") as document:
+            files = {"document": (os.path.basename(file_path), document)}
+            resp = await client.post(url, headers=headers, params=params, files=files, timeout=TIMEOUT)
         resp.raise_for_status()
 
         try:
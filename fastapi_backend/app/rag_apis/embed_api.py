@@ -3,11 +3,15 @@ import os
 import asyncio
 import httpx
 
+from collections import OrderedDict
 from itertools import cycle
 from httpx import HTTPStatusError, RequestError
 
 from app.rag_apis.model_enums import EMBEDDING_SUBCATEGORIES
+from app.rag_apis.chat_api import _estimate_tokens
 from app.rag_services.helpers import ExtractionError
+from app.rag_apis.http_clients import get_http_client
+from app.rag_apis.rate_limiter import acquire_rate_limit, select_key
 from loguru import logger as AgentLogger
 
 from dotenv import load_dotenv
@@ -34,54 +38,102 @@ API_KEYS = [k for k in [
 ] if k]
 
 MAX_RETRIES = 5
-RATE_LIMIT_BEHAVIOR = {"minute": "sleep", "hour": "switch", "day": "switch"}
+
+# statuses of a model that exhausted its retries: the whole document moves to the next model
+MODEL_FALLBACK_STATUSES = (429, 500, 502)
+
+# Batching: large inputs are split by item count and estimated tokens, and up to
+# EMBEDDING_CONCURRENCY batches are in flight at once, spread over the key list
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 8000))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
 
 
 # -------------------------------------------------
 # Helpers
 # -------------------------------------------------
-def parse_rate_headers(headers):
-    parsed = {}
-    for k, v in headers.items():
-        kl = k.lower()
-        if "ratelimit" in kl:
-            try:
-                parsed[kl] = int(v)
-            except ValueError:
-                continue
-    if "ratelimit-remaining" in parsed and "x-ratelimit-remaining-minute" not in parsed:
-        parsed["x-ratelimit-remaining-minute"] = parsed["ratelimit-remaining"]
-    if "ratelimit-reset" in parsed and "x-ratelimit-reset-minute" not in parsed:
-        parsed["x-ratelimit-reset-minute"] = parsed["ratelimit-reset"]
-    return parsed
-
-
-def decide_action(rate_headers):
-    remaining = {
-        "minute": rate_headers.get("x-ratelimit-remaining-minute"),
-        "hour": rate_headers.get("x-ratelimit-remaining-hour"),
-        "day": rate_headers.get("x-ratelimit-remaining-day"),
-    }
-    reset = {
-        "minute": rate_headers.get("x-ratelimit-reset-minute", rate_headers.get("ratelimit-reset")),
-        "hour": rate_headers.get("x-ratelimit-reset-hour", rate_headers.get("ratelimit-reset")),
-        "day": rate_headers.get("x-ratelimit-reset-day", rate_headers.get("ratelimit-reset")),
-    }
-
-    for scope, remain in remaining.items():
-        if remain is not None and remain <= 0:
-            return scope, RATE_LIMIT_BEHAVIOR.get(scope, "sleep"), reset.get(scope, 60)
-    return None, None, None
+def split_batches(inputs: list[str], max_items: int, max_tokens: int) -> list[list[str]]:
+    """Consecutive batches within both limits; an input above max_tokens gets a batch of its own."""
+    batches, current, current_tokens = [], [], 0
+
+    for text in inputs:
+        tokens = _estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+
+        current.append(text)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+# -------------------------------------------------
+# Query embedding cache
+# -------------------------------------------------
+class QueryEmbeddingCache:
+    """Process-wide LRU of query embeddings keyed by (model label, text), with hit/miss counters."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, str]):
+        embedding = self._entries.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return embedding
+
+    def put(self, key: tuple[str, str], embedding: list[float]) -> None:
+        if self.maxsize <= 0:
+            return
+
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+
+QUERY_EMBEDDING_CACHE = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_SIZE)
 
 
 # -------------------------------------------------
 # Embedding Orchestrator
 # -------------------------------------------------
 class EmbeddingOrchestrator:
-    def __init__(self, base_api: str, user_key_list: list[str]):
+    def __init__(
+        self,
+        base_api: str,
+        user_key_list: list[str],
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+        max_concurrency: int = EMBEDDING_CONCURRENCY,
+    ):
+        self.keys = user_key_list
         self.key_cycle = cycle(user_key_list)
         self.base_api = base_api
         self.max_retries = MAX_RETRIES
+        self.batch_size = max(1, batch_size)
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.max_concurrency = max(1, max_concurrency)
         AgentLogger.info("EmbeddingOrchestrator initialized", extra={"keys": len(API_KEYS)})
 
     async def _safe_call(self, client, api_key, model, inputs, model_queue, failure_count, retry_num=0):
@@ -99,32 +151,14 @@ class EmbeddingOrchestrator:
         AgentLogger.debug("Calling embedding API", extra={"model": model.value, "key": api_key[:6], "retry": retry_num})
 
         try:
-            resp = await client.post(url, headers=headers, json=payload)
+            # paced by the key's shared limiter, which learns the limits from the response headers
+            await acquire_rate_limit(self.base_api, api_key)
+            resp = await client.post(url, headers=headers, json=payload, timeout=TIMEOUT)
             resp.raise_for_status()
 
             data = resp.json().get("data", [])
             embeds = [d["embedding"] for d in data]
 
-            # rate-limit handling
-            rate_headers = parse_rate_headers(resp.headers)
-            scope, action, reset = decide_action(rate_headers)
-
-            if action == "sleep":
-                reset = min(reset or 60, 60)
-                AgentLogger.warning(
-                    "Rate limit reached, sleeping",
-                    extra={"scope": scope, "seconds": reset, "model": model.value, "key": api_key[:6]},
-                )
-                await asyncio.sleep(reset)
-
-            elif action == "switch":
-                AgentLogger.warning(
-                    "Rate limit — switching key",
-                    extra={"scope": scope, "model": model.value, "key": api_key[:6]},
-                )
-                next_key = next(self.key_cycle)
-                return await self._safe_call(client, next_key, model, inputs, model_queue, failure_count)
-
             AgentLogger.success(
                 "Embedding retrieved successfully",
                 extra={"model": model.value, "key": api_key[:6]},
@@ -141,7 +175,7 @@ class EmbeddingOrchestrator:
                 )
                 try:
                     next_key = next(self.key_cycle)
-                    return await self._safe_call(client, next_key, model, inputs, model_queue, failure_count)
+                    return await self._safe_call(get_http_client(self.base_api, next_key), next_key, model, inputs, model_queue, failure_count)
                 except ExtractionError:
                     raise
                 except Exception as inner_e:
@@ -236,8 +270,34 @@ class EmbeddingOrchestrator:
                 status_code=500,
             ) from e
 
+    async def get_query_embedding(self, query: str, label="embeddings") -> list[float]:
+        """
+        Embed a single query, served from QUERY_EMBEDDING_CACHE when the label's first model embedded the same text before.
+        Entries are keyed on (model, text) of the model that answered, so a fallback result never stands in for it.
+        """
+        model_queue = EMBEDDING_SUBCATEGORIES.get(label)
+        key = (model_queue[0].value if model_queue else label, query)
+
+        embedding = QUERY_EMBEDDING_CACHE.get(key)
+        if embedding is None:
+            embeddings, model = await self.embed_document([query], label=label)
+            embedding = embeddings[0]
+            QUERY_EMBEDDING_CACHE.put((model, query), embedding)
+
+        AgentLogger.debug("Query embedding", extra={"label": label, **QUERY_EMBEDDING_CACHE.stats()})
+        return embedding
+
     async def get_embedding(self, inputs, label="embeddings"):
         """Get embeddings for given inputs (uses model queue for the specified label)."""
+        embeddings, _ = await self.embed_document(inputs, label=label)
+        return embeddings
+
+    async def embed_document(self, inputs, label="embeddings") -> tuple[list, str]:
+        """
+        Embed all inputs with a single model of the label's queue, so every vector shares one space.
+        Batches retry on their own; a batch that exhausts its retries moves the whole document to the next model.
+        Returns the embeddings and the value of the model that produced them.
+        """
         if isinstance(inputs, str):
             inputs = [inputs]
 
@@ -245,14 +305,40 @@ class EmbeddingOrchestrator:
             AgentLogger.error("Unknown embedding label", extra={"label": label})
             raise ValueError(f"Unknown embedding label: {label}")
 
+        batches = split_batches(inputs, self.batch_size, self.max_batch_tokens)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch, model):
+            # each batch has its own key and retries, so a transient failure doesn't restart the document
+            async with semaphore:
+                # picked once a slot is free, so the key with the most headroom at that moment gets the batch
+                api_key = select_key(self.base_api, self.keys)
+                # empty model queue: _safe_call raises instead of switching the model of this batch alone
+                return await self._safe_call(get_http_client(self.base_api, api_key), api_key, model, batch, [], {})
+
         model_queue = EMBEDDING_SUBCATEGORIES[label].copy()
-        current_model = model_queue.pop(0)
-        failure_count = {}
-        api_key = next(self.key_cycle)
+        while True:
+            model = model_queue.pop(0)
+            AgentLogger.debug("Running embedding pipeline", extra={"label": label, "model": model.value, "inputs": len(inputs), "batches": len(batches)})
+
+            tasks = [asyncio.ensure_future(embed_batch(batch, model)) for batch in batches]
+            try:
+                results = await asyncio.gather(*tasks)
+            except ExtractionError as e:
+                for task in tasks:
+                    task.cancel()
+
+                if e.status_code not in MODEL_FALLBACK_STATUSES or not model_queue:
+                    raise
+
+                AgentLogger.error(
+                    "Max retries exceeded — re-embedding the document with the next model",
+                    extra={"model": model.value, "next_model": model_queue[0].value, "code": e.status_code},
+                )
+                continue
 
-        AgentLogger.debug("Running embedding pipeline", extra={"label": label, "model": current_model.value})
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            return await self._safe_call(client, api_key, current_model, inputs, model_queue, failure_count)
+            # gather keeps batch order
+            return [embedding for batch_embeddings in results for embedding in batch_embeddings], model.value
 
 
 # -------------------------------------------------
@@ -0,0 +1,93 @@
+import os
+import asyncio
+
+import httpx
+
+from loguru import logger as AgentLogger
+from app.rag_apis.rate_limiter import observe_rate_limit
+
+# optional: HTTP/2 multiplexing needs h2 (the "http2" extra)
+try:
+    import h2
+except ImportError:  # pragma: no cover - depends on the "http2" extra
+    h2 = None
+
+
+# ───────────────────────────────────────────────
+# Config
+# ───────────────────────────────────────────────
+HTTP2_ENABLED = h2 is not None and os.getenv("HTTP2_ENABLED", "1") != "0"
+
+# per (base_api, api_key) pool; with HTTP/2 a single connection carries all concurrent streams
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60.0))
+
+# default only: every orchestrator passes its own TIMEOUT per request
+DEFAULT_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+LIMITS = httpx.Limits(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+)
+
+
+# ───────────────────────────────────────────────
+# Client registry
+# ───────────────────────────────────────────────
+_HTTP_CLIENTS: dict[tuple[str, str], httpx.AsyncClient] = {}
+# connections belong to the loop that opened them
+_POOL_LOOP: asyncio.AbstractEventLoop | None = None
+
+
+def _bind_loop() -> None:
+    global _POOL_LOOP
+    loop = asyncio.get_running_loop()
+
+    if _POOL_LOOP is not loop:
+        if _HTTP_CLIENTS:
+            # e.g. a script calling asyncio.run twice: the old loop is gone, so its connections are unusable
+            AgentLogger.debug("Event loop changed, dropping pooled HTTP clients", extra={"clients": len(_HTTP_CLIENTS)})
+            _HTTP_CLIENTS.clear()
+        _POOL_LOOP = loop
+
+
+def get_http_client(base_api: str, api_key: str) -> httpx.AsyncClient:
+    """
+    Shared keep-alive client for one (base_api, api_key) pair, created on first use.
+    Every response feeds the key's rate limiter. Callers must not close it; close_http_clients does that at shutdown.
+    """
+    _bind_loop()
+    key = (base_api.rstrip("/"), api_key)
+
+    client = _HTTP_CLIENTS.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=LIMITS,
+            timeout=DEFAULT_TIMEOUT,
+            follow_redirects=True,
+            event_hooks={"response": [observe_rate_limit(base_api, api_key)]},
+        )
+        _HTTP_CLIENTS[key] = client
+        AgentLogger.debug("Opened pooled HTTP client", extra={"base_api": key[0], "key": api_key[:6], "http2": HTTP2_ENABLED})
+
+    return client
+
+
+async def open_http_clients() -> None:
+    """Bind the registry to the application loop at startup; clients are then opened per key on first use."""
+    _bind_loop()
+    if h2 is None:
+        AgentLogger.info("h2 not installed, pooled HTTP clients use HTTP/1.1")
+    AgentLogger.info("HTTP client registry ready", extra={"http2": HTTP2_ENABLED, "max_connections": HTTP_MAX_CONNECTIONS})
+
+
+async def close_http_clients() -> None:
+    """Close every pooled client (application shutdown)."""
+    clients = list(_HTTP_CLIENTS.values())
+    _HTTP_CLIENTS.clear()
+
+    await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+    AgentLogger.info("Closed pooled HTTP clients", extra={"clients": len(clients)})
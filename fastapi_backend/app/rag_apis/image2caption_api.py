@@ -7,6 +7,8 @@ import httpx
 from itertools import cycle
 from app.rag_apis.model_enums import MULTIMODAL_SUBCATEGORIES
 from app.rag_services.helpers import ExtractionError
+from app.rag_apis.http_clients import get_http_client
+from app.rag_apis.rate_limiter import acquire_rate_limit, select_key
 from loguru import logger as AgentLogger
 
 # ───────────────────────────────────────────────
@@ -24,46 +26,6 @@ API_KEYS = [
 ]
 
 MAX_RETRIES = 5
-RATE_LIMIT_BEHAVIOR = {"minute": "sleep", "hour": "switch", "day": "switch"}
-
-
-# ───────────────────────────────────────────────
-# Helpers
-# ───────────────────────────────────────────────
-def parse_rate_headers(headers):
-    parsed = {}
-    for k, v in headers.items():
-        kl = k.lower()
-        if "ratelimit" in kl:
-            try:
-                parsed[kl] = int(v)
-            except ValueError:
-                continue
-    if "ratelimit-remaining" in parsed:
-        parsed["x-ratelimit-remaining-minute"] = parsed["ratelimit-remaining"]
-    if "ratelimit-reset" in parsed:
-        parsed["x-ratelimit-reset-minute"] = parsed["ratelimit-reset"]
-    return parsed
-
-
-def decide_action(rate_headers):
-    remaining = {
-        "minute": rate_headers.get("x-ratelimit-remaining-minute"),
-        "hour": rate_headers.get("x-ratelimit-remaining-hour"),
-        "day": rate_headers.get("x-ratelimit-remaining-day"),
-    }
-    reset = {
-        "minute": rate_headers.get("x-ratelimit-reset-minute", rate_headers.get("ratelimit-reset")),
-        "hour": rate_headers.get("x-ratelimit-reset-hour", rate_headers.get("ratelimit-reset")),
-        "day": rate_headers.get("x-ratelimit-reset-day", rate_headers.get("ratelimit-reset")),
-    }
-    for scope, remain in remaining.items():
-        if remain is not None and remain <= 0:
-            return scope, RATE_LIMIT_BEHAVIOR.get(scope, "sleep"), reset.get(scope, 60)
-    return None, None, None
-
-
-
 
 
 # ───────────────────────────────────────────────
@@ -72,6 +34,7 @@ def decide_action(rate_headers):
 class MultiModalVisionClient:
     def __init__(self, base_api: str, user_key_list: list[str]):
         self.base_api = base_api
+        self.keys = user_key_list
         self.key_cycle = cycle(user_key_list)
         self.max_retries = MAX_RETRIES
         AgentLogger.info("MultiModalVisionClient initialized", extra={"available_keys": len(API_KEYS)})
@@ -110,42 +73,14 @@ class MultiModalVisionClient:
         )
 
         try:
-            resp = await client.post(url, headers=headers, json=body)
+            # paced by the key's shared limiter, which learns the limits from the response headers
+            await acquire_rate_limit(self.base_api, api_key)
+            resp = await client.post(url, headers=headers, json=body, timeout=TIMEOUT)
             resp.raise_for_status()
 
             data = resp.json()
             answer = data["choices"][0]["message"]["content"]
 
-            # rate-limit handling
-            rate_headers = parse_rate_headers(resp.headers)
-            scope, action, reset = decide_action(rate_headers)
-
-            if action == "sleep":
-                reset = min(reset or 60, 60)
-                AgentLogger.warning(
-                    "Rate limit reached, sleeping",
-                    extra={"scope": scope, "seconds": reset, "model": model.value, "key": api_key[:6]},
-                )
-                await asyncio.sleep(reset)
-
-            elif action == "switch":
-                AgentLogger.warning(
-                    "Rate limit — switching key",
-                    extra={"scope": scope, "model": model.value, "key": api_key[:6]},
-                )
-                next_key = next(self.key_cycle)
-                return await self._safe_call(
-                    client,
-                    next_key,
-                    model,
-                    base64_img,
-                    question,
-                    model_queue,
-                    failure_count,
-                    retry_num=retry_num,
-                    base64_format=base64_format,
-                )
-
             AgentLogger.success(
                 "Image described successfully",
                 extra={"model": model.value, "key": api_key[:6]},
@@ -172,7 +107,7 @@ class MultiModalVisionClient:
                     next_key = next(self.key_cycle)
                     await asyncio.sleep(2 ** (retry_num % 4))
                     return await self._safe_call(
-                        client,
+                        get_http_client(self.base_api, next_key),
                         next_key,
                         model,
                         base64_img,
@@ -306,10 +241,10 @@ class MultiModalVisionClient:
         model_queue = MULTIMODAL_SUBCATEGORIES[label].copy()
         current_model = model_queue.pop(0)
         failure_count = {}
-        api_key = next(self.key_cycle)
+        api_key = select_key(self.base_api, self.keys)
 
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            return await self._safe_call(client, api_key, current_model, base64_img, question, model_queue, failure_count)
+        client = get_http_client(self.base_api, api_key)
+        return await self._safe_call(client, api_key, current_model, base64_img, question, model_queue, failure_count)
 
 
 # ───────────────────────────────────────────────
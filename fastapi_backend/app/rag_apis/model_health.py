@@ -0,0 +1,173 @@
+import os
+import math
+import time
+import statistics
+
+from collections import deque
+from dataclasses import dataclass, field
+
+from loguru import logger as AgentLogger
+
+
+# ───────────────────────────────────────────────
+# Config
+# ───────────────────────────────────────────────
+# weight of the newest call in the latency / error-rate averages
+HEALTH_EWMA_ALPHA = float(os.getenv("MODEL_HEALTH_ALPHA", 0.3))
+
+# consecutive failures that open a model's circuit, and how long it stays open before calls may probe it again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 3))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", 60.0))
+
+# recent latencies kept per model for percentiles (hedging delay)
+HEALTH_LATENCY_WINDOW = int(os.getenv("MODEL_HEALTH_LATENCY_WINDOW", 100))
+
+# an unmeasured model goes first at most once per interval, so a fast model that was never called gets measured; 0 disables it
+MODEL_EXPLORE_INTERVAL = float(os.getenv("MODEL_EXPLORE_INTERVAL", 300.0))
+
+
+# ───────────────────────────────────────────────
+# Per-model health
+# ───────────────────────────────────────────────
+@dataclass
+class ModelHealth:
+    """
+    Rolling health of one model: EWMA latency of successful calls, recent latencies, EWMA error rate and a circuit breaker.
+    closed: normal. open: skipped. half_open: cooldown over, a single probe call goes through while the others still see
+    the circuit open; its success closes it, its failure reopens it.
+    """
+    latency: float | None = None
+    error_rate: float = 0.0
+    failures: int = 0
+    opened_at: float = 0.0
+    explored_at: float | None = None
+    probe_at: float | None = None
+    latencies: deque = field(default_factory=lambda: deque(maxlen=HEALTH_LATENCY_WINDOW))
+
+    def state(self, now: float) -> str:
+        if self.failures < CIRCUIT_FAILURE_THRESHOLD:
+            return "closed"
+        if now - self.opened_at < CIRCUIT_COOLDOWN:
+            return "open"
+        # a probe in flight; one that never resolves (not sent, cancelled) is given up after another cooldown
+        if self.probe_at is not None and now - self.probe_at < CIRCUIT_COOLDOWN:
+            return "open"
+        return "half_open"
+
+    def acquire(self, now: float) -> bool:
+        """False while the circuit is open; in half_open the caller becomes the probe."""
+        state = self.state(now)
+        if state == "half_open":
+            self.probe_at = now
+        return state != "open"
+
+    def expected_latency(self, prior: float = float("inf")) -> float:
+        """Latency to a successful answer, counting the calls lost to errors; the prior for an unmeasured model."""
+        if self.latency is None:
+            return prior
+        return self.latency / max(1.0 - self.error_rate, 0.1)
+
+    def latency_percentile(self, q: float, min_samples: int = 1) -> float | None:
+        """Nearest-rank percentile of the recent latencies; None below min_samples."""
+        if len(self.latencies) < max(1, min_samples):
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    def record_latency(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else HEALTH_EWMA_ALPHA * latency + (1 - HEALTH_EWMA_ALPHA) * self.latency
+        self.latencies.append(latency)
+
+    def record_latency_bound(self, latency: float) -> None:
+        # percentiles only: the call has no outcome, so the EWMA of answered calls is left alone
+        self.latencies.append(latency)
+
+    def record_success(self, latency: float) -> None:
+        self.record_latency(latency)
+        self.error_rate *= 1 - HEALTH_EWMA_ALPHA
+        self.failures = 0
+        self.probe_at = None
+
+    def record_failure(self, now: float) -> bool:
+        """Returns True when this failure opens (or reopens) the circuit."""
+        self.error_rate = HEALTH_EWMA_ALPHA + (1 - HEALTH_EWMA_ALPHA) * self.error_rate
+        self.failures += 1
+        self.probe_at = None
+
+        if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.opened_at = now
+            return True
+        return False
+
+
+# ───────────────────────────────────────────────
+# Process-wide registry
+# ───────────────────────────────────────────────
+_MODEL_HEALTH: dict[tuple[str, str], ModelHealth] = {}
+
+
+def get_model_health(base_api: str, model) -> ModelHealth:
+    key = (base_api.rstrip("/"), model.value)
+    health = _MODEL_HEALTH.get(key)
+    if health is None:
+        health = _MODEL_HEALTH[key] = ModelHealth()
+    return health
+
+
+def record_model_success(base_api: str, model, latency: float) -> None:
+    get_model_health(base_api, model).record_success(latency)
+
+
+def record_model_latency(base_api: str, model, latency: float) -> None:
+    """A latency without an outcome, e.g. the lower bound of a call cancelled by a faster hedge."""
+    get_model_health(base_api, model).record_latency_bound(latency)
+
+
+def record_model_failure(base_api: str, model) -> None:
+    health = get_model_health(base_api, model)
+    if health.record_failure(time.monotonic()):
+        AgentLogger.warning(
+            "Circuit open — skipping model",
+            extra={"model": model.value, "failures": health.failures, "cooldown": CIRCUIT_COOLDOWN},
+        )
+
+
+def acquire_model(base_api: str, model) -> bool:
+    """Whether a call may use the model now: not while its circuit is open, and only one probe while it is half open."""
+    return get_model_health(base_api, model).acquire(time.monotonic())
+
+
+def rank_models(base_api: str, models: list) -> tuple[list, list]:
+    """
+    Split a model queue into (available, open): available models fastest first by expected latency,
+    label order among equals; models with an open circuit keep their order and come back only as a last resort.
+    Unmeasured models rank at the median of the measured ones, and one of them is explored first per MODEL_EXPLORE_INTERVAL.
+    """
+    now = time.monotonic()
+    available, skipped = [], []
+
+    for model in models:
+        health = get_model_health(base_api, model)
+        # a half-open model is probed by this caller; concurrent callers skip it until the probe resolves
+        (available if health.acquire(now) else skipped).append(model)
+
+    measured = [get_model_health(base_api, model).expected_latency() for model in available if get_model_health(base_api, model).latency is not None]
+    if not measured:
+        # nothing to compare against: the label's priority order
+        return available, skipped
+
+    # optimistic prior: an unmeasured model ranks like a typical measured one, not after all of them.
+    # sorted is stable: label order among equals
+    prior = statistics.median(measured)
+    available.sort(key=lambda model: get_model_health(base_api, model).expected_latency(prior))
+
+    for model in available:
+        health = get_model_health(base_api, model)
+        if MODEL_EXPLORE_INTERVAL > 0 and health.latency is None and (health.explored_at is None or now - health.explored_at >= MODEL_EXPLORE_INTERVAL):
+            health.explored_at = now
+            available.remove(model)
+            available.insert(0, model)
+            AgentLogger.debug("Exploring unmeasured model", extra={"model": model.value})
+            break
+
+    return available, skipped
@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+
+from dataclasses import dataclass
+from itertools import count
+
+from loguru import logger as AgentLogger
+
+
+# ───────────────────────────────────────────────
+# Config
+# ───────────────────────────────────────────────
+# window of every rate-limit scope the providers report, in seconds
+SCOPE_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# longest a single request waits for its key; past it the request goes out and the 429 handling takes over
+MAX_RATE_LIMIT_WAIT = float(os.getenv("MAX_RATE_LIMIT_WAIT", 60.0))
+
+
+# ───────────────────────────────────────────────
+# Helpers
+# ───────────────────────────────────────────────
+def parse_rate_headers(headers) -> dict[str, int]:
+    """Integer rate-limit headers, lower-cased; the unscoped ratelimit-* headers count as the minute scope."""
+    parsed = {}
+    for k, v in headers.items():
+        kl = k.lower()
+        if "ratelimit" in kl or kl == "retry-after":
+            try:
+                parsed[kl] = int(v)
+            except ValueError:
+                continue
+    for field in ("limit", "remaining", "reset"):
+        if f"ratelimit-{field}" in parsed and f"x-ratelimit-{field}-minute" not in parsed:
+            parsed[f"x-ratelimit-{field}-minute"] = parsed[f"ratelimit-{field}"]
+    return parsed
+
+
+# ───────────────────────────────────────────────
+# Token bucket
+# ───────────────────────────────────────────────
+@dataclass
+class TokenBucket:
+    """One scope of a key: holds up to `capacity` requests and refills at capacity / window."""
+    capacity: float
+    rate: float
+    tokens: float
+    updated: float
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Limits of one (base_api, key), learned from the rate-limit headers of its responses.
+    Until a provider reports a limit the key is unthrottled; afterwards requests are paced to the refill rate
+    instead of running into 429s. Waiters on a key are served in arrival order.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.buckets: dict[str, TokenBucket] = {}
+        self.blocked_until = 0.0
+        self.last_selected = 0
+        self._lock: asyncio.Lock | None = None
+        self._lock_loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        # a lock belongs to one event loop
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
+
+    def observe(self, headers, status_code: int = 200) -> None:
+        """Update the buckets from one response."""
+        parsed = parse_rate_headers(headers)
+        now = time.monotonic()
+
+        for scope, seconds in SCOPE_SECONDS.items():
+            limit = parsed.get(f"x-ratelimit-limit-{scope}")
+            remaining = parsed.get(f"x-ratelimit-remaining-{scope}")
+            reset = parsed.get(f"x-ratelimit-reset-{scope}")
+
+            bucket = self.buckets.get(scope)
+            if limit and limit > 0:
+                if bucket is None:
+                    bucket = self.buckets[scope] = TokenBucket(limit, limit / seconds, limit, now)
+                bucket.refill(now)
+                bucket.capacity, bucket.rate = limit, limit / seconds
+
+            if remaining is None:
+                continue
+
+            if bucket is not None:
+                # the provider's count already includes every request it has seen
+                bucket.tokens = min(bucket.tokens, remaining)
+            if remaining <= 0 and reset:
+                self.blocked_until = max(self.blocked_until, now + reset)
+
+        retry_after = parsed.get("retry-after")
+        if status_code == 429 and retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def wait_time(self) -> float:
+        """Seconds until this key may send its next request."""
+        now = time.monotonic()
+        waits = [bucket.wait(now) for bucket in self.buckets.values()]
+        return max([self.blocked_until - now, 0.0, *waits])
+
+    async def acquire(self) -> None:
+        """Wait for a request slot (at most MAX_RATE_LIMIT_WAIT) and take it."""
+        async with self._get_lock():
+            wait = self.wait_time()
+            if wait > 0:
+                AgentLogger.debug("Pacing request to rate limit", extra={"key": self.name, "seconds": round(wait, 2)})
+                await asyncio.sleep(min(wait, MAX_RATE_LIMIT_WAIT))
+
+            now = time.monotonic()
+            for bucket in self.buckets.values():
+                bucket.refill(now)
+                bucket.tokens = max(0.0, bucket.tokens - 1)
+
+
+# ───────────────────────────────────────────────
+# Process-wide registry
+# ───────────────────────────────────────────────
+_RATE_LIMITERS: dict[tuple[str, str], RateLimiter] = {}
+_SELECTIONS = count(1)
+
+
+def get_rate_limiter(base_api: str, api_key: str) -> RateLimiter:
+    key = (base_api.rstrip("/"), api_key)
+    limiter = _RATE_LIMITERS.get(key)
+    if limiter is None:
+        limiter = _RATE_LIMITERS[key] = RateLimiter(api_key[:6])
+    return limiter
+
+
+async def acquire_rate_limit(base_api: str, api_key: str) -> None:
+    await get_rate_limiter(base_api, api_key).acquire()
+
+
+def observe_rate_limit(base_api: str, api_key: str):
+    """httpx response hook feeding a key's limiter; installed on every pooled client."""
+    limiter = get_rate_limiter(base_api, api_key)
+
+    async def hook(response) -> None:
+        limiter.observe(response.headers, response.status_code)
+
+    return hook
+
+
+def select_key(base_api: str, keys: list[str]) -> str:
+    """The key that can send soonest; among equally free keys the least recently used, so load spreads over all keys."""
+    def priority(api_key: str) -> tuple[float, int]:
+        limiter = get_rate_limiter(base_api, api_key)
+        return limiter.wait_time(), limiter.last_selected
+
+    api_key = min(keys, key=priority)
+    get_rate_limiter(base_api, api_key).last_selected = next(_SELECTIONS)
+    return api_key
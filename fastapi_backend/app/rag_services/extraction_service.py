@@ -11,6 +11,7 @@ from app.rag_apis.chat_api import ChatOrchestrator
 
 # helpers for disc paths
 from app.rag_services.helpers import get_doc_paths, get_log_path, get_doc_title, get_user_api_keys, log_pipeline_methods, ExtractionError
+from app.rag_services.keyword_index import invalidate_corpus_statistics
 
 #loggs
 from app.log_generator import InfoLogger
@@ -198,6 +199,8 @@ class Extractor:
 
         await self.db.commit()
 
+        invalidate_corpus_statistics(self.project_id, self.output_level)
+
 
 
 
@@ -300,16 +303,16 @@ class Enricher:
         self.chat_orchestrator = ChatOrchestrator(user_key_list=user_key_list,  base_api="https://chat-ai.academiccloud.de/v1")
 
 
-    def _call_orchestrator(self, system_prompt, user_prompt):
+    async def _call_orchestrator(self, system_prompt, user_prompt):
         if self.do_history:
-            chat_output = self.chat_orchestrator.call_with_history(
+            chat_output = await self.chat_orchestrator.call_with_history(
                 label=self.model,
                 system_prompt=system_prompt,
                 user_prompt=user_prompt,
                 history=self.history,
             )
         else:
-            chat_output = self.chat_orchestrator.call(
+            chat_output = await self.chat_orchestrator.call(
                 label=self.model,
                 system_prompt=system_prompt,
                 user_prompt=user_prompt,
@@ -348,7 +351,7 @@ class Enricher:
         return output_string
 
 
-    def _enrich_chunk(self, chunk: str) -> Any:
+    async def _enrich_chunk(self, chunk: str) -> Any:
         """
         self.prompt stays fully dynamic.
         Example self.prompt:
@@ -387,7 +390,7 @@ class Enricher:
         """.strip()
 
 
-        new_content = self._call_orchestrator(system_prompt, user_prompt)
+        new_content = await self._call_orchestrator(system_prompt, user_prompt)
 
         self.logger.log_step(task="info_text", log_text=f"new_content: {new_content}")
         # Caption and Position Logic
@@ -437,7 +440,7 @@ class Enricher:
             if not old_content:
                 continue
 
-            new_content = self._enrich_chunk(old_content)
+            new_content = await self._enrich_chunk(old_content)
 
             await Retrieval.update_data(
                 data_dict={"content": new_content},
@@ -451,6 +454,8 @@ class Enricher:
                 db=self.db
             )
 
+        invalidate_corpus_statistics(self.project_id, self.input_level)
+
 
 
 
@@ -527,10 +532,10 @@ class Filter:
 
 
 
-    def _call_orchestrator(self, user_prompt, system_prompt):
+    async def _call_orchestrator(self, user_prompt, system_prompt):
         if self.do_history:
 
-            chat_output = self.chat_orchestrator.call_with_history(label=self.model, system_prompt=system_prompt,
+            chat_output = await self.chat_orchestrator.call_with_history(label=self.model, system_prompt=system_prompt,
                                                          user_prompt=user_prompt, history=self.history)
 
             #self.logger.log_step(task="info_text", log_text=f"Unwrapping following answer: {chat_output}")
@@ -543,7 +548,7 @@ class Filter:
 
 
         else:
-            chat_output = self.chat_orchestrator.call(label=self.model, system_prompt=system_prompt, user_prompt=user_prompt)
+            chat_output = await self.chat_orchestrator.call(label=self.model, system_prompt=system_prompt, user_prompt=user_prompt)
             #self.logger.log_step(task="info_text", log_text=f"Unwrapping following answer: {chat_output}")
 
             output_bool = self.extract_bool(chat_output)
@@ -554,7 +559,7 @@ class Filter:
 
 
 
-    def _decide_relevance(self, input_chunk):
+    async def _decide_relevance(self, input_chunk):
         """
                 Rewrites image content with paragraphs describing it - if it aligns with the main topic of the file. Otherwise, it removes it.
                 Should remove descriptions of logos and layout symbols
@@ -617,7 +622,7 @@ class Filter:
                 """.strip()
 
 
-        bool_output = self._call_orchestrator(user_prompt, system_prompt)
+        bool_output = await self._call_orchestrator(user_prompt, system_prompt)
 
         return bool_output
 
@@ -645,7 +650,7 @@ class Filter:
         for input_id in input_ids:
             content = content_by_id.get(input_id, "")
 
-            is_relevant = self._decide_relevance(content)
+            is_relevant = await self._decide_relevance(content)
 
             if not is_relevant:
                 await Retrieval.delete_data(
@@ -660,6 +665,8 @@ class Filter:
                 )
                 self.logger.log_step(task="info_text", layer=1, log_text=f"Removed chunk:\n {content}\n")
 
+        invalidate_corpus_statistics(self.project_id, self.input_level)
+
 
 
 
@@ -695,6 +702,8 @@ class Reseter:
         await self.db.execute(stmt)
         await self.db.commit()
 
+        invalidate_corpus_statistics(self.project_id, self.level)
+
 
 
 
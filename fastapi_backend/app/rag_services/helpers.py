@@ -1,9 +1,11 @@
 import os
+import hashlib
 from pathlib import Path
 # Database ops
+from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import DocPipelines
+from app.models import DocPipelines, Retrieval, EmbeddingCache
 
 #logs
 from app.log_generator import InfoLogger
@@ -99,6 +101,81 @@ async def get_doc_paths(user_id: UUID, project_id: UUID, doc_id: UUID, db: Async
 
 
 
+def get_doc_dir(user_id: UUID, doc_id: UUID) -> Path:
+    # same layout as the upload route: shared-data/uploads/<user_id>/<doc_id>/
+    return Path("shared-data/uploads") / str(user_id) / str(doc_id)
+
+
+def get_embedding_paths(user_id: UUID, project_id: UUID, doc_id: UUID, level: str, dtype: str = "float32") -> tuple[Path, Path]:
+    # compact (quantized) matrices share the ids sidecar of the float32 matrix;
+    # ".unit" marks L2-normalized rows (legacy matrices are converted by migration e5a2b8c61d07)
+    embedding_dir = get_doc_dir(user_id, doc_id) / "embeddings"
+    suffix = "" if dtype == "float32" else f".{dtype}"
+    matrix_path = embedding_dir / f"{project_id}_{level}.unit{suffix}.npy"
+    ids_path = embedding_dir / f"{project_id}_{level}.ids.npy"
+
+    return matrix_path, ids_path
+
+
+def get_keyword_index_path(user_id: UUID, project_id: UUID, doc_id: UUID, level: str) -> Path:
+    # BM25 inverted index, see keyword_index.write_inverted_index
+    return get_doc_dir(user_id, doc_id) / "embeddings" / f"{project_id}_{level}.bm25.npz"
+
+
+def get_hierarchy_path(user_id: UUID, project_id: UUID, doc_id: UUID) -> Path:
+    # parent -> child adjacency of all levels of the document, see vector_store.write_hierarchy
+    return get_doc_dir(user_id, doc_id) / "embeddings" / f"{project_id}.hierarchy.npz"
+
+
+def get_index_dir(user_id: UUID, project_id: UUID) -> Path:
+    # project-wide indexes (router level) are not tied to a single upload
+    return Path("shared-data/indexes") / str(user_id) / str(project_id)
+
+
+def get_index_paths(user_id: UUID, project_id: UUID, level: str) -> tuple[Path, Path]:
+    index_dir = get_index_dir(user_id, project_id)
+    index_path = index_dir / f"{level}.hnsw"
+    meta_path = index_dir / f"{level}.hnsw.meta.npz"
+
+    return index_path, meta_path
+
+
+
+
+# ====== EMBEDDING CACHE ======
+
+
+def content_hash(text: str) -> str:
+    # EmbeddingCache key of a chunk
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def delete_cached_embeddings(user_id: UUID, project_id: UUID, db: AsyncSession, batch_size: int = 500) -> None:
+    """
+    Delete the EmbeddingCache rows of the project's chunks that no other project of the user still contains.
+    Must run before the project's Retrievals are deleted. Does not commit.
+    """
+    result = await db.execute(
+        select(Retrieval.content).where(Retrieval.user_id == user_id, Retrieval.project_id == project_id, Retrieval.content.is_not(None)).distinct()
+    )
+    contents = list(result.scalars().all())
+
+    for start in range(0, len(contents), batch_size):
+        batch = contents[start:start + batch_size]
+
+        # identical content in another project shares the cached vector
+        result = await db.execute(
+            select(Retrieval.content).where(Retrieval.user_id == user_id, Retrieval.project_id != project_id, Retrieval.content.in_(batch)).distinct()
+        )
+        shared = set(result.scalars().all())
+
+        hashes = [content_hash(content) for content in batch if content not in shared]
+        if hashes:
+            await EmbeddingCache.bulk_delete_data(where_dict={"user_id": user_id, "content_hash": hashes}, db=db)
+
+
+
+
 async def get_doc_title(user_id: UUID, project_id: UUID, doc_id: UUID, db: AsyncSession):
     if doc_id is None:
         raise LookupError("No DocPipelines row found for doc_id=None")
@@ -22,6 +22,7 @@ from app.rag_services.extraction_service import Enricher, Filter
 # helpers for disc paths
 
 from app.rag_services.helpers import get_doc_paths, get_log_path, get_doc_title, get_user_api_keys, log_pipeline_methods, ExtractionError
+from app.rag_services.keyword_index import invalidate_corpus_statistics
 
 
 #logs
@@ -539,9 +540,9 @@ class ItemEnricher:
 
 
 
-    def _call_orchestrator(self, system_prompt, user_prompt):
+    async def _call_orchestrator(self, system_prompt, user_prompt):
         if self.do_history:
-            chat_output = self.chat_orchestrator.call_with_history(label=self.model, system_prompt=system_prompt,
+            chat_output = await self.chat_orchestrator.call_with_history(label=self.model, system_prompt=system_prompt,
                                                          user_prompt=user_prompt, history=self.history)
 
             output_string = self.unwrap_answer(chat_output)
@@ -551,14 +552,14 @@ class ItemEnricher:
                              {"role": "assistant", "content": output_string}]
 
         else:
-            chat_output = self.chat_orchestrator.call(label=self.model, system_prompt=system_prompt,
+            chat_output = await self.chat_orchestrator.call(label=self.model, system_prompt=system_prompt,
                                             user_prompt=user_prompt)
 
             output_string = self.unwrap_answer(chat_output)
 
         return output_string
 
-    def _enrich_chunk(self, chunk: str) -> str:
+    async def _enrich_chunk(self, chunk: str) -> str:
         # Qwen3-Coder is explicitly an instruction-tuned coder model, so its usage profile lines up with OpenAIs mini line
 
         system_prompt = f"""
@@ -592,7 +593,7 @@ class ItemEnricher:
                 ---
                 """.strip()
 
-        enriched_output = self._call_orchestrator(system_prompt, user_prompt)
+        enriched_output = await self._call_orchestrator(system_prompt, user_prompt)
 
         return enriched_output
 
@@ -601,7 +602,7 @@ class ItemEnricher:
 
 
 
-    def process_items(self, i, line, output_dict):
+    async def process_items(self, i, line, output_dict):
 
         if i in self.item_lines:
             # update actual paragraph for next iteration
@@ -613,7 +614,7 @@ class ItemEnricher:
             self.current_chunk = self.current_chunk.replace(self.starting_mark, "", 1).replace(self.ending_mark, "", 1)
 
             # process item into readable text
-            explained_item = self._enrich_chunk(self.current_chunk)
+            explained_item = await self._enrich_chunk(self.current_chunk)
 
 
             output_dict["text"] += f"{explained_item}\n"
@@ -628,11 +629,11 @@ class ItemEnricher:
 
 
 
-    def process_last_item(self, output_dict):
+    async def process_last_item(self, output_dict):
         if self.current_chunk:
             self.current_chunk = self.current_chunk.replace(self.starting_mark, "", 1).replace(self.ending_mark, "", 1)
 
-            explained_item = self._enrich_chunk(self.current_chunk)
+            explained_item = await self._enrich_chunk(self.current_chunk)
 
             output_dict["text"] += f"{explained_item}\n"
 
@@ -668,14 +669,14 @@ class ItemEnricher:
         start = time.time()
         for i, line in enumerate(lines):
 
-            is_item = self.process_items(i, line, output_dict)
+            is_item = await self.process_items(i, line, output_dict)
             if is_item:
                 continue
 
             output_dict["text"] += f"{line}\n"
 
         # In case that the last paragraph still belongs to an item, save this item
-        self.process_last_item(output_dict)
+        await self.process_last_item(output_dict)
 
         end = time.time()
 
@@ -759,10 +760,10 @@ class ItemFilter:
         self.chat_orchestrator = ChatOrchestrator(user_key_list=user_key_list,
                                                   base_api="https://chat-ai.academiccloud.de/v1")
 
-    def _call_orchestrator(self, user_prompt, system_prompt):
+    async def _call_orchestrator(self, user_prompt, system_prompt):
         if self.do_history:
 
-            chat_output = self.chat_orchestrator.call_with_history(label=self.model, system_prompt=system_prompt,
+            chat_output = await self.chat_orchestrator.call_with_history(label=self.model, system_prompt=system_prompt,
                                                                    user_prompt=user_prompt, history=self.history)
 
             # self.logger.log_step(task="info_text", log_text=f"Unwrapping following answer: {chat_output}")
@@ -773,7 +774,7 @@ class ItemFilter:
                              {"role": "assistant", "content": str(output_bool)}]
 
         else:
-            chat_output = self.chat_orchestrator.call(label=self.model, system_prompt=system_prompt,
+            chat_output = await self.chat_orchestrator.call(label=self.model, system_prompt=system_prompt,
                                                       user_prompt=user_prompt)
             # self.logger.log_step(task="info_text", log_text=f"Unwrapping following answer: {chat_output}")
 
@@ -781,7 +782,7 @@ class ItemFilter:
 
         return output_bool
 
-    def _decide_relevance(self, input_chunk):
+    async def _decide_relevance(self, input_chunk):
         """
                 Rewrites image content with paragraphs describing it - if it aligns with the main topic of the file. Otherwise, it removes it.
                 Should remove descriptions of logos and layout symbols
@@ -818,7 +819,7 @@ class ItemFilter:
 
         # self.logger.log_step(task="info_text", layer=1, log_text=f"Starting to filter following chunk: {input_chunk}")
 
-        bool_output = self._call_orchestrator(user_prompt, system_prompt)
+        bool_output = await self._call_orchestrator(user_prompt, system_prompt)
 
         return bool_output
 
@@ -826,7 +827,7 @@ class ItemFilter:
 
 
 
-    def process_items(self, i, line, output_dict):
+    async def process_items(self, i, line, output_dict):
 
         if i in self.item_lines:
             # update actual paragraph for next iteration
@@ -837,7 +838,7 @@ class ItemFilter:
 
             input_chunk = self.current_chunk.replace(self.starting_mark, "", 1).replace(self.ending_mark, "", 1)
 
-            is_relevant = self._decide_relevance(input_chunk)
+            is_relevant = await self._decide_relevance(input_chunk)
 
             if is_relevant:
                 output_dict["text"] += f"{self.current_chunk}\n"
@@ -853,9 +854,9 @@ class ItemFilter:
 
 
 
-    def process_last_item(self, output_dict):
+    async def process_last_item(self, output_dict):
         if self.current_chunk:
-            is_relevant = self._decide_relevance(self.current_chunk)
+            is_relevant = await self._decide_relevance(self.current_chunk)
 
             if is_relevant:
                 output_dict["text"] += f"{self.current_chunk}\n"
@@ -901,14 +902,14 @@ class ItemFilter:
             #if not line:
                 #continue
 
-            is_item = self.process_items(i, line, output_dict)
+            is_item = await self.process_items(i, line, output_dict)
             if is_item:
                 continue
 
             output_dict["text"] += f"{line}\n"
 
         # In case that the last paragraph still belongs to an item, save this item
-        self.process_last_item(output_dict)
+        await self.process_last_item(output_dict)
 
         end = time.time()
 
@@ -1224,6 +1225,9 @@ async def run_chunking(pipeline: list[dict[str, Any]], user_id: UUID, project_id
     first_pipeline_args = {**runner_args, "method_list": pipeline}
     await run_chunking_pipeline(**first_pipeline_args)
 
+    # every level of the document was re-created
+    invalidate_corpus_statistics(project_id)
+
 
 
 
@@ -1414,5 +1418,7 @@ async def update_chunking_results(
 
             await Retrieval.update_data(data_dict=data_dict, where_dict=row, db=db)
 
+        invalidate_corpus_statistics(project_id, level)
+
 
 
@@ -0,0 +1,663 @@
+import math
+import os
+import re
+from collections import Counter, OrderedDict, defaultdict
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from loguru import logger as AgentLogger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+
+# ---------------------------------------------
+
+# ------------ BM25 INVERTED INDEX ------------
+
+# ---------------------------------------------
+
+# Each exported (project, doc, level) of a BM25Retriever gets <project_id>_<level>.bm25.npz next to the embeddings:
+#   terms      sorted vocabulary
+#   term_ptr   int64 (n_terms + 1), the postings of terms[i] are post_rows / post_tf[term_ptr[i]:term_ptr[i + 1]]
+#   post_rows  row of each posting, ascending within a term
+#   post_tf    term frequency of each posting
+#   doc_lens   token count of each row
+#   ids        int64 retrieval_ids, row i <-> ids[i]
+#
+# Block-max metadata for dynamic pruning: rows are cut into ranges of BLOCK_ROWS, and the postings of each term
+# inside one range form a block, with the largest term frequency and the shortest row of that block:
+#   blk_ptr       int64 (n_terms + 1), the blocks of terms[i] are blk_ptr[i]:blk_ptr[i + 1]
+#   blk_range     row range of each block
+#   blk_post_ptr  int64 (n_blocks + 1), the postings of block j are blk_post_ptr[j]:blk_post_ptr[j + 1]
+#   blk_max_tf    largest term frequency in the block
+#   blk_min_len   shortest row in the block
+#
+# Levels of up to CSR_MAX_ROWS rows also store the term-document matrix of BM25 weights for the exported k1 / b,
+# in CSR form on the postings above (row pointer term_ptr, column indices post_rows):
+#   weights        float64 BM25 weight of each posting, over all rows of the level
+#   weight_params  float64 [k1, b]
+#
+# Integer arrays use the smallest unsigned dtype that fits; the file is loaded on first use and cached per mtime.
+
+
+_TOKEN_PATTERN = re.compile(r"\b\w+\b")
+
+BLOCK_ROWS = 64
+
+# relative slack on the block upper bounds, covers float rounding from summing them in a different order than the scores
+_BOUND_SLACK = 1e-9
+
+# weight matrices are exported up to CSR_MAX_ROWS rows (dense score rows stay cheap, batches of queries pay off);
+# single top-k queries use them up to CSR_QUERY_MAX_ROWS, above that block-max pruning is faster
+# (see benchmarks/bench_bm25_search.py)
+CSR_MAX_ROWS = 100_000
+CSR_QUERY_MAX_ROWS = 20_000
+
+_INDEX_ARRAYS = ("terms", "term_ptr", "post_rows", "post_tf", "doc_lens", "ids")
+_BLOCK_ARRAYS = ("blk_ptr", "blk_range", "blk_post_ptr", "blk_max_tf", "blk_min_len")
+
+# path -> (mtime_ns, index)
+_INDEXES: dict[str, tuple[int, "InvertedIndex"]] = {}
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    # simple whitespace + punctuation tokenizer, shared by export and query time
+    return _TOKEN_PATTERN.findall((text or "").lower())
+
+
+class InvertedIndex:
+
+    def __init__(self, terms: np.ndarray, term_ptr: np.ndarray, post_rows: np.ndarray, post_tf: np.ndarray, doc_lens: np.ndarray, ids: np.ndarray, blocks: Optional[dict[str, np.ndarray]] = None):
+        self.terms = terms
+        self.term_ptr = term_ptr
+        self.post_rows = post_rows
+        self.post_tf = post_tf
+        self.doc_lens = doc_lens
+        self.ids = ids
+
+        # indexes exported before block-max pruning get their blocks computed here
+        blocks = blocks or _build_blocks(term_ptr, post_rows, post_tf, doc_lens)
+        self.blk_ptr = blocks["blk_ptr"]
+        self.blk_range = blocks["blk_range"]
+        self.blk_post_ptr = blocks["blk_post_ptr"]
+        self.blk_max_tf = blocks["blk_max_tf"]
+        self.blk_min_len = blocks["blk_min_len"]
+
+        self.weights: Optional[np.ndarray] = None
+        self.weight_params: Optional[np.ndarray] = None
+
+    @property
+    def n_ranges(self) -> int:
+        return -(-len(self.ids) // BLOCK_ROWS)
+
+    def term_id(self, term: str) -> Optional[int]:
+        i = int(np.searchsorted(self.terms, term))
+        if i >= len(self.terms) or self.terms[i] != term:
+            return None
+        return i
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (rows, term frequencies) of a term, empty if it does not occur.
+        """
+        i = self.term_id(term)
+        if i is None:
+            return self.post_rows[:0], self.post_tf[:0]
+
+        start, end = self.term_ptr[i], self.term_ptr[i + 1]
+
+        return self.post_rows[start:end], self.post_tf[start:end]
+
+    def block_postings(self, term: str, ranges: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (rows, term frequencies) of a term inside the selected row ranges (boolean mask over n_ranges).
+        Only the postings of the matching blocks are read.
+        """
+        i = self.term_id(term)
+        if i is None:
+            return self.post_rows[:0], self.post_tf[:0]
+
+        block_ids = np.arange(self.blk_ptr[i], self.blk_ptr[i + 1])
+        block_ids = block_ids[ranges[self.blk_range[block_ids]]]
+
+        starts = self.blk_post_ptr[block_ids]
+        lengths = self.blk_post_ptr[block_ids + 1] - starts
+
+        # concatenated aranges of the block slices
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+
+        return self.post_rows[offsets], self.post_tf[offsets]
+
+    def block_arrays(self) -> dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in _BLOCK_ARRAYS}
+
+    def has_weights(self, k1: float, b: float) -> bool:
+        return self.weights is not None and self.weight_params.tolist() == [k1, b]
+
+    def set_weights(self, k1: float, b: float) -> None:
+        """
+        Precompute the BM25 weight of every posting, with N, df and avgdl over all rows of the level.
+        The float operations are those of a per-document scan, so scores summed from these weights are identical.
+        """
+        n_docs = len(self.ids)
+        avgdl = int(self.doc_lens.sum()) / n_docs if n_docs else 0.0
+
+        df = np.diff(self.term_ptr)
+        idf = np.array([math.log(1 + (n_docs - freq + 0.5) / (freq + 0.5)) for freq in df.tolist()], dtype=np.float64)
+
+        freq = self.post_tf.astype(np.float64)
+        dl = self.doc_lens[self.post_rows].astype(np.float64)
+
+        numerator = freq * (k1 + 1)
+        denominator = freq + k1 * (1 - b + b * dl / avgdl)
+        self.weights = np.repeat(idf, df) * (numerator / denominator)
+        self.weight_params = np.array([k1, b], dtype=np.float64)
+
+
+def _compact(values: Iterable[int]) -> np.ndarray:
+    array = np.fromiter(values, dtype=np.int64)
+    if not len(array):
+        return array.astype(np.uint8)
+
+    return array.astype(np.min_scalar_type(int(array.max())))
+
+
+def _build_blocks(term_ptr: np.ndarray, post_rows: np.ndarray, post_tf: np.ndarray, doc_lens: np.ndarray) -> dict[str, np.ndarray]:
+    n_terms = len(term_ptr) - 1
+    term_of_posting = np.repeat(np.arange(n_terms), np.diff(term_ptr))
+    range_of_posting = post_rows.astype(np.int64) // BLOCK_ROWS
+
+    # a new block starts wherever the term or the row range changes
+    new_block = np.ones(len(post_rows), dtype=bool)
+    new_block[1:] = (np.diff(term_of_posting) != 0) | (np.diff(range_of_posting) != 0)
+    starts = np.flatnonzero(new_block)
+
+    if not len(starts):
+        empty = np.empty(0, dtype=np.uint8)
+        return {"blk_ptr": np.zeros(n_terms + 1, dtype=np.int64), "blk_range": empty, "blk_post_ptr": np.zeros(1, dtype=np.int64), "blk_max_tf": empty, "blk_min_len": empty}
+
+    return {
+        "blk_ptr": np.searchsorted(term_of_posting[starts], np.arange(n_terms + 1)).astype(np.int64),
+        "blk_range": _compact(range_of_posting[starts]),
+        "blk_post_ptr": np.append(starts, len(post_rows)).astype(np.int64),
+        "blk_max_tf": _compact(np.maximum.reduceat(post_tf, starts)),
+        "blk_min_len": _compact(np.minimum.reduceat(doc_lens[post_rows], starts)),
+    }
+
+
+def build_inverted_index(ids: Iterable, documents: Iterable[Optional[str]]) -> InvertedIndex:
+    ids = np.asarray(list(ids), dtype=np.int64)
+
+    postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+    doc_lens = []
+    for row, document in enumerate(documents):
+        tokens = tokenize(document)
+        doc_lens.append(len(tokens))
+        for term, freq in Counter(tokens).items():
+            postings[term].append((row, freq))
+
+    if len(doc_lens) != len(ids):
+        raise ValueError(f"{len(doc_lens)} documents do not match {len(ids)} ids")
+
+    terms = sorted(postings)
+    term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_ptr[1:] = np.cumsum([len(postings[term]) for term in terms])
+
+    return InvertedIndex(
+        terms=np.asarray(terms, dtype=str),
+        term_ptr=term_ptr,
+        post_rows=_compact(row for term in terms for row, _ in postings[term]),
+        post_tf=_compact(freq for term in terms for _, freq in postings[term]),
+        doc_lens=_compact(doc_lens),
+        ids=ids,
+    )
+
+
+def write_inverted_index(path: Path, index: InvertedIndex) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+
+    with open(tmp_path, "wb") as f:
+        weights = {"weights": index.weights, "weight_params": index.weight_params} if index.weights is not None else {}
+        np.savez_compressed(f, **{name: getattr(index, name) for name in _INDEX_ARRAYS}, **index.block_arrays(), **weights)
+
+    os.replace(tmp_path, path)
+
+    _INDEXES.pop(str(path), None)
+
+
+def load_inverted_index(path: Path) -> Optional[InvertedIndex]:
+    """
+    Load an exported index. Returns None if the export does not exist.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    key = str(path)
+    cached = _INDEXES.get(key)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    try:
+        with np.load(path) as data:
+            blocks = {name: data[name] for name in _BLOCK_ARRAYS} if set(_BLOCK_ARRAYS) <= set(data.files) else None
+            index = InvertedIndex(**{name: data[name] for name in _INDEX_ARRAYS}, blocks=blocks)
+            if "weights" in data.files:
+                index.weights, index.weight_params = data["weights"], data["weight_params"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+    _INDEXES[key] = (mtime_ns, index)
+
+    return index
+
+
+def remove_inverted_index(path: Path) -> None:
+    _INDEXES.pop(str(path), None)
+    path.unlink(missing_ok=True)
+
+
+def _idf(n_docs: int, freq: int) -> float:
+    return math.log(1 + (n_docs - freq + 0.5) / (freq + 0.5))
+
+
+def _query_statistics(blocks: list[tuple[InvertedIndex, np.ndarray]], query_tokens: list[str], corpus: Optional["CorpusStatistics"] = None) -> tuple[int, float, dict[str, float]]:
+    """
+    N, avgdl and the idf of each query token occurring in the candidates. N, df and avgdl are taken over the
+    candidate rows only, like a scan of their content would, unless the statistics of the whole level are given.
+    """
+    n_docs = sum(int(mask.sum()) for _, mask in blocks)
+    if not n_docs:
+        return 0, 0.0, {}
+
+    if corpus is not None:
+        return n_docs, corpus.avgdl, corpus.idf(query_tokens)
+
+    avgdl = sum(int(index.doc_lens[mask].sum()) for index, mask in blocks) / n_docs
+
+    # every row is a candidate: df is the posting count
+    full = [bool(mask.all()) for _, mask in blocks]
+
+    idf: dict[str, float] = {}
+    for term in dict.fromkeys(query_tokens):
+        freq = 0
+        for (index, mask), all_rows in zip(blocks, full):
+            rows, _ = index.postings(term)
+            freq += len(rows) if all_rows else int(mask[rows].sum())
+
+        if freq:
+            idf[term] = _idf(n_docs, freq)
+
+    return n_docs, avgdl, idf
+
+
+def _score_postings(index: InvertedIndex, postings: dict[str, tuple[np.ndarray, np.ndarray]], query_tokens: list[str], idf: dict[str, float], avgdl: float, k1: float, b: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exact BM25 of every row that appears in the given postings of one index. Contributions are added in query order,
+    repeated tokens count again, so the floats equal those of a per-document scan.
+    """
+    matched = [rows for rows, _ in postings.values()]
+    rows = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+    if not len(rows):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    scores = np.zeros(len(rows), dtype=np.float64)
+    doc_lens = index.doc_lens[rows].astype(np.float64)
+
+    for term in query_tokens:
+        if term not in postings:
+            continue
+
+        term_rows, tf = postings[term]
+        positions = np.searchsorted(rows, term_rows)
+        freq = tf.astype(np.float64)
+        dl = doc_lens[positions]
+
+        numerator = freq * (k1 + 1)
+        denominator = freq + k1 * (1 - b + b * dl / avgdl)
+        scores[positions] += idf[term] * (numerator / denominator)
+
+    return index.ids[rows], scores
+
+
+def _masked(rows: np.ndarray, tf: np.ndarray, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    keep = mask[rows]
+    return rows[keep], tf[keep]
+
+
+def bm25_scores(blocks: list[tuple[InvertedIndex, np.ndarray]], query_tokens: list[str], k1: float, b: float, corpus: Optional["CorpusStatistics"] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Okapi BM25 over the candidate rows of one or more indexes, given as (index, row mask) blocks.
+    df and avgdl come from the corpus statistics if given, otherwise from the candidates.
+
+    Returns (retrieval_ids, scores) of the candidates matching at least one query token; every other candidate scores 0.
+    Only the postings of the query tokens are touched.
+    """
+    n_docs, avgdl, idf = _query_statistics(blocks, query_tokens, corpus)
+
+    id_blocks, score_blocks = [], []
+    for index, mask in blocks:
+        if not n_docs:
+            break
+
+        postings = {term: _masked(*index.postings(term), mask) for term in idf}
+        ids, scores = _score_postings(index, postings, query_tokens, idf, avgdl, k1, b)
+        id_blocks.append(ids)
+        score_blocks.append(scores)
+
+    if not id_blocks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    return np.concatenate(id_blocks), np.concatenate(score_blocks)
+
+
+def bm25_top_k(blocks: list[tuple[InvertedIndex, np.ndarray]], query_tokens: list[str], k1: float, b: float, k: int, corpus: Optional["CorpusStatistics"] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Block-max pruned variant of bm25_scores for top-k queries.
+
+    Every row range gets an upper bound: the sum over the query tokens of their best block score in that range,
+    from the block's largest term frequency and shortest row. Ranges are scored exactly in descending bound order,
+    in batches of doubling size; once k rows are scored, ranges whose bound is below the k-th best score are skipped
+    with all of their postings.
+
+    Returns (retrieval_ids, scores) of a subset of the matching candidates that contains every row scoring at
+    least the k-th best score, ties included, so the final top-k is identical to the exhaustive one.
+    """
+    n_docs, avgdl, idf = _query_statistics(blocks, query_tokens, corpus)
+    if not n_docs or not idf or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    multiplicity = Counter(token for token in query_tokens if token in idf)
+
+    # upper bound per (block, range), laid out as one array over the ranges of all blocks
+    range_offsets = np.cumsum([0] + [index.n_ranges for index, _ in blocks])
+    bounds = np.zeros(int(range_offsets[-1]), dtype=np.float64)
+
+    for (index, _), offset in zip(blocks, range_offsets):
+        for term, count in multiplicity.items():
+            i = index.term_id(term)
+            if i is None:
+                continue
+
+            block_ids = slice(index.blk_ptr[i], index.blk_ptr[i + 1])
+            freq = index.blk_max_tf[block_ids].astype(np.float64)
+            dl = index.blk_min_len[block_ids].astype(np.float64)
+
+            numerator = freq * (k1 + 1)
+            denominator = freq + k1 * (1 - b + b * dl / avgdl)
+            np.add.at(bounds, offset + index.blk_range[block_ids].astype(np.int64), count * idf[term] * (numerator / denominator))
+
+    bounds *= 1 + _BOUND_SLACK
+
+    order = np.argsort(-bounds, kind="stable")
+    order = order[bounds[order] > 0]
+
+    threshold = -np.inf
+    id_parts, score_parts = [], []
+    start, batch = 0, max(1, -(-k // BLOCK_ROWS))
+
+    while start < len(order):
+        selected = order[start:start + batch]
+        selected = selected[bounds[selected] >= threshold]
+        if not len(selected):
+            break
+
+        ranges = np.zeros(len(bounds), dtype=bool)
+        ranges[selected] = True
+
+        for (index, mask), offset in zip(blocks, range_offsets):
+            index_ranges = ranges[offset:offset + index.n_ranges]
+            if not index_ranges.any():
+                continue
+
+            postings = {term: _masked(*index.block_postings(term, index_ranges), mask) for term in idf}
+            ids, scores = _score_postings(index, postings, query_tokens, idf, avgdl, k1, b)
+            id_parts.append(ids)
+            score_parts.append(scores)
+
+        all_scores = np.concatenate(score_parts)
+        if len(all_scores) >= k:
+            threshold = np.partition(all_scores, len(all_scores) - k)[len(all_scores) - k]
+
+        start += batch
+        batch *= 2
+
+    if not id_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    ids, scores = np.concatenate(id_parts), np.concatenate(score_parts)
+    keep = scores >= threshold
+
+    return ids[keep], scores[keep]
+
+
+def bm25_matrix_scores(index: InvertedIndex, queries: list[list[str]], corpus: Optional["CorpusStatistics"] = None, k1: Optional[float] = None, b: Optional[float] = None) -> np.ndarray:
+    """
+    BM25 of every row of the level for a batch of tokenized queries, from the precomputed weight matrix:
+    a sparse row-sum per query, all queries in one bincount. Returns a dense (n_queries, n_rows) float64 array.
+
+    With corpus statistics (and k1 / b), the weights of the query terms' postings are computed from the corpus
+    df / avgdl instead of read from the weight matrix, which holds the statistics of this index only.
+
+    Weights are added in query order, repeated tokens count again, so the scores equal bm25_scores over all rows.
+    """
+    n_rows = len(index.ids)
+
+    # per query term: the posting weights depend on the term only
+    corpus_weights: dict[str, np.ndarray] = {}
+
+    flat_parts, weight_parts = [], []
+    for q, tokens in enumerate(queries):
+        idf = corpus.idf(tokens) if corpus is not None else None
+
+        for term in tokens:
+            i = index.term_id(term)
+            if i is None or (idf is not None and term not in idf):
+                continue
+
+            start, end = index.term_ptr[i], index.term_ptr[i + 1]
+            flat_parts.append(q * n_rows + index.post_rows[start:end].astype(np.int64))
+
+            if idf is None:
+                weight_parts.append(index.weights[start:end])
+                continue
+
+            if term not in corpus_weights:
+                freq = index.post_tf[start:end].astype(np.float64)
+                dl = index.doc_lens[index.post_rows[start:end]].astype(np.float64)
+
+                numerator = freq * (k1 + 1)
+                denominator = freq + k1 * (1 - b + b * dl / corpus.avgdl)
+                corpus_weights[term] = idf[term] * (numerator / denominator)
+
+            weight_parts.append(corpus_weights[term])
+
+    if not flat_parts:
+        return np.zeros((len(queries), n_rows), dtype=np.float64)
+
+    scores = np.bincount(np.concatenate(flat_parts), weights=np.concatenate(weight_parts), minlength=len(queries) * n_rows)
+
+    return scores.reshape(len(queries), n_rows)
+
+
+
+
+# ---------------------------------------------
+
+# ------------ CORPUS STATISTICS --------------
+
+# ---------------------------------------------
+
+# df and avgdl of a whole (project, level), shared by every BM25Retriever of that level: per-document retrievers
+# score against the same idf, and the statistics are computed once per content state instead of on every query.
+# Entries are keyed on a fingerprint of the level read from the database (row count, max retrieval_id, total content
+# length), so writes of other worker processes are picked up as well; it is read once per request, not per retriever.
+# Writers of Retrievals.content in this process (chunking, Extractor, Enricher, Filter, Reset, chunk edits) drop the
+# entries and bump the content version through invalidate_corpus_statistics, so the next read sees their writes.
+# At most CORPUS_STATISTICS_CACHE_SIZE levels are kept, least recently used evicted first.
+
+BM25_STATISTICS = ("corpus", "candidates")
+
+CORPUS_STATISTICS_CACHE_SIZE = int(os.getenv("CORPUS_STATISTICS_CACHE_SIZE", 64))
+
+# (project_id, level) -> (fingerprint, statistics), least recently used first
+_CORPUS_STATISTICS: OrderedDict[tuple, tuple[tuple, "CorpusStatistics"]] = OrderedDict()
+
+# bumped on every invalidation in this process
+_CONTENT_VERSION = 0
+
+
+class CorpusStatistics:
+
+    def __init__(self, n_docs: int, avgdl: float, terms: np.ndarray, df: np.ndarray):
+        self.n_docs = n_docs
+        self.avgdl = avgdl
+        self.terms = terms
+        self.df = df
+
+    @classmethod
+    def from_index(cls, index: InvertedIndex) -> "CorpusStatistics":
+        n_docs = len(index.ids)
+        avgdl = float(index.doc_lens.sum()) / n_docs if n_docs else 0.0
+        return cls(n_docs=n_docs, avgdl=avgdl, terms=index.terms, df=np.diff(index.term_ptr))
+
+    def idf(self, query_tokens: list[str]) -> dict[str, float]:
+        idf: dict[str, float] = {}
+        for term in dict.fromkeys(query_tokens):
+            i = int(np.searchsorted(self.terms, term))
+            if i < len(self.terms) and self.terms[i] == term and self.df[i]:
+                idf[term] = _idf(self.n_docs, int(self.df[i]))
+
+        return idf
+
+
+def build_corpus_statistics(documents: Iterable[Optional[str]]) -> CorpusStatistics:
+    documents = list(documents)
+    return CorpusStatistics.from_index(build_inverted_index(range(len(documents)), documents))
+
+
+def invalidate_corpus_statistics(project_id, level: Optional[str] = None) -> None:
+    """
+    Called after Retrievals of the project change; without a level every level of the project is invalidated.
+    """
+    global _CONTENT_VERSION
+    _CONTENT_VERSION += 1
+
+    for cached_key in [cached_key for cached_key in _CORPUS_STATISTICS if cached_key[0] == project_id and level in (None, cached_key[1])]:
+        _CORPUS_STATISTICS.pop(cached_key, None)
+
+
+def content_version() -> int:
+    return _CONTENT_VERSION
+
+
+def cached_corpus_statistics(project_id, level: str, fingerprint: tuple) -> Optional[CorpusStatistics]:
+    key = (project_id, level)
+    cached = _CORPUS_STATISTICS.get(key)
+    if cached is None:
+        return None
+
+    # the rows changed since the statistics were computed
+    if cached[0] != fingerprint:
+        _CORPUS_STATISTICS.pop(key, None)
+        return None
+
+    _CORPUS_STATISTICS.move_to_end(key)
+    return cached[1]
+
+
+def store_corpus_statistics(project_id, level: str, fingerprint: tuple, statistics: CorpusStatistics) -> None:
+    if CORPUS_STATISTICS_CACHE_SIZE <= 0:
+        return
+
+    key = (project_id, level)
+    _CORPUS_STATISTICS[key] = (fingerprint, statistics)
+    _CORPUS_STATISTICS.move_to_end(key)
+    while len(_CORPUS_STATISTICS) > CORPUS_STATISTICS_CACHE_SIZE:
+        _CORPUS_STATISTICS.popitem(last=False)
+
+
+
+# ---------------------------------------------
+
+# ---------------- SQLITE FTS5 ----------------
+
+# ---------------------------------------------
+
+# On SQLite, an external-content FTS5 table mirrors Retrievals.content (rowid = retrieval_id). Triggers on Retrievals
+# keep it in sync with every writer (chunking, Enricher, Filter, update_chunking_results), so BM25Retriever with
+# backend="fts5" filters and ranks inside SQLite with the built-in bm25() (k1 = 1.2, b = 0.75, statistics over the
+# whole table) instead of loading the chunk text into Python.
+
+FTS_TABLE = "retrievals_fts"
+
+KEYWORD_BACKENDS = ("index", "fts5")
+
+_FTS5_AVAILABLE = False
+
+FTS_STATEMENTS = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(content, content='Retrievals', content_rowid='retrieval_id')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON Retrievals BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.retrieval_id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON Retrievals BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.retrieval_id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON Retrievals BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.retrieval_id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.retrieval_id, new.content);
+    END""",
+)
+
+DROP_FTS_STATEMENTS = (
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+
+def set_fts5_available(available: bool) -> None:
+    global _FTS5_AVAILABLE
+    _FTS5_AVAILABLE = available
+
+
+def fts5_available() -> bool:
+    return _FTS5_AVAILABLE
+
+
+async def create_fts(conn: AsyncConnection) -> bool:
+    """
+    Create the FTS5 mirror and its triggers if missing; a new mirror is filled from the existing chunks.
+    Returns False (FTS5 stays disabled) on other dialects or when SQLite was built without FTS5.
+    """
+    if conn.dialect.name != "sqlite":
+        set_fts5_available(False)
+        return False
+
+    try:
+        exists = (await conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE})).first() is not None
+
+        for statement in FTS_STATEMENTS:
+            await conn.execute(text(statement))
+
+        if not exists:
+            await conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+    except Exception as e:
+        AgentLogger.warning("SQLite FTS5 unavailable, BM25Retriever keeps its inverted index", extra={"error": repr(e)})
+        set_fts5_available(False)
+        return False
+
+    set_fts5_available(True)
+    return True
+
+
+def fts_match_expression(query_tokens: list[str]) -> str:
+    # any query token, each as a quoted FTS5 string so no token is read as query syntax
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(query_tokens))
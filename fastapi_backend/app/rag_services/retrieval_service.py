@@ -1,22 +1,25 @@
 import json
 import asyncio
 from typing import Any, Dict, List, Optional, Iterable
-import re
 import time
 import copy
-import struct
+
+import numpy as np
 
 #fastapi exceptions
 from fastapi import APIRouter, Depends, HTTPException, Request
 
 #Orchestrators
-from app.rag_apis.chat_api import ChatOrchestrator
-from app.rag_apis.embed_api import EmbeddingOrchestrator
+from app.rag_apis.chat_api import ChatOrchestrator, label_context_limit, _estimate_tokens, _truncate_to_tokens
+from app.rag_apis.embed_api import EmbeddingOrchestrator, split_batches
+from app.rag_apis.model_enums import CONTEXT_RESERVE, EMBEDDING_SUBCATEGORIES
 
 
 
 # External helpers
-from app.rag_services.helpers import load_doc_pipelines, load_pipeline, get_doc_paths, get_log_path, get_doc_title, get_user_api_keys, log_pipeline_methods, ExtractionError
+from app.rag_services.helpers import load_doc_pipelines, load_pipeline, content_hash, get_doc_paths, get_embedding_paths, get_hierarchy_path, get_keyword_index_path, get_index_paths, get_log_path, get_doc_title, get_user_api_keys, log_pipeline_methods, ExtractionError
+from app.rag_services.keyword_index import KEYWORD_BACKENDS, BM25_STATISTICS, FTS_TABLE, fts5_available, fts_match_expression, tokenize, build_inverted_index, write_inverted_index, load_inverted_index, remove_inverted_index, bm25_top_k, bm25_matrix_scores, CSR_MAX_ROWS, CSR_QUERY_MAX_ROWS, build_corpus_statistics, cached_corpus_statistics, store_corpus_statistics, content_version
+from app.rag_services.vector_store import write_matrix, load_matrix, remove_matrix, select_rows, HierarchyIndex, write_hierarchy, load_hierarchy, build_hnsw, load_hnsw, remove_hnsw, hnsw_search, HNSW_DEFAULT_M, HNSW_DEFAULT_EF_SEARCH, HNSW_MIN_ELEMENTS, EMBEDDING_DTYPES, DEFAULT_RESCORE_FACTOR, quantize_vectors, encode_vectors, decode_vectors, normalize_rows, sqlite_vec_enabled, vec_delete, vec_insert, vec_search
 
 
 
@@ -25,9 +28,10 @@ from app.log_generator import InfoLogger
 from app.generate_markdown import export_logs
 
 # Database ops
+from sqlalchemy import select, func, text, literal_column, table as sa_table, column as sa_column
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import ProjectData, SavedProjects, DocPipelines, MainPipeline, Paragraph, Retrieval, Embedding, Settings
+from app.models import ProjectData, SavedProjects, DocPipelines, MainPipeline, Paragraph, Retrieval, Embedding, EmbeddingCache, Settings
 
 
 
@@ -71,7 +75,8 @@ class ChatGenerator:
 
         user_key_list = await get_user_api_keys(user_id=self.user_id, base_api="https://chat-ai.academiccloud.de/v1", db=self.db)
 
-        self.chat_orchestrator = ChatOrchestrator(user_key_list=user_key_list,  base_api="https://chat-ai.academiccloud.de/v1")
+        # chat path: hedge slow model calls
+        self.chat_orchestrator = ChatOrchestrator(user_key_list=user_key_list,  base_api="https://chat-ai.academiccloud.de/v1", hedge=True)
 
 
 
@@ -129,7 +134,7 @@ class ChatGenerator:
     ---
     """.strip()
 
-        chat_output = self.chat_orchestrator.call(
+        chat_output = await self.chat_orchestrator.call(
             label=self.query_transformation_model,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
@@ -140,7 +145,7 @@ class ChatGenerator:
 
         return chat_output
 
-    def _generate_content(self, query: str, history: list[dict[str, Any]], retrieval_input_chunks: str) -> str:
+    async def _generate_content(self, query: str, history: list[dict[str, Any]], retrieval_input_chunks: str) -> str:
         system_prompt = f"""
     You are an assistant that processes a user query together with retrieved text chunks.
 
@@ -179,7 +184,7 @@ class ChatGenerator:
 
         if history:
 
-            chat_output = self.chat_orchestrator.call_with_history(
+            chat_output = await self.chat_orchestrator.call_with_history(
                 label=self.generator_model,
                 system_prompt=system_prompt,
                 user_prompt=user_prompt,
@@ -187,7 +192,7 @@ class ChatGenerator:
             )
         else:
 
-            chat_output = self.chat_orchestrator.call(
+            chat_output = await self.chat_orchestrator.call(
                 label=self.generator_model,
                 system_prompt=system_prompt,
                 user_prompt=user_prompt,
@@ -208,7 +213,7 @@ class ChatGenerator:
 
         retrieval_input_chunks = "\n\n[NEW_CHUNK]\n\n".join(input_chunks)
 
-        output_answer = self._generate_content(query, history, retrieval_input_chunks)
+        output_answer = await self._generate_content(query, history, retrieval_input_chunks)
 
         return output_answer
 
@@ -237,6 +242,43 @@ def rows_to_columns(rows):
 
 
 
+async def retrieval_fingerprint(db: AsyncSession, user_id: UUID, project_id: UUID, doc_id: Optional[UUID] = None, level: Optional[str] = None) -> tuple[int, int, int]:
+    """
+    Row count, max retrieval_id and total content length of the project's chunks (optionally of one doc and / or level,
+    reranker rows excluded), in one aggregate query: changes with inserts, deletes and content edits, from any process.
+    """
+    filters = [Retrieval.user_id == user_id, Retrieval.project_id == project_id, Retrieval.level != "rerank"]
+    if doc_id is not None:
+        filters.append(Retrieval.doc_id == doc_id)
+    if level is not None:
+        filters.append(Retrieval.level == level)
+
+    result = await db.execute(
+        select(func.count(Retrieval.retrieval_id), func.max(Retrieval.retrieval_id), func.coalesce(func.sum(func.length(Retrieval.content)), 0))
+        .where(*filters)
+    )
+    count, max_id, length = result.one()
+
+    return int(count), int(max_id or 0), int(length)
+
+
+
+async def level_fingerprint(db: AsyncSession, user_id: UUID, project_id: UUID, level: str) -> tuple[int, int, int]:
+    """
+    retrieval_fingerprint of a whole level, read once per session (i.e. per request) and shared by every retriever of
+    the level, since the aggregate reads all its content. A write in this process (invalidate_corpus_statistics)
+    moves the content version, so the next call reads it again.
+    """
+    fingerprints = db.info.setdefault("level_fingerprints", {})
+    key = (user_id, project_id, level, content_version())
+
+    if key not in fingerprints:
+        fingerprints[key] = await retrieval_fingerprint(db, user_id, project_id, level=level)
+
+    return fingerprints[key]
+
+
+
 
 
 async def get_retrieval_content(db: AsyncSession, user_id: UUID, project_id: UUID, retrieval_ids: Iterable = ()):
@@ -505,6 +547,7 @@ class BaseRetriever:
 
         user_key_list = await get_user_api_keys(user_id=self.user_id, base_api="https://chat-ai.academiccloud.de/v1", db=self.db)
 
+        # hedged per call: query transformation and the reranker only, not the map-reduce shard calls
         self.chat_orchestrator = ChatOrchestrator(user_key_list=user_key_list,  base_api="https://chat-ai.academiccloud.de/v1")
 
 
@@ -552,9 +595,47 @@ class BaseRetriever:
 
 
 
-    async def filter_retrieval_content(self, retrieval_ids: Optional[Iterable] = ()):
+    def _hierarchy_bitmap(self, filter_ids: Iterable) -> Optional[tuple[HierarchyIndex, np.ndarray]]:
+        """
+        In-memory counterpart of _find_source_data: the bitmap of this level's chunks that belong to the filter_ids,
+        from the hierarchy index exported with the document. None if there is no index or it does not know the ids.
+        """
+        index = load_hierarchy(get_hierarchy_path(self.user_id, self.project_id, self.doc_id))
+        if index is None:
+            return None
+
+        bitmap = index.children(filter_ids, self.level)
+        if bitmap is None:
+            return None
+
+        return index, bitmap
+
+
 
-        columns = ["retrieval_id", "content"]
+    def _bitmap_candidates(self, filter_ids: Iterable, row_ids: np.ndarray) -> Optional[dict]:
+        """
+        Candidates as a bitmap over the rows of a file exported for this doc and level (row i <-> row_ids[i]).
+        Returns None if there is no hierarchy index or the file and the index were not exported from the same chunks.
+        """
+        hierarchy = self._hierarchy_bitmap(filter_ids)
+        if hierarchy is None:
+            return None
+
+        index, bitmap = hierarchy
+        row_mask = index.row_mask(self.level, bitmap, row_ids)
+        if row_mask is None:
+            return None
+
+        if not row_mask.any():
+            return {}
+
+        return {"retrieval_id": row_ids[row_mask].tolist(), "row_mask": row_mask}
+
+
+
+    async def filter_retrieval_content(self, retrieval_ids: Optional[Iterable] = (), with_content: bool = True, with_title: bool = False):
+
+        columns = ["retrieval_id", "content"] if with_content else ["retrieval_id"]
         
         # Reranker
         if self.level == "rerank":
@@ -577,15 +658,29 @@ class BaseRetriever:
         else:
             # if this retriever is not the router and retrieval_ids exist for filtering. In this case the child class is running retrieval.
             if retrieval_ids and self.doc_id:
-                level_ids = await self._find_source_data(retrieval_ids)
-
-                where = {
-                    "user_id": self.user_id,
-                    "project_id": self.project_id,
-                    "doc_id": self.doc_id,
-                    "level_id": level_ids,
-                    "level": self.level,
-                }
+                hierarchy = self._hierarchy_bitmap(retrieval_ids)
+
+                if hierarchy is not None and hierarchy[0].fingerprint == await retrieval_fingerprint(self.db, self.user_id, self.project_id, doc_id=self.doc_id):
+                    index, bitmap = hierarchy
+                    where = {
+                        "user_id": self.user_id,
+                        "project_id": self.project_id,
+                        "doc_id": self.doc_id,
+                        "retrieval_id": index.level_ids(self.level)[bitmap].tolist(),
+                        "level": self.level,
+                    }
+
+                # no hierarchy index exported yet, or the chunks changed since (fingerprint mismatch): resolve the parent level_ids in SQL
+                else:
+                    level_ids = await self._find_source_data(retrieval_ids)
+
+                    where = {
+                        "user_id": self.user_id,
+                        "project_id": self.project_id,
+                        "doc_id": self.doc_id,
+                        "level_id": level_ids,
+                        "level": self.level,
+                    }
 
 
             # if this retriever is not the router but there are no filter_ids.
@@ -617,9 +712,11 @@ class BaseRetriever:
                 }
 
                 # we need the doc_id to decide which pipelines to run next
-                columns = ["doc_id", "retrieval_id", "content"]
+                columns = ["doc_id", "retrieval_id", "content"] if with_content else ["doc_id", "retrieval_id"]
 
 
+        if with_title:
+            columns = columns + ["title"]
 
         retrieval_rows, columns = await Retrieval.get_all(
             columns=columns,
@@ -667,10 +764,11 @@ class BaseRetriever:
         ---
         """.strip()
 
-        chat_output = self.chat_orchestrator.call(
+        chat_output = await self.chat_orchestrator.call(
             label=self.transformation_model,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
+            hedge=True,
         )
         if is_json(chat_output):
             chat_output = self.unwrap_answer(chat_output)
@@ -702,7 +800,11 @@ class BaseRetriever:
         retrieval_dict = await self.filter_retrieval_content(filter_ids)
 
 
-        self.logger.log_step(task="table", layer=1, table_data={"Candidate chunks": retrieval_dict["content"]})
+        if retrieval_dict and "content" not in retrieval_dict:
+            # candidates selected on an index carry no content
+            self.logger.log_step(task="info_text", layer=1, log_text=f"{len(retrieval_dict['retrieval_id'])} candidate chunks")
+        else:
+            self.logger.log_step(task="table", layer=1, table_data={"Candidate chunks": retrieval_dict["content"]})
 
         # call to child method
         #self.logger.log_step(task="info_text", layer=1, log_text=f"Input dict:\n{retrieval_dict}")
@@ -747,6 +849,20 @@ class BaseRetriever:
 
 
 
+# Candidates that do not fit one prompt are packed into shards within the context of the reasoner model, selected
+# in parallel (map) and their winners selected again (reduce); up to REASONER_SHARD_CONCURRENCY shard calls at once
+REASONER_SHARD_CONCURRENCY = 4
+
+# prefilter option -> cheap retriever at the same level, which passes only its top prefilter_amount candidates on
+PREFILTER_TYPES = {"bm25": "BM25Retriever", "embedding": "EmbeddingRetriever"}
+DEFAULT_PREFILTER_AMOUNT = 50
+
+# what the reasoner reads of each chunk: the full content, its title, its title and lead (where Extractor / Enricher
+# summaries sit), or the first view_chars characters of the content
+REASONER_VIEWS = ("content", "title", "summary", "prefix")
+DEFAULT_VIEW_CHARS = 300
+
+
 class ReasonerRetriever(BaseRetriever):
     """"
     Provides retrieval_output that aligns best with the raw input query
@@ -756,13 +872,41 @@ class ReasonerRetriever(BaseRetriever):
     To create an instance of the class, provide the level at which the retrieval will take place
     """
 
-    def __init__(self, db: AsyncSession, logger: InfoLogger, user_id: UUID, project_id: UUID, level: str, retrieval_amount: int, reasoner_model: str, query_transformation_model: str, query_transformation_prompt: Optional[str] = "A new version of this query in the same language, suited for chunk retrieval with LLMs", doc_id: Optional[UUID] = None):
+    def __init__(self, db: AsyncSession, logger: InfoLogger, user_id: UUID, project_id: UUID, level: str, retrieval_amount: int, reasoner_model: str, query_transformation_model: str, query_transformation_prompt: Optional[str] = "A new version of this query in the same language, suited for chunk retrieval with LLMs", doc_id: Optional[UUID] = None, shard_tokens: Optional[str] = None, prefilter: Optional[str] = None, prefilter_amount: Optional[str] = None, embedding_model: Optional[str] = None, view: Optional[str] = "content", view_chars: Optional[str] = None):
 
         super().__init__(db=db, logger=logger, user_id=user_id, project_id=project_id, doc_id=doc_id, level=level, retrieval_amount=retrieval_amount, query_transformation_model=query_transformation_model, query_transformation_prompt=query_transformation_prompt)
 
 
         self.reasoner_model = reasoner_model
 
+        # optional cap on the chunk tokens per shard, below the model context: smaller shards answer faster
+        self.shard_tokens = self._safe_int(shard_tokens, "shard_tokens")
+
+        # optional BM25 / embedding pass in front of the reasoner
+        self.prefilter_spec = self.prefilter_method({"level": level, "prefilter": prefilter, "prefilter_amount": prefilter_amount, "embedding_model": embedding_model})
+
+        # compact chunk representation in the selection prompt
+        self.view = view or "content"
+        if self.view not in REASONER_VIEWS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for 'view'. Must be one of {', '.join(REASONER_VIEWS)}, got: {view!r}"
+            )
+        self.view_chars = self._safe_int(view_chars, "view_chars") or DEFAULT_VIEW_CHARS
+
+
+    @staticmethod
+    def _safe_int(value: Optional[str], name: str) -> Optional[int]:
+        if value in (None, ""):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for '{name}'. Must be an integer, got: {value!r}"
+            )
+
     @staticmethod
     def unwrap_retrieval_ids(chat_output) -> List[str]:
         """
@@ -802,6 +946,10 @@ class ReasonerRetriever(BaseRetriever):
             if isinstance(item, str) and item.strip():
                 output_ids.append(item.strip())
 
+            # aliases are small numbers, models often return them unquoted
+            elif isinstance(item, int) and not isinstance(item, bool):
+                output_ids.append(str(item))
+
 
         return output_ids
 
@@ -809,7 +957,7 @@ class ReasonerRetriever(BaseRetriever):
 
 
 
-    def _retrieve_ids(self, query: str, retrieval_input_chunks: str) -> List[str]:
+    async def _retrieve_ids(self, query: str, retrieval_input_chunks: str) -> List[str]:
         # Qwen3-Coder is explicitly an instruction-tuned coder model, so its usage profile lines up with OpenAIs mini line
 
         # QWEN2.5_CODER_32B_INSTRUCT
@@ -854,11 +1002,12 @@ class ReasonerRetriever(BaseRetriever):
     ---
     """.strip()
 
-        # chat orchestrator already instanced by BaseRetriever
-        chat_output = self.chat_orchestrator.call(
+        # chat orchestrator already instanced by BaseRetriever; as reranker the call is on the answer path, so hedge it
+        chat_output = await self.chat_orchestrator.call(
             label=self.reasoner_model,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
+            hedge=self.level == "rerank",
         )
 
         output_ids = self.unwrap_retrieval_ids(chat_output)
@@ -868,12 +1017,173 @@ class ReasonerRetriever(BaseRetriever):
 
 
 
+    @classmethod
+    def prefilter_method(cls, method: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Method spec of the prefilter of a ReasonerRetriever spec, None without prefilter.
+        Indexing uses it to export the embeddings / inverted index the prefilter searches.
+        """
+        prefilter = method.get("prefilter")
+        if not prefilter:
+            return None
+
+        if prefilter not in PREFILTER_TYPES:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for 'prefilter'. Must be one of {', '.join(PREFILTER_TYPES)}, got: {prefilter!r}"
+            )
+
+        prefilter_amount = cls._safe_int(method.get("prefilter_amount"), "prefilter_amount") or DEFAULT_PREFILTER_AMOUNT
+
+        prefilter_method = {"type": PREFILTER_TYPES[prefilter], "level": method["level"], "retrieval_amount": prefilter_amount, "query_transformation_model": "", "query_transformation_prompt": ""}
+
+        if prefilter == "bm25":
+            prefilter_method.update({"k1": "1.5", "b": "0.75"})
+        else:
+            if not method.get("embedding_model"):
+                raise HTTPException(status_code=422, detail="The embedding prefilter requires an 'embedding_model'")
+            prefilter_method["embedding_model"] = method["embedding_model"]
+
+        return prefilter_method
+
+
+
+    async def _prefilter(self, query: str, retrieval_dict: dict) -> dict:
+        """
+        Keep the top prefilter_amount candidates of the prefilter retriever, best first.
+        Keeps every candidate if the prefilter finds nothing (e.g. no embeddings at this level yet).
+        """
+        method = dict(self.prefilter_spec)
+        method_type = method.pop("type")
+        prefilter = TYPE_MAPPER[method_type](db=self.db, logger=self.logger, user_id=self.user_id, project_id=self.project_id, doc_id=self.doc_id, **method)
+
+        # as router, the candidates are the whole level: an embedding prefilter can search its HNSW index
+        prefilter_dict = retrieval_dict
+        if not self.doc_id and isinstance(prefilter, EmbeddingRetriever):
+            router_index = await prefilter._load_router_index()
+            if router_index is not None:
+                prefilter_dict = {**retrieval_dict, "router_index": router_index[0]}
+
+        top_ids = await prefilter.run_retriever(query, prefilter_dict)
+
+        positions = {retrieval_id: i for i, retrieval_id in enumerate(retrieval_dict["retrieval_id"])}
+        kept = [positions[retrieval_id] for retrieval_id in top_ids if retrieval_id in positions]
+
+        if not kept:
+            self.logger.log_step(task="info_text", layer=2, log_text=f"Prefilter found no chunks, keeping all {len(positions)} candidates")
+            return retrieval_dict
+
+        self.logger.log_step(task="info_text", layer=2, log_text=f"Prefilter kept {len(kept)} of {len(positions)} chunks")
+
+        return {column: [values[i] for i in kept] for column, values in retrieval_dict.items()}
+
+
+
+    async def filter_retrieval_content(self, retrieval_ids: Optional[Iterable] = (), with_content: bool = True, with_title: bool = False):
+        # the title and summary views read the title column as well
+        return await super().filter_retrieval_content(retrieval_ids, with_content, with_title or self.view in ("title", "summary"))
+
+
+
+    def _view_texts(self, retrieval_dict: dict) -> list[str]:
+        contents = [content or "" for content in retrieval_dict["content"]]
+        if self.view == "content":
+            return contents
+
+        leads = [content[:self.view_chars] for content in contents]
+        if self.view == "prefix":
+            return leads
+
+        # chunks without a title fall back to their lead
+        titles = retrieval_dict.get("title") or [""] * len(contents)
+        if self.view == "title":
+            return [title or lead for title, lead in zip(titles, leads)]
+
+        return [f"{title}\n{lead}" if title else lead for title, lead in zip(titles, leads)]
+
+
+
+    def _shard_budget(self, query: str) -> int:
+        # CONTEXT_RESERVE covers the instructions and the response
+        budget = label_context_limit(self.reasoner_model) - CONTEXT_RESERVE - _estimate_tokens(query)
+        if self.shard_tokens:
+            budget = min(budget, self.shard_tokens)
+
+        return max(1, budget)
+
+
+
+    async def _select_shards(self, query: str, shards: list[list[str]]) -> list[List[str]]:
+        semaphore = asyncio.Semaphore(REASONER_SHARD_CONCURRENCY)
+
+        async def select(shard: list[str]) -> List[str]:
+            async with semaphore:
+                return await self._retrieve_ids(query, "".join(shard))
+
+        return await asyncio.gather(*(select(shard) for shard in shards))
+
+
+
     async def run_retriever(self, query: str, retrieval_dict: dict):
-        retrieval_input_chunks = ""
-        for retrieval_id, content in zip(retrieval_dict["retrieval_id"], retrieval_dict["content"]):
-            retrieval_input_chunks += f"CHUNK_ID={retrieval_id}\n{content}\n\n"
+        """
+        Candidates that fit the context of the reasoner model are selected in one call. Larger candidate sets are
+        map-reduced: shards within the budget are selected in parallel, then their winners are sharded and selected
+        again until they fit one call, so latency follows the shard size instead of the number of candidates.
+        With a prefilter, only its top candidates are sent.
+
+        Chunks are listed under dense aliases (1..N) instead of their retrieval_id, which costs fewer prompt and output
+        tokens; returned aliases are translated back, unknown ones are dropped.
+        Each chunk is shown through the view of this retriever (full content, title, summary or prefix).
+        """
+        if self.prefilter_spec and len(retrieval_dict["retrieval_id"]) > self.prefilter_spec["retrieval_amount"]:
+            retrieval_dict = await self._prefilter(query, retrieval_dict)
+
+        budget = self._shard_budget(query)
+
+        # alias -> retrieval_id, alias -> prompt entry
+        aliases: dict[str, Any] = {}
+        chunks: dict[str, str] = {}
+        for alias, (retrieval_id, content) in enumerate(zip(retrieval_dict["retrieval_id"], self._view_texts(retrieval_dict)), start=1):
+            chunk = f"CHUNK_ID={alias}\n{content}\n\n"
+
+            # a single chunk above the budget is cut, it would overflow any prompt
+            if _estimate_tokens(chunk) > budget:
+                chunk = _truncate_to_tokens(chunk, budget, suffix="\n\n")
+
+            aliases[str(alias)] = retrieval_id
+            chunks[str(alias)] = chunk
+
+        candidate_aliases = list(chunks)
+        shards = split_batches([chunks[i] for i in candidate_aliases], max(1, len(candidate_aliases)), budget)
+
+        while len(shards) > 1:
+            self.logger.log_step(task="info_text", layer=2, log_text=f"Selecting from {len(candidate_aliases)} chunks in {len(shards)} shards")
+
+            # each shard lists its aliases best first: the position is the reducer's score (lower is better)
+            ranks: dict[str, int] = {}
+            for shard_aliases in await self._select_shards(query, shards):
+                for rank, alias in enumerate(dict.fromkeys(shard_aliases)):
+                    ranks.setdefault(alias, rank)
+
+            # unknown aliases are dropped; winners keep the candidate order
+            winners = [alias for alias in candidate_aliases if alias in ranks]
+
+            # every shard kept all of its chunks: another round would not shrink them, so the best ranked are returned
+            # (stable sort: the shards' top picks first, in candidate order)
+            if len(winners) == len(candidate_aliases):
+                winners.sort(key=ranks.__getitem__)
+                return [aliases[alias] for alias in (winners[:self.k] if self.k else winners)]
+
+            candidate_aliases = winners
+            shards = split_batches([chunks[i] for i in candidate_aliases], max(1, len(candidate_aliases)), budget)
 
-        retrieval_output_ids = self._retrieve_ids(query, retrieval_input_chunks)
+        if not candidate_aliases:
+            return []
+
+        # set lookups: hallucinated or repeated aliases are dropped without scanning the candidates
+        valid_aliases = set(candidate_aliases)
+        output_aliases = dict.fromkeys(alias for alias in await self._retrieve_ids(query, "".join(shards[0])) if alias in valid_aliases)
+        retrieval_output_ids = [aliases[alias] for alias in output_aliases]
 
         # content_mask = [i in retrieval_output_ids for i in retrieval_dict["retrieval_id"]]
         # output_dict = {"retrieval_id": retrieval_output_ids, "content": retrieval_dict["content"][content_mask]}
@@ -885,6 +1195,10 @@ class ReasonerRetriever(BaseRetriever):
 
 
 
+# values per IN (...) clause, below SQLite's bound-parameter limit
+SQL_IN_BATCH_SIZE = 500
+
+
 class EmbeddingRetriever(BaseRetriever):
     """
     Contains all functionality to generate embeddings of a query and retrieval_input, and provide retrieval_output based on cosine similarity.
@@ -896,7 +1210,7 @@ class EmbeddingRetriever(BaseRetriever):
     Provides two methods: generate_embeddings, similarity_search
     """
 
-    def __init__(self, db: AsyncSession, logger: InfoLogger, user_id: UUID, project_id: UUID, level: str, retrieval_amount: int, embedding_model: str, query_transformation_model: str, query_transformation_prompt: Optional[str] = "A new version of this query in the same language, suited for chunk retrieval with LLMs", doc_id: Optional[UUID] = None):
+    def __init__(self, db: AsyncSession, logger: InfoLogger, user_id: UUID, project_id: UUID, level: str, retrieval_amount: int, embedding_model: str, query_transformation_model: str, query_transformation_prompt: Optional[str] = "A new version of this query in the same language, suited for chunk retrieval with LLMs", doc_id: Optional[UUID] = None, hnsw_m: Optional[str] = None, hnsw_ef_search: Optional[str] = None, hnsw_min_elements: Optional[str] = None, storage: Optional[str] = "float32", rescore_factor: Optional[str] = None):
 
         super().__init__(db=db, logger=logger, user_id=user_id, project_id=project_id, doc_id=doc_id, level=level, retrieval_amount=retrieval_amount, query_transformation_model=query_transformation_model, query_transformation_prompt=query_transformation_prompt)  # modern Python 3 style, no super(EmbeddingRetriever, self)
 
@@ -906,12 +1220,38 @@ class EmbeddingRetriever(BaseRetriever):
 
         self.embedding_orchestrator: Optional[EmbeddingOrchestrator] = None
 
+        # HNSW tuning, only used by the router (see run_router_index)
+        self.hnsw_m = self._safe_int(hnsw_m, "hnsw_m", HNSW_DEFAULT_M)
+        self.hnsw_ef_search = self._safe_int(hnsw_ef_search, "hnsw_ef_search", HNSW_DEFAULT_EF_SEARCH)
+        self.hnsw_min_elements = self._safe_int(hnsw_min_elements, "hnsw_min_elements", HNSW_MIN_ELEMENTS)
+
+        # Storage mode: compact vectors are scanned, then the best k * rescore_factor are rescored in float32
+        self.storage = storage or "float32"
+        if self.storage not in EMBEDDING_DTYPES:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for 'storage'. Must be one of {', '.join(EMBEDDING_DTYPES)}, got: {storage!r}"
+            )
+        self.rescore_factor = max(1, self._safe_int(rescore_factor, "rescore_factor", DEFAULT_RESCORE_FACTOR))
+
 
 
     # ============================================================
     # INTERNAL HELPERS
     # ============================================================
 
+    @staticmethod
+    def _safe_int(value: Optional[str], name: str, default: int) -> int:
+        if value in (None, ""):
+            return default
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for '{name}'. Must be an integer, got: {value!r}"
+            )
+
     async def init_embedding_client(self):
 
         user_key_list = await get_user_api_keys(user_id=self.user_id, base_api="https://chat-ai.academiccloud.de/v1", db=self.db)
@@ -922,19 +1262,16 @@ class EmbeddingRetriever(BaseRetriever):
 
 
 
-    async def _embed(self, texts):
+    async def _embed(self, texts, label: Optional[str] = None) -> tuple[list, str]:
+        # one model for all texts: returns the embeddings and the value of the model that produced them
+        embeddings, model = await self.embedding_orchestrator.embed_document(texts, label=label or self.embedding_model)
 
-        embeddings = await self.embedding_orchestrator.get_embedding(texts, label=self.embedding_model)  # embeddings
-
-        return embeddings
+        return embeddings, model
 
     async def generate_embeddings(self, filter_ids: Optional[Iterable] = ()) -> None:
 
         # filter_ids are always empty, since embeddings are generated before retrieval
 
-        # Delete previous embeddings of this doc and level in the "Embeddings" table
-        await Embedding.delete_data(where_dict={"user_id": self.user_id, "project_id": self.project_id, "doc_id": self.doc_id, "level": self.level}, db=self.db)
-
         # initialize embedding orchestrator
         await self.init_embedding_client()
 
@@ -942,33 +1279,276 @@ class EmbeddingRetriever(BaseRetriever):
 
         #self.logger.log_step(log_text=f"Embedding the retrieval input of each {self.level}")
 
-        retrieval_dict = await self.filter_retrieval_content(filter_ids)
+        # the retrieval filter below skips content, embedding needs it
+        retrieval_dict = await super().filter_retrieval_content(filter_ids)
 
+        if not retrieval_dict:
+            await self._delete_embeddings(retrieval_ids=[])
+            await self.db.commit()
+            self._invalidate_router_index()
 
-        # Additional Deleting of possible matches of the retrieval_ids with other documents
-        for retrieval_id in retrieval_dict["retrieval_id"]:
-            await Embedding.delete_data(where_dict={"user_id": self.user_id, "project_id": self.project_id, "retrieval_id": retrieval_id}, db=self.db)
+            if self.doc_id:
+                for dtype in EMBEDDING_DTYPES:
+                    remove_matrix(*get_embedding_paths(self.user_id, self.project_id, self.doc_id, self.level, dtype))
+            return
 
+        # Embed the retrieval input content: unchanged chunks come from the cache, only new content goes to the API.
+        # Previous embeddings stay in place until the new ones are ready.
+        emb_matrix = await self._embed_cached(retrieval_dict["content"])
 
+        # the table only keeps the compact form of the selected storage mode
+        blobs = encode_vectors(emb_matrix, self.storage)
 
-        # Embed the retrieval input content asynchronously
-        async def embed_columns(input_dict):
+        # Replace the stored embeddings in one transaction: set-based deletes, one executemany insert, one commit
+        await self._delete_embeddings(retrieval_ids=retrieval_dict["retrieval_id"])
 
-            embeddings = await self._embed(input_dict["content"])
+        await Embedding.bulk_insert_data(rows=[
+            {"user_id": self.user_id, "project_id": self.project_id, "doc_id": self.doc_id, "level": self.level, "retrieval_id": retrieval_id, "embedding": blob, "dtype": self.storage, "normalized": True}
+            for retrieval_id, blob in zip(retrieval_dict["retrieval_id"], blobs)
+        ], db=self.db)
 
-            embeddings = [struct.pack(f"{len(e)}f", *e) for e in embeddings]
+        # sqlite-vec backend: mirror into the vec0 table of this project level, same transaction
+        if self._use_sqlite_vec():
+            await vec_insert(self.db, self.project_id, self.level, retrieval_dict["retrieval_id"], emb_matrix)
 
-            output_list = [{"user_id": self.user_id, "project_id": self.project_id, "retrieval_id": input_dict["retrieval_id"][i], "embedding": embeddings[i]} for i in range(len(embeddings))]
+        await self.db.commit()
+        self._invalidate_router_index()
 
-            return output_list
+        # Contiguous matrix next to the upload, memory-mapped at query time.
+        # The float32 matrix is always written: it is the rescoring source for compact storage modes.
+        if self.doc_id:
+            matrix_path, ids_path = get_embedding_paths(self.user_id, self.project_id, self.doc_id, self.level)
+            write_matrix(matrix_path, ids_path, emb_matrix, retrieval_dict["retrieval_id"])
 
-        retrieval_list = await embed_columns(retrieval_dict)
+            for dtype in EMBEDDING_DTYPES[1:]:
+                compact_path, _ = get_embedding_paths(self.user_id, self.project_id, self.doc_id, self.level, dtype)
+                if dtype == self.storage:
+                    codes, _ = quantize_vectors(emb_matrix, dtype)
+                    write_matrix(compact_path, ids_path, codes, retrieval_dict["retrieval_id"])
+                else:
+                    remove_matrix(compact_path)
 
 
-        for insert_dict in retrieval_list:
-            await Embedding.insert_data(data_dict=insert_dict, db=self.db)
 
-        await self.db.commit()
+
+    def _invalidate_router_index(self) -> None:
+        """
+        The project-level HNSW index of this level was built from the previous vectors: it is dropped, and the router
+        scans exactly until run_router_index rebuilds it (same role as vec_delete / vec_insert for sqlite-vec).
+        """
+        if self.doc_id and self.level != "rerank":
+            remove_hnsw(*get_index_paths(self.user_id, self.project_id, self.level))
+
+
+
+    async def _delete_embeddings(self, retrieval_ids: list) -> None:
+        """
+        Delete the previous embeddings of this doc and level, plus possible matches of the retrieval_ids with other documents.
+        Does not commit.
+        """
+        if self._use_sqlite_vec():
+            previous_rows, _ = await Embedding.get_all(columns=["retrieval_id"], where_dict={"user_id": self.user_id, "project_id": self.project_id, "doc_id": self.doc_id, "level": self.level}, db=self.db)
+            await vec_delete(self.db, self.project_id, self.level, [row["retrieval_id"] for row in previous_rows] + list(retrieval_ids))
+
+        await Embedding.bulk_delete_data(where_dict={"user_id": self.user_id, "project_id": self.project_id, "doc_id": self.doc_id, "level": self.level}, db=self.db)
+
+        for start in range(0, len(retrieval_ids), SQL_IN_BATCH_SIZE):
+            await Embedding.bulk_delete_data(where_dict={"user_id": self.user_id, "project_id": self.project_id, "retrieval_id": retrieval_ids[start:start + SQL_IN_BATCH_SIZE]}, db=self.db)
+
+
+
+    async def filter_retrieval_content(self, retrieval_ids: Optional[Iterable] = ()):
+        """
+        Below a router or a parent retriever, the candidates are a bitmap over the rows of the exported matrix,
+        taken from the hierarchy index: the scan needs no content, so there is no SQL round trip.
+        Falls back to the SQL filter when the document has no current matrix or index.
+
+        The router takes its candidates from a current HNSW index, or else from an id-only SQL filter:
+        only the retrieved top-k is read with content.
+        """
+        if self.level == "rerank":
+            return await super().filter_retrieval_content(retrieval_ids)
+
+        if not self.doc_id:
+            router_index = await self._load_router_index()
+            if router_index is not None:
+                index, index_ids = router_index
+                return {"retrieval_id": index_ids, "router_index": index}
+
+            return await super().filter_retrieval_content(retrieval_ids, with_content=False)
+
+        if retrieval_ids:
+            mapped = load_matrix(*get_embedding_paths(self.user_id, self.project_id, self.doc_id, self.level))
+            candidates = self._bitmap_candidates(retrieval_ids, mapped[1]) if mapped is not None else None
+
+            if candidates is not None:
+                return candidates
+
+        return await super().filter_retrieval_content(retrieval_ids)
+
+
+
+    def _use_sqlite_vec(self) -> bool:
+        # reranker embeddings are generated per query and never mirrored
+        return sqlite_vec_enabled() and self.level != "rerank"
+
+
+
+    async def _embed_query(self, query: str) -> np.ndarray:
+        # one remote call per distinct query across the router and all document retrievers
+        embedding = await self.embedding_orchestrator.get_query_embedding(query, label=self.embedding_model)
+
+        return np.asarray(embedding, dtype=np.float32)
+
+
+
+    async def _embed_cached(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed texts through the content-addressed EmbeddingCache, keyed by (embedding model, sha256 of the content).
+        The key is the model that produced the vector, not the label, since a label falls back across models.
+        The cache always holds float32 vectors: the export writes the float32 matrix that rescoring reads, and
+        the storage mode only quantizes the Embeddings table. Misses are inserted but not committed.
+        Returns the L2-normalized (n, d) float32 matrix in input order.
+        """
+        hashes = [content_hash(text) for text in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+
+        model_queue = EMBEDDING_SUBCATEGORIES.get(self.embedding_model)
+        model = model_queue[0].value if model_queue else self.embedding_model
+
+        cached = {}
+        for start in range(0, len(unique_hashes), SQL_IN_BATCH_SIZE):
+            rows, _ = await EmbeddingCache.get_all(columns=["content_hash", "embedding"], where_dict={"user_id": self.user_id, "embedding_model": model, "content_hash": unique_hashes[start:start + SQL_IN_BATCH_SIZE]}, db=self.db)
+            cached.update({row["content_hash"]: row["embedding"] for row in rows})
+
+        misses = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in cached}
+
+        if misses:
+            embeddings, used_model = await self._embed(list(misses.values()))
+
+            if used_model != model and cached:
+                # the primary model failed over: the cached hits live in another vector space,
+                # so the whole document is embedded again with the model that answered
+                misses = dict(zip(hashes, texts))
+                cached = {}
+                embeddings, used_model = await self._embed(list(misses.values()), label=used_model)
+
+            # unit length once at export, so query-time cosine similarity is a plain dot product
+            embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+            for text_hash, vector in zip(misses, embeddings):
+                cached[text_hash] = vector.tobytes()
+
+            # a concurrent export of the same content may have inserted the row meanwhile
+            await EmbeddingCache.bulk_insert_ignore_data(rows=[
+                {"user_id": self.user_id, "embedding_model": used_model, "content_hash": text_hash, "embedding": cached[text_hash]}
+                for text_hash in misses
+            ], db=self.db)
+
+        return self._stack_embeddings([cached[text_hash] for text_hash in hashes])
+
+
+
+    async def _load_mapped_embeddings(self, retrieval_dict: dict, dtype: str = "float32") -> Optional[tuple[np.ndarray, list]]:
+        """
+        Collect the candidate rows from the exported matrix files of each document.
+        For compact dtypes the quantized matrix is used where it exists, the float32 matrix otherwise.
+        Returns None if any file is missing or stale, so the caller falls back to the Embeddings table.
+        """
+        if self.level == "rerank":
+            return None
+
+        doc_ids = {self.doc_id} if self.doc_id else set(retrieval_dict.get("doc_id", []))
+        if not doc_ids:
+            return None
+
+        wanted_ids = np.asarray(retrieval_dict["retrieval_id"], dtype=np.int64)
+
+        # candidate bitmap from the hierarchy index, aligned with the rows of this document's matrix
+        row_mask = retrieval_dict.get("row_mask")
+
+        matrix_blocks, id_blocks = [], []
+        for doc_id in doc_ids:
+            mapped = None
+            if dtype != "float32":
+                mapped = load_matrix(*get_embedding_paths(self.user_id, self.project_id, doc_id, self.level, dtype))
+            if mapped is None:
+                mapped = load_matrix(*get_embedding_paths(self.user_id, self.project_id, doc_id, self.level))
+            if mapped is None:
+                return None
+
+            if row_mask is not None and len(row_mask) == len(mapped[1]):
+                matrix, ids = mapped[0][row_mask], mapped[1][row_mask]
+            else:
+                matrix, ids = select_rows(*mapped, wanted_ids)
+            matrix_blocks.append(matrix)
+            id_blocks.append(ids)
+
+        row_ids = np.concatenate(id_blocks)
+
+        # chunks were re-created after the last export
+        if len(row_ids) != len(np.unique(wanted_ids)):
+            return None
+
+        emb_matrix = matrix_blocks[0] if len(matrix_blocks) == 1 else np.concatenate(matrix_blocks)
+
+        return emb_matrix, row_ids.tolist()
+
+
+
+    async def _load_router_index(self) -> Optional[tuple[Any, np.ndarray]]:
+        """
+        The router scans every chunk of the project level. If a persisted HNSW index was built from
+        the current chunks of the level, return it with its labels; otherwise None (exact scan).
+        """
+        loaded = load_hnsw(*get_index_paths(self.user_id, self.project_id, self.level))
+        if loaded is None:
+            return None
+
+        index, index_ids, fingerprint = loaded
+
+        # stale index: chunks changed since the last export
+        if fingerprint != await level_fingerprint(self.db, self.user_id, self.project_id, self.level):
+            return None
+
+        return index, index_ids
+
+
+
+    async def _load_stored_embeddings(self, retrieval_ids: list) -> Optional[tuple[np.ndarray, list]]:
+        embedding_rows, columns = await Embedding.get_all(columns=["retrieval_id", "embedding", "dtype", "normalized"], where_dict={"user_id": self.user_id, "project_id": self.project_id, "retrieval_id": retrieval_ids}, db=self.db)
+
+        embedding_columns = rows_to_columns(embedding_rows)
+
+        if not embedding_columns:
+            return None
+
+        # Convert BLOBs into one contiguous float32 matrix, shape (N, dim)
+        emb_matrix = self._stack_embeddings(embedding_columns["embedding"], embedding_columns["dtype"])
+
+        # rows stored before normalization (migration not applied yet)
+        legacy = ~np.asarray(embedding_columns["normalized"], dtype=bool)
+        if legacy.any():
+            emb_matrix = emb_matrix.copy()
+            emb_matrix[legacy] = normalize_rows(emb_matrix[legacy])
+
+        return emb_matrix, embedding_columns["retrieval_id"]
+
+
+
+    async def _rescore(self, query_embedding: np.ndarray, candidates: dict, retrieval_dict: dict) -> dict:
+        """
+        Re-rank the candidates of a compact scan against the full-precision matrix files.
+        Keeps the compact ranking if the float32 rows are not available (e.g. DB fallback).
+        """
+        loaded = await self._load_mapped_embeddings({"retrieval_id": candidates["retrieval_id"], "doc_id": retrieval_dict.get("doc_id", [])})
+        if loaded is None:
+            return candidates
+
+        emb_matrix, row_ids = loaded
+        scores = self._similarity(query_embedding, emb_matrix)
+
+        return {"retrieval_id": row_ids, "cosine_similarity": scores}
 
 
 
@@ -978,80 +1558,138 @@ class EmbeddingRetriever(BaseRetriever):
         if not self.k:
             self.k = 1
 
+        if not retrieval_dict:
+            return []
 
         # initialize embedding orchestrator
         await self.init_embedding_client()
 
-        # 3. Load embeddings for these IDs, if they exist
+        # Router over a large level: approximate search on the persisted HNSW index
+        router_index = retrieval_dict.get("router_index")
+        if router_index is not None:
+            query_embedding = await self._embed_query(query)
+            return hnsw_search(router_index, query_embedding, self.k, self.hnsw_ef_search)
 
-        retrieval_ids = retrieval_dict["retrieval_id"]
+        # sqlite-vec backend: KNN and the retrieval_id filter run inside SQLite
+        if self._use_sqlite_vec():
+            query_embedding = await self._embed_query(query)
+            vec_ids = await vec_search(self.db, self.project_id, self.level, query_embedding, retrieval_dict["retrieval_id"], self.k)
+            if vec_ids is not None:
+                return vec_ids
 
-        embedding_rows, columns = await Embedding.get_all(columns=["embedding_id", "retrieval_id", "embedding"], where_dict={"user_id": self.user_id, "project_id": self.project_id, "retrieval_id": retrieval_ids}, db=self.db)
+        # 3. Load embeddings for these IDs, if they exist: exported matrix first, Embeddings table as fallback
+        loaded = await self._load_mapped_embeddings(retrieval_dict, self.storage)
+        if loaded is None:
+            loaded = await self._load_stored_embeddings(retrieval_dict["retrieval_id"])
 
-        embedding_columns = rows_to_columns(embedding_rows)
+        if loaded is None:
+            return []
+
+        emb_matrix, row_ids = loaded
+
+        # query vector, shape (d,)
+        query_embedding = await self._embed_query(query)
 
+        # 4. compute score: one matrix-vector product for all rows
+        scores = self._similarity(query_embedding, emb_matrix)
+        score_columns = {"retrieval_id": row_ids, "cosine_similarity": scores}
 
-        # 4. Compute cosine similarity using the static method
+        # 4b. compact storage: keep a wider candidate set and rescore it in full precision
+        if self.storage != "float32":
+            candidates = self.top_k_numpy(score_columns, "cosine_similarity", self.k * self.rescore_factor)
+            score_columns = await self._rescore(query_embedding, candidates, retrieval_dict)
 
+        # 5. Select top-k
+        top_k_embedding_columns = self.top_k_numpy(score_columns, "cosine_similarity", self.k)
 
-        # Convert BLOBs back to float32 vectors
 
-        vectors = [
-            list(struct.unpack(f"{len(b) // 4}f", b))
-            for b in embedding_columns["embedding"]
-        ]
+        #  6. Return retrieval_ids
+        return top_k_embedding_columns["retrieval_id"]
 
-        # Matrix als list-of-lists (kein np.vstack nötig)
-        emb_matrix = vectors  # shape: (N, dim) als Python list
+    @staticmethod
+    def _stack_embeddings(blobs: list[bytes], dtypes: Optional[list[str]] = None) -> np.ndarray:
+        """
+        Decode stored BLOBs into a (n, d) float32 matrix, with a single buffer copy per storage dtype.
+        """
+        dtypes = dtypes or ["float32"] * len(blobs)
 
-        # Query embedding als plain list
-        # _embed gibt jetzt list[list[float]] zurück → [0] reicht
-        query_embedding = (await self._embed([query]))[0]
+        groups: dict[str, list[int]] = {}
+        for i, dtype in enumerate(dtypes):
+            groups.setdefault(dtype, []).append(i)
 
-        # compute score
-        embedding_columns["cosine_similarity"] = self._cosine_similarity(query_embedding, emb_matrix)
+        decoded = {}
+        for dtype, idx in groups.items():
+            group_blobs = [blobs[i] for i in idx]
+            if len({len(b) for b in group_blobs}) == 1:
+                decoded[dtype] = decode_vectors(group_blobs, dtype)
 
-        # 5. Sort top-k
-        top_k_embedding_columns = self.top_k_numpy(embedding_columns, "cosine_similarity", self.k)
+        if not decoded or len(decoded) != len(groups) or len({matrix.shape[1] for matrix in decoded.values()}) != 1:
+            raise ExtractionError(
+                "Stored embeddings have inconsistent dimensions. Re-export the retrieval pipeline.",
+                status_code=409,
+            )
 
+        if len(decoded) == 1:
+            return next(iter(decoded.values()))
 
-        #  6. Return retrieval_ids
-        return top_k_embedding_columns["retrieval_id"]
+        emb_matrix = np.empty((len(blobs), next(iter(decoded.values())).shape[1]), dtype=np.float32)
+        for dtype, idx in groups.items():
+            emb_matrix[idx] = decoded[dtype]
+
+        return emb_matrix
+
+    @classmethod
+    def _similarity(cls, query_embedding: np.ndarray, emb_matrix: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity against stored vectors, which are unit length: a dot product with the normalized query.
+        int8 codes carry their scale outside the matrix file, so they keep the full cosine (the scale cancels out).
+        """
+        if emb_matrix.dtype == np.int8:
+            return cls._cosine_similarity(query_embedding, emb_matrix)
+
+        query_unit = normalize_rows(query_embedding.reshape(1, -1))[0]
+
+        return emb_matrix.astype(np.float32, copy=False) @ query_unit
 
     @staticmethod
-    def _cosine_similarity(query_embedding: list[float], emb_matrix: list[list[float]]) -> list[float]:
+    def _cosine_similarity(query_embedding: np.ndarray, emb_matrix: np.ndarray) -> np.ndarray:
         """
         Compute cosine similarity between a single query vector and a matrix of embeddings.
 
         Parameters:
-            query_embedding : list[float], length d
-            emb_matrix      : list[list[float]], shape (n, d)
+            query_embedding : np.ndarray, shape (d,)
+            emb_matrix      : np.ndarray, shape (n, d)
 
         Returns:
-            sims : list[float], length n
+            sims : np.ndarray, shape (n,)
         """
-        query_norm = math.sqrt(sum(x * x for x in query_embedding))
+        # compact (float16 / int8) matrices are scored in float32
+        emb_matrix = emb_matrix.astype(np.float32, copy=False)
+
+        query_norm = np.linalg.norm(query_embedding)
+        row_norms = np.linalg.norm(emb_matrix, axis=1)
+        denom = row_norms * query_norm
 
-        sims = []
-        for row in emb_matrix:
-            dot = sum(a * b for a, b in zip(row, query_embedding))
-            row_norm = math.sqrt(sum(x * x for x in row))
-            denom = row_norm * query_norm
-            sims.append(dot / denom if denom != 0.0 else 0.0)
+        dots = emb_matrix @ query_embedding
 
-        return sims
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0.0)
 
 
 
     @staticmethod
     def top_k_numpy(col_dict: dict, sort_col: str, k: int) -> dict:
-        values = col_dict[sort_col]  # list[float]
+        values = np.asarray(col_dict[sort_col])
+        k = min(k, len(values))
 
-        # Top-k indices sortiert absteigend nach similarity
-        sorted_idx = sorted(range(len(values)), key=lambda i: values[i], reverse=True)[:k]
+        if k <= 0:
+            return {col: [] for col in col_dict}
+
+        # Partial selection of the k best rows, then sort only those k (descending)
+        top_idx = np.argpartition(-values, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-values[top_idx], kind="stable")]
 
         return {
-            col: [col_dict[col][i] for i in sorted_idx]
+            col: [col_dict[col][i] for i in top_idx]
             for col in col_dict
         }
 
@@ -1059,18 +1697,32 @@ class EmbeddingRetriever(BaseRetriever):
 
 
 
-import math
-from collections import Counter, defaultdict
-
 class BM25Retriever(BaseRetriever):
 
-    def __init__(self, db: AsyncSession, logger: InfoLogger, user_id: UUID, project_id: UUID, level: str, retrieval_amount: int, query_transformation_model: str, query_transformation_prompt: str, doc_id: UUID, k1: str, b: str):
+    def __init__(self, db: AsyncSession, logger: InfoLogger, user_id: UUID, project_id: UUID, level: str, retrieval_amount: int, query_transformation_model: str, query_transformation_prompt: str, doc_id: UUID, k1: str, b: str, backend: Optional[str] = "index", statistics: Optional[str] = "corpus"):
 
         super().__init__(db=db, logger=logger, user_id=user_id, doc_id=doc_id, project_id=project_id, level=level, retrieval_amount=retrieval_amount, query_transformation_model=query_transformation_model, query_transformation_prompt=query_transformation_prompt)
 
         self.k1 = self._safe_float(k1, "k1")
         self.b = self._safe_float(b, "b")
 
+        # "index": exported inverted index (exact k1 / b), "fts5": SQLite FTS5 mirror ranked by its bm25()
+        self.backend = backend or "index"
+        if self.backend not in KEYWORD_BACKENDS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for 'backend'. Must be one of {', '.join(KEYWORD_BACKENDS)}, got: {backend!r}"
+            )
+
+        # "corpus": df / avgdl of the whole level, shared with the other retrievers of the level; "candidates": of the candidates only.
+        # FTS5 always ranks with the statistics of its mirror
+        self.statistics = statistics or "corpus"
+        if self.statistics not in BM25_STATISTICS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Invalid value for 'statistics'. Must be one of {', '.join(BM25_STATISTICS)}, got: {statistics!r}"
+            )
+
 
 
     @staticmethod
@@ -1086,75 +1738,243 @@ class BM25Retriever(BaseRetriever):
 
     def _tokenize(self, text: str):
         # simple whitespace + punctuation tokenizer
-        text = text.lower()
-        return re.findall(r"\b\w+\b", text)
+        return tokenize(text)
 
-    async def run_retriever(self, query: str, retrieval_dict: dict):
+
+
+    async def generate_index(self) -> None:
         """
-        Args:
-            query (str)
-            retrieval_dict (dict):
-                {
-                    "retrieval_id": [id1, id2, ...],
-                    "content": [chunk1, chunk2, ...]
-                }
+        Export the inverted index of this level, one file per document: chunks are tokenized once here instead of on every query.
+        A router (no doc_id) exports the files of every document in the project.
+        """
+        retrieval_dict = await super().filter_retrieval_content()
 
-        Returns:
-            List of retrieval_id values for top-k retrieved chunks.
+        if not retrieval_dict:
+            if self.doc_id:
+                remove_inverted_index(get_keyword_index_path(self.user_id, self.project_id, self.doc_id, self.level))
+            return
+
+        doc_ids = [self.doc_id] * len(retrieval_dict["retrieval_id"]) if self.doc_id else retrieval_dict["doc_id"]
+
+        documents: dict[UUID, tuple[list, list]] = {}
+        for doc_id, retrieval_id, content in zip(doc_ids, retrieval_dict["retrieval_id"], retrieval_dict["content"]):
+            ids, contents = documents.setdefault(doc_id, ([], []))
+            ids.append(retrieval_id)
+            contents.append(content)
+
+        for doc_id, (ids, contents) in documents.items():
+            # CPU-bound: keep the event loop free while the chunks are tokenized
+            index = await asyncio.to_thread(build_inverted_index, ids, contents)
+            if len(ids) <= CSR_MAX_ROWS:
+                index.set_weights(self.k1, self.b)
+            write_inverted_index(get_keyword_index_path(self.user_id, self.project_id, doc_id, self.level), index)
+
+
+
+    async def filter_retrieval_content(self, retrieval_ids: Optional[Iterable] = ()):
         """
+        Below a router or a parent retriever, the candidates are a bitmap over the rows of the exported inverted index,
+        so no chunk content is loaded. Falls back to the SQL filter when the document has no current index.
+        The FTS5 backend only needs the candidate ids; without filter_ids they are the whole scope, which is filtered in SQLite.
+        """
+        if self._use_fts():
+            candidates = await super().filter_retrieval_content(retrieval_ids, with_content=False)
+            if candidates and not retrieval_ids:
+                candidates["scope_only"] = True
+            return candidates
+
+        if retrieval_ids and self.doc_id and self.level != "rerank":
+            index = load_inverted_index(get_keyword_index_path(self.user_id, self.project_id, self.doc_id, self.level))
+            candidates = self._bitmap_candidates(retrieval_ids, index.ids) if index is not None else None
+
+            if candidates is not None:
+                return candidates
 
-        retrieval_ids = retrieval_dict["retrieval_id"]
-        documents = retrieval_dict["content"]
-        #assert len(retrieval_ids) == len(documents), "Input lists must be same length"
+        return await super().filter_retrieval_content(retrieval_ids)
 
-        # ---- Tokenize documents ----
-        tokenized_docs = [self._tokenize(doc) for doc in documents]
-        doc_lengths = [len(doc) for doc in tokenized_docs]
-        avgdl = sum(doc_lengths) / len(doc_lengths)
 
-        # ---- Compute term frequencies ----
-        tf = [Counter(doc) for doc in tokenized_docs]
 
-        # ---- Compute document frequencies ----
-        df = defaultdict(int)
-        for doc in tokenized_docs:
-            for term in set(doc):
-                df[term] += 1
+    def _use_fts(self) -> bool:
+        # reranker candidates span documents and come with their content
+        return self.backend == "fts5" and fts5_available() and self.level != "rerank"
 
-        N = len(documents)
 
-        # ---- Compute IDF ----
-        idf = {}
-        for term, freq in df.items():
-            idf[term] = math.log(1 + (N - freq + 0.5) / (freq + 0.5))
 
-        # ---- Score documents for query ----
+    async def _rank_fts(self, query: str, retrieval_dict: dict) -> list:
+        """
+        Top-k inside SQLite: MATCH on the FTS5 mirror, scope and candidate filters on Retrievals, ORDER BY bm25().
+        Candidates without any query token follow in candidate order, like the other backends.
+        """
         query_tokens = self._tokenize(query)
-        scores = []
+        candidate_ids = retrieval_dict["retrieval_id"]
+        if not query_tokens or self.k <= 0:
+            return candidate_ids[:self.k]
+
+        fts = sa_table(FTS_TABLE, sa_column("rowid"))
+        score = func.bm25(literal_column(FTS_TABLE)).label("score")
+
+        stmt = (
+            select(Retrieval.retrieval_id, score)
+            .join(fts, fts.c.rowid == Retrieval.retrieval_id)
+            .where(
+                text(f"{FTS_TABLE} MATCH :match").bindparams(match=fts_match_expression(query_tokens)),
+                Retrieval.user_id == self.user_id,
+                Retrieval.project_id == self.project_id,
+                Retrieval.level == self.level,
+            )
+            .order_by(score, Retrieval.retrieval_id)
+            .limit(self.k)
+        )
+        if self.doc_id:
+            stmt = stmt.where(Retrieval.doc_id == self.doc_id)
 
-        for i, doc_tf in enumerate(tf):
-            score = 0.0
-            dl = doc_lengths[i]
+        # without filter_ids the scope is the candidate set, so no id list is sent
+        if retrieval_dict.get("scope_only"):
+            batches = [stmt]
+        else:
+            batches = [stmt.where(Retrieval.retrieval_id.in_(candidate_ids[start:start + SQL_IN_BATCH_SIZE])) for start in range(0, len(candidate_ids), SQL_IN_BATCH_SIZE)]
+
+        matches = []
+        for batch in batches:
+            matches += (await self.db.execute(batch)).all()
+
+        # bm25() is lower for better matches
+        matches.sort(key=lambda row: (row.score, row.retrieval_id))
+        top_ids = [row.retrieval_id for row in matches[:self.k]]
+
+        if len(top_ids) < self.k:
+            matched = set(top_ids)
+            top_ids += [retrieval_id for retrieval_id in candidate_ids if retrieval_id not in matched][:self.k - len(top_ids)]
+
+        return top_ids
 
-            for term in query_tokens:
-                if term not in doc_tf:
-                    continue
 
-                freq = doc_tf[term]
-                numerator = freq * (self.k1 + 1)
-                denominator = freq + self.k1 * (1 - self.b + self.b * dl / avgdl)
-                score += idf.get(term, 0) * (numerator / denominator)
 
-            scores.append({"id": retrieval_ids[i], "score": score})
+    def _load_index_blocks(self, retrieval_dict: dict) -> Optional[list[tuple[Any, np.ndarray]]]:
+        """
+        One (inverted index, candidate row mask) block per document.
+        Returns None if any index is missing or stale, so the caller scans the chunk content instead.
+        """
+        if self.level == "rerank":
+            return None
+
+        doc_ids = {self.doc_id} if self.doc_id else set(retrieval_dict.get("doc_id", []))
+        if not doc_ids:
+            return None
+
+        wanted_ids = np.asarray(retrieval_dict["retrieval_id"], dtype=np.int64)
+        row_mask = retrieval_dict.get("row_mask")
+
+        blocks = []
+        for doc_id in doc_ids:
+            index = load_inverted_index(get_keyword_index_path(self.user_id, self.project_id, doc_id, self.level))
+            if index is None:
+                return None
+
+            if row_mask is not None and len(row_mask) == len(index.ids):
+                blocks.append((index, row_mask))
+            else:
+                blocks.append((index, np.isin(index.ids, wanted_ids)))
 
-        # ---- Sort & return top-k retrieval_ids ----
-        scores.sort(key=lambda x: x["score"], reverse=True)
-        top_ids = [entry["id"] for entry in scores[:self.k]]
+        # chunks were re-created after the last export
+        if sum(int(mask.sum()) for _, mask in blocks) != len(np.unique(wanted_ids)):
+            return None
+
+        return blocks
+
+
+
+    async def _corpus_statistics(self):
+        """
+        df / avgdl of this (project, level) at its current content: computed once from the chunk content,
+        then reused by every BM25Retriever of the level while the fingerprint of its rows is unchanged.
+        """
+        if self.statistics != "corpus" or self.level == "rerank":
+            return None
+
+        fingerprint = await level_fingerprint(self.db, self.user_id, self.project_id, self.level)
+        statistics = cached_corpus_statistics(self.project_id, self.level, fingerprint)
+        if statistics is not None:
+            return statistics
+
+        rows, _ = await Retrieval.get_all(
+            where_dict={"user_id": self.user_id, "project_id": self.project_id, "level": self.level},
+            db=self.db,
+            columns=["content"],
+        )
+
+        # CPU-bound: keep the event loop free while the chunks are tokenized
+        statistics = await asyncio.to_thread(build_corpus_statistics, [row["content"] for row in rows])
+        store_corpus_statistics(self.project_id, self.level, fingerprint, statistics)
+
+        return statistics
+
+
+
+    def _rank_indexed(self, query: str, retrieval_dict: dict, blocks: list[tuple[Any, np.ndarray]], corpus=None) -> list:
+        """
+        Top-k from the inverted index, in the order of the content scan: score descending, ties in candidate order,
+        candidates without any query token last.
+        """
+        index, mask = blocks[0]
+
+        # whole (mid-sized) level of one document: sparse row-sum over the weight matrix of this k1 / b (idf of the
+        # document), or over the query terms' postings weighted with the corpus statistics of the level
+        if len(blocks) == 1 and len(index.ids) <= CSR_QUERY_MAX_ROWS and (corpus is not None or index.has_weights(self.k1, self.b)) and mask.all():
+            scores = bm25_matrix_scores(index, [self._tokenize(query)], corpus, self.k1, self.b)[0]
+            matched = np.flatnonzero(scores)
+            ids, scores = index.ids[matched], scores[matched]
+
+        # block-max pruning: only rows that can still reach the top-k are scored
+        else:
+            ids, scores = bm25_top_k(blocks, self._tokenize(query), self.k1, self.b, self.k, corpus)
+
+        candidate_ids = np.asarray(retrieval_dict["retrieval_id"], dtype=np.int64)
+
+        order = np.argsort(candidate_ids, kind="stable")
+        positions = order[np.searchsorted(candidate_ids, ids, sorter=order)]
+
+        top_ids = ids[np.lexsort((positions, -scores))][:self.k].tolist()
+
+        if len(top_ids) < self.k:
+            unmatched = candidate_ids[~np.isin(candidate_ids, ids)]
+            top_ids += unmatched[:self.k - len(top_ids)].tolist()
 
         return top_ids
 
 
 
+    async def run_retriever(self, query: str, retrieval_dict: dict):
+        """
+        Args:
+            query (str)
+            retrieval_dict (dict):
+                {
+                    "retrieval_id": [id1, id2, ...],
+                    "content": [chunk1, chunk2, ...]
+                }
+
+        Returns:
+            List of retrieval_id values for top-k retrieved chunks.
+        """
+
+        if self._use_fts():
+            return await self._rank_fts(query, retrieval_dict)
+
+        # exported inverted index: only the postings of the query tokens are read
+        blocks = self._load_index_blocks(retrieval_dict)
+
+        # no current export: index the candidate content in memory
+        if blocks is None:
+            index = build_inverted_index(retrieval_dict["retrieval_id"], retrieval_dict["content"])
+            if len(index.ids) <= CSR_QUERY_MAX_ROWS:
+                index.set_weights(self.k1, self.b)
+            blocks = [(index, np.ones(len(index.ids), dtype=bool))]
+
+        return self._rank_indexed(query, retrieval_dict, blocks, await self._corpus_statistics())
+
+
+
 # ====================================================================
 # ============================ Evaluator ============================
 # ====================================================================
@@ -1237,7 +2057,7 @@ class Evaluator:
             ---
             """.strip()
 
-        chat_output = self.chat_orchestrator.call(
+        chat_output = await self.chat_orchestrator.call(
             label=self.transformation_model,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
@@ -1336,7 +2156,7 @@ class Evaluator:
         """.strip()
 
         # chat orchestrator already instanced by BaseRetriever
-        chat_output = self.chat_orchestrator.call(
+        chat_output = await self.chat_orchestrator.call(
             label=self.reasoner_model,
             system_prompt=system_prompt,
             user_prompt=user_prompt,
@@ -1573,8 +2393,6 @@ async def run_retrieval(db, user_id, query, history, progress=None):
 
 
 
-from sqlalchemy import select
-
 async def get_retrieval_output(db, user_id, project_id, session_logger, query, history, progress=None):
     main_pipeline = await MainPipeline.get_row(where_dict={"user_id": user_id, "project_id": project_id}, db=db)
     router, reranker, doc_pipelines = None, None, None
@@ -1857,6 +2675,7 @@ async def run_document_pipeline(query, input_ids, input_pipeline, logger, user_i
 
 EMBEDDING_TYPE_MAPPER = {
     "EmbeddingRetriever": EmbeddingRetriever,
+    "BM25Retriever": BM25Retriever,
 }
 
 async def run_embeddings(method_list: list[dict[str, Any]], user_id: UUID, project_id: UUID, doc_id: UUID, db: AsyncSession):
@@ -1877,7 +2696,12 @@ async def run_embeddings(method_list: list[dict[str, Any]], user_id: UUID, proje
 
 
         method_instance = EMBEDDING_TYPE_MAPPER[method_type](**method)
-        await method_instance.generate_embeddings()
+
+        # BM25 exports its inverted index instead of embeddings
+        if isinstance(method_instance, BM25Retriever):
+            await method_instance.generate_index()
+        else:
+            await method_instance.generate_embeddings()
 
 
 
@@ -1896,13 +2720,23 @@ async def run_doc_embeddings(retrieval_pipeline, user_id, project_id, doc_id, db
         return False
 
 
-    # We run embeddings if needed
+    # We run embeddings (and BM25 indexes) if needed
     embedding_methods = [
         copy.deepcopy(method)
         for method in retrieval_pipeline
-        if method["type"] == "EmbeddingRetriever"
+        if method["type"] in EMBEDDING_TYPE_MAPPER
+    ]
+
+    # ReasonerRetriever prefilters search the same exports
+    embedding_methods += [
+        prefilter
+        for method in retrieval_pipeline
+        if method["type"] == "ReasonerRetriever" and (prefilter := ReasonerRetriever.prefilter_method(method))
     ]
 
+    # parent -> child adjacency for hierarchical filtering, used by every retriever of the pipeline
+    await run_hierarchy_index(user_id, project_id, doc_id, db)
+
     if embedding_methods:
         await run_embeddings(embedding_methods, user_id, project_id, doc_id, db)
 
@@ -1910,3 +2744,86 @@ async def run_doc_embeddings(retrieval_pipeline, user_id, project_id, doc_id, db
 
 
 
+async def run_hierarchy_index(user_id: UUID, project_id: UUID, doc_id: UUID, db: AsyncSession) -> None:
+    """
+    Export the hierarchy index of a document: the chunks of every level, linked through the level ids in the paragraph metadata.
+    """
+    retrieval_rows, _ = await Retrieval.get_all(columns=["retrieval_id", "level", "level_id"], where_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id}, db=db)
+    retrieval_columns = rows_to_columns([row for row in retrieval_rows if row["level"] != "rerank"])
+
+    paragraph_rows, _ = await Paragraph.get_all(columns=["paragraph_metadata"], where_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id}, db=db)
+
+    paragraph_levels = []
+    for row in paragraph_rows:
+        meta = row["paragraph_metadata"]
+        try:
+            meta = json.loads(meta) if isinstance(meta, str) else (meta or {})
+        except json.JSONDecodeError:
+            meta = {}
+        paragraph_levels.append(meta)
+
+    fingerprint = await retrieval_fingerprint(db, user_id, project_id, doc_id=doc_id)
+    write_hierarchy(get_hierarchy_path(user_id, project_id, doc_id), retrieval_columns, paragraph_levels, fingerprint)
+
+
+
+
+async def _load_level_blocks(user_id: UUID, project_id: UUID, level: str, db: AsyncSession) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    One (matrix, ids) block per document with embeddings at this level.
+    Exported matrix files are memory-mapped; documents without one are read from the Embeddings table.
+    """
+    rows, _ = await Embedding.get_all(columns=["doc_id"], where_dict={"user_id": user_id, "project_id": project_id, "level": level}, db=db)
+    doc_ids = {row["doc_id"] for row in rows}
+
+    blocks = []
+    for doc_id in doc_ids:
+        mapped = load_matrix(*get_embedding_paths(user_id, project_id, doc_id, level))
+
+        if mapped is None:
+            embedding_rows, _ = await Embedding.get_all(columns=["retrieval_id", "embedding", "dtype"], where_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": level}, db=db)
+            embedding_columns = rows_to_columns(embedding_rows)
+            mapped = (EmbeddingRetriever._stack_embeddings(embedding_columns["embedding"], embedding_columns["dtype"]), np.asarray(embedding_columns["retrieval_id"], dtype=np.int64))
+
+        blocks.append(mapped)
+
+    return blocks
+
+
+
+async def run_router_index(router_method: Dict[str, Any], user_id: UUID, project_id: UUID, db: AsyncSession) -> bool:
+    """
+    Build the HNSW index of an EmbeddingRetriever router over all chunks of its level.
+    Small levels get no index and are scanned exactly at query time.
+    A BM25Retriever router exports the inverted index of every document at its level.
+    A ReasonerRetriever router gets the index of its prefilter.
+    """
+    if router_method and router_method.get("type") == "ReasonerRetriever" and router_method.get("level"):
+        prefilter = ReasonerRetriever.prefilter_method(router_method)
+        return await run_router_index(prefilter, user_id, project_id, db) if prefilter else False
+
+    if router_method and router_method.get("type") == "BM25Retriever" and router_method.get("level"):
+        method = {key: value for key, value in router_method.items() if key not in ("type", "color")}
+        method.update({"logger": None, "user_id": user_id, "project_id": project_id, "doc_id": None, "db": db})
+        await BM25Retriever(**method).generate_index()
+        return True
+
+    if not router_method or router_method.get("type") != "EmbeddingRetriever" or not router_method.get("level"):
+        return False
+
+    level = router_method["level"]
+    index_path, meta_path = get_index_paths(user_id, project_id, level)
+
+    # taken before the vectors are read: a concurrent change leaves the index stale, never falsely current
+    fingerprint = await retrieval_fingerprint(db, user_id, project_id, level=level)
+
+    blocks = await _load_level_blocks(user_id, project_id, level, db)
+    if not blocks:
+        remove_hnsw(index_path, meta_path)
+        return False
+
+    m = EmbeddingRetriever._safe_int(router_method.get("hnsw_m"), "hnsw_m", HNSW_DEFAULT_M)
+    min_elements = EmbeddingRetriever._safe_int(router_method.get("hnsw_min_elements"), "hnsw_min_elements", HNSW_MIN_ELEMENTS)
+
+    # CPU-bound: keep the event loop free while the graph is built
+    return await asyncio.to_thread(build_hnsw, index_path, meta_path, blocks, m, min_elements=min_elements, fingerprint=fingerprint)
@@ -0,0 +1,555 @@
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Iterable, Optional
+from uuid import UUID
+
+import numpy as np
+
+from loguru import logger as AgentLogger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# optional: approximate nearest-neighbour search for large levels
+try:
+    import hnswlib
+except ImportError:  # pragma: no cover - depends on the "ann" extra
+    hnswlib = None
+
+
+
+# ---------------------------------------------
+
+# ---------- MEMORY-MAPPED EMBEDDINGS ----------
+
+# ---------------------------------------------
+
+# Each exported (project, doc, level) gets two .npy files next to the upload:
+#   <project_id>_<level>.unit.npy  float32 matrix of L2-normalized rows, shape (n, dim)
+#   <project_id>_<level>.ids.npy   int64 retrieval_ids, row i <-> ids[i]
+#
+# Files are opened with mmap_mode="r", so hot projects are served from the OS page cache.
+# Matrices without the ".unit" tag predate normalization and are converted by migration e5a2b8c61d07.
+
+
+# path -> (mtime_ns, matrix, ids)
+_MAPPED: dict[str, tuple[int, np.ndarray, np.ndarray]] = {}
+
+
+def _atomic_save(path: Path, array: np.ndarray) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+
+    os.replace(tmp_path, path)
+
+
+def write_matrix(matrix_path: Path, ids_path: Path, matrix: np.ndarray, ids: Iterable) -> None:
+    """
+    Persist an embedding matrix (float32, or the compact float16/int8 codes) and its retrieval_id sidecar.
+    """
+    if matrix.dtype not in (np.float16, np.int8):
+        matrix = matrix.astype(np.float32, copy=False)
+    matrix = np.ascontiguousarray(matrix)
+    ids = np.asarray(list(ids), dtype=np.int64)
+
+    if matrix.ndim != 2 or matrix.shape[0] != ids.shape[0]:
+        raise ValueError(f"Matrix shape {matrix.shape} does not match {ids.shape[0]} ids")
+
+    _atomic_save(ids_path, ids)
+    _atomic_save(matrix_path, matrix)
+
+    _MAPPED.pop(str(matrix_path), None)
+
+
+def load_matrix(matrix_path: Path, ids_path: Path) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """
+    Memory-map an exported matrix. Returns None if the export does not exist.
+    """
+    try:
+        mtime_ns = os.stat(matrix_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    key = str(matrix_path)
+    cached = _MAPPED.get(key)
+    if cached and cached[0] == mtime_ns:
+        return cached[1], cached[2]
+
+    try:
+        matrix = np.load(matrix_path, mmap_mode="r")
+        ids = np.load(ids_path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if matrix.ndim != 2 or matrix.shape[0] != ids.shape[0]:
+        return None
+
+    _MAPPED[key] = (mtime_ns, matrix, ids)
+
+    return matrix, ids
+
+
+def remove_matrix(matrix_path: Path, ids_path: Optional[Path] = None) -> None:
+    _MAPPED.pop(str(matrix_path), None)
+    for path in (matrix_path, ids_path):
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row (float32). Zero rows stay zero.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0.0)
+
+
+def select_rows(matrix: np.ndarray, ids: np.ndarray, wanted_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Restrict a mapped matrix to the rows whose id is in wanted_ids.
+    Only the selected rows are paged in.
+    """
+    mask = np.isin(ids, wanted_ids)
+
+    if mask.all():
+        return matrix, ids
+
+    return matrix[mask], ids[mask]
+
+
+
+
+# ---------------------------------------------
+
+# -------------- HIERARCHY INDEX --------------
+
+# ---------------------------------------------
+
+# Each exported (project, doc) also gets <project_id>.hierarchy.npz next to its matrices:
+#   levels    level names, one column each
+#   ids_<i>   sorted int64 retrieval_ids of level i; position j is bit j of that level's bitmaps
+#   paths     int32 (n_paragraphs, n_levels), the chunk position of each paragraph at every level, -1 if none
+#
+# A paragraph row links all of its ancestors, so the rows are the parent -> child adjacency of the document.
+# Filtering a child level by parent retrieval_ids is then a bitmap lookup plus a boolean AND, without SQL.
+
+
+# path -> (mtime_ns, index)
+_HIERARCHY: dict[str, tuple[int, "HierarchyIndex"]] = {}
+
+
+class HierarchyIndex:
+
+    def __init__(self, levels: list[str], ids: list[np.ndarray], paths: np.ndarray, fingerprint: Optional[tuple] = None):
+        self.levels = list(levels)
+        self.ids = ids
+        self.paths = paths
+        # fingerprint of the document's chunks at export time, compared against the database before use
+        self.fingerprint = fingerprint
+
+    def level_ids(self, level: str) -> Optional[np.ndarray]:
+        if level not in self.levels:
+            return None
+        return self.ids[self.levels.index(level)]
+
+    def children(self, filter_ids: Iterable, level: str) -> Optional[np.ndarray]:
+        """
+        Bitmap over level_ids(level) of the chunks below (or above) the given retrieval_ids, at any level.
+        Returns None if the level is unknown or none of the ids belongs to this document.
+        """
+        if level not in self.levels:
+            return None
+
+        filter_ids = np.asarray(list(filter_ids), dtype=np.int64)
+        selected = np.zeros(self.paths.shape[0], dtype=bool)
+        found = False
+
+        for col, ids in enumerate(self.ids):
+            parent_bitmap = np.isin(ids, filter_ids)
+            if not parent_bitmap.any():
+                continue
+
+            found = True
+            column = self.paths[:, col]
+            member = column >= 0
+            selected[member] |= parent_bitmap[column[member]]
+
+        if not found:
+            return None
+
+        column = self.paths[selected, self.levels.index(level)]
+        bitmap = np.zeros(len(self.level_ids(level)), dtype=bool)
+        bitmap[column[column >= 0]] = True
+
+        return bitmap
+
+    def row_mask(self, level: str, bitmap: np.ndarray, row_ids: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Project a level bitmap onto the rows of an exported matrix (row i <-> row_ids[i]).
+        Returns None if the matrix and the index were not exported from the same chunks.
+        """
+        ids = self.level_ids(level)
+        if ids is None or len(ids) != len(row_ids):
+            return None
+
+        positions = np.searchsorted(ids, row_ids)
+        if (positions >= len(ids)).any() or not np.array_equal(ids[positions], row_ids):
+            return None
+
+        return bitmap[positions]
+
+
+def write_hierarchy(path: Path, retrieval_columns: dict[str, list], paragraph_levels: list[dict[str, Any]], fingerprint: Optional[tuple] = None) -> None:
+    """
+    Persist the hierarchy index of one document.
+
+    retrieval_columns: {"retrieval_id": [...], "level": [...], "level_id": [...]} for every chunk of the document
+    paragraph_levels:  per paragraph, the {"<level>_id": level_id} entries of its metadata
+    fingerprint:       integers describing the chunks the index was built from, stored as is
+    """
+    levels = sorted(set(retrieval_columns.get("level", [])))
+
+    ids, lookup = [], []
+    for level in levels:
+        pairs = sorted(
+            (int(retrieval_id), int(level_id))
+            for retrieval_id, row_level, level_id in zip(retrieval_columns["retrieval_id"], retrieval_columns["level"], retrieval_columns["level_id"])
+            if row_level == level
+        )
+        ids.append(np.asarray([retrieval_id for retrieval_id, _ in pairs], dtype=np.int64))
+        lookup.append({level_id: position for position, (_, level_id) in enumerate(pairs)})
+
+    paths = np.full((len(paragraph_levels), len(levels)), -1, dtype=np.int32)
+    for row, meta in enumerate(paragraph_levels):
+        for col, level in enumerate(levels):
+            level_id = meta.get(f"{level}_id")
+            if level_id is not None:
+                paths[row, col] = lookup[col].get(int(level_id), -1)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    extra = {} if fingerprint is None else {"fingerprint": np.asarray(fingerprint, dtype=np.int64)}
+    with open(tmp_path, "wb") as f:
+        np.savez(f, levels=np.asarray(levels, dtype=str), paths=paths, **{f"ids_{i}": level_ids for i, level_ids in enumerate(ids)}, **extra)
+    os.replace(tmp_path, path)
+
+    _HIERARCHY.pop(str(path), None)
+
+
+def load_hierarchy(path: Path) -> Optional[HierarchyIndex]:
+    """
+    Load (and cache per mtime) the hierarchy index of a document. Returns None if it was never exported.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    key = str(path)
+    cached = _HIERARCHY.get(key)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    try:
+        with np.load(path) as data:
+            levels = data["levels"].tolist()
+            fingerprint = tuple(data["fingerprint"].tolist()) if "fingerprint" in data.files else None
+            index = HierarchyIndex(levels, [data[f"ids_{i}"] for i in range(len(levels))], data["paths"], fingerprint)
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+    _HIERARCHY[key] = (mtime_ns, index)
+
+    return index
+
+
+
+
+# ---------------------------------------------
+
+# --------------- QUANTIZATION ----------------
+
+# ---------------------------------------------
+
+# Storage modes of an EmbeddingRetriever. "float32" is lossless; the compact modes are scanned first
+# and the best candidates are rescored against the float32 matrix file.
+#   float16  2 bytes per dimension
+#   int8     1 byte per dimension + one float32 scale per vector (symmetric, max-abs)
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+DEFAULT_RESCORE_FACTOR = 4
+
+
+def quantize_vectors(matrix: np.ndarray, dtype: str) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Returns (codes, scales). scales is None except for int8, where row i ~= codes[i] * scales[i].
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if dtype == "float32":
+        return matrix, None
+
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        safe = np.where(scales == 0.0, 1.0, scales)
+        codes = np.clip(np.rint(matrix / safe[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    raise ValueError(f"Unknown embedding dtype: {dtype!r}")
+
+
+def encode_vectors(matrix: np.ndarray, dtype: str) -> list[bytes]:
+    """
+    One BLOB per row for the Embeddings table. int8 rows are prefixed with their float32 scale.
+    """
+    codes, scales = quantize_vectors(matrix, dtype)
+
+    if scales is None:
+        return [row.tobytes() for row in codes]
+
+    return [scale.tobytes() + row.tobytes() for scale, row in zip(scales, codes)]
+
+
+def decode_vectors(blobs: list[bytes], dtype: str) -> np.ndarray:
+    """
+    Inverse of encode_vectors: (n, d) float32 matrix. All blobs must share the same length.
+    """
+    n = len(blobs)
+    buffer = b"".join(blobs)
+
+    if dtype == "float32":
+        return np.frombuffer(buffer, dtype=np.float32).reshape(n, -1)
+
+    if dtype == "float16":
+        return np.frombuffer(buffer, dtype=np.float16).reshape(n, -1).astype(np.float32)
+
+    if dtype == "int8":
+        raw = np.frombuffer(buffer, dtype=np.uint8).reshape(n, -1)
+        scales = raw[:, :4].copy().view(np.float32)
+        codes = raw[:, 4:].view(np.int8)
+        return codes.astype(np.float32) * scales
+
+    raise ValueError(f"Unknown embedding dtype: {dtype!r}")
+
+
+
+
+# ---------------------------------------------
+
+# ---------------- HNSW INDEX -----------------
+
+# ---------------------------------------------
+
+# Default size below which a level is scanned exactly; HNSW only pays off on large corpora.
+HNSW_MIN_ELEMENTS = 20_000
+HNSW_DEFAULT_M = 16
+HNSW_DEFAULT_EF_CONSTRUCTION = 200
+HNSW_DEFAULT_EF_SEARCH = 64
+
+
+# path -> (mtime_ns, index, ids, fingerprint)
+_HNSW: dict[str, tuple[int, Any, np.ndarray, Optional[tuple]]] = {}
+
+
+def hnsw_available() -> bool:
+    return hnswlib is not None
+
+
+def build_hnsw(index_path: Path, meta_path: Path, blocks: list[tuple[np.ndarray, np.ndarray]], m: int = HNSW_DEFAULT_M, ef_construction: int = HNSW_DEFAULT_EF_CONSTRUCTION, min_elements: Optional[int] = None, fingerprint: Optional[tuple] = None) -> bool:
+    """
+    Build and persist a cosine HNSW index from (matrix, ids) blocks, e.g. one memory-mapped block per document.
+    Labels are the retrieval_ids themselves; the sorted labels, the dimension and the fingerprint of the
+    chunks it was built from go to the meta sidecar.
+
+    Returns False (and removes any previous index) when the level has fewer than min_elements vectors
+    (default HNSW_MIN_ELEMENTS), documents were embedded with different models, or hnswlib is missing.
+    """
+    total = sum(len(ids) for _, ids in blocks)
+    dims = {matrix.shape[1] for matrix, _ in blocks}
+    min_elements = HNSW_MIN_ELEMENTS if min_elements is None else min_elements
+
+    if hnswlib is None or total < min_elements or len(dims) != 1:
+        remove_hnsw(index_path, meta_path)
+        if hnswlib is None:
+            AgentLogger.warning("hnswlib not installed, skipping HNSW index", extra={"index": str(index_path)})
+        return False
+
+    dim = dims.pop()
+    index = hnswlib.Index(space="cosine", dim=dim)
+    index.init_index(max_elements=total, M=m, ef_construction=ef_construction)
+
+    # one block at a time, so only a single document's vectors are paged in
+    for matrix, ids in blocks:
+        index.add_items(np.ascontiguousarray(matrix, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    index.save_index(str(tmp_path))
+
+    all_ids = np.sort(np.concatenate([np.asarray(ids, dtype=np.int64) for _, ids in blocks]))
+    extra = {} if fingerprint is None else {"fingerprint": np.asarray(fingerprint, dtype=np.int64)}
+    tmp_meta = meta_path.with_name(meta_path.name + ".tmp")
+    with open(tmp_meta, "wb") as f:
+        np.savez(f, ids=all_ids, dim=np.int64(dim), **extra)
+    os.replace(tmp_meta, meta_path)
+    os.replace(tmp_path, index_path)
+
+    _HNSW.pop(str(index_path), None)
+
+    AgentLogger.info("HNSW index built", extra={"index": str(index_path), "elements": total, "M": m})
+    return True
+
+
+def load_hnsw(index_path: Path, meta_path: Path) -> Optional[tuple[Any, np.ndarray, Optional[tuple]]]:
+    """
+    Load a persisted index together with its sorted label array and build fingerprint. Returns None if unavailable.
+    """
+    if hnswlib is None:
+        return None
+
+    try:
+        mtime_ns = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    key = str(index_path)
+    cached = _HNSW.get(key)
+    if cached and cached[0] == mtime_ns:
+        return cached[1], cached[2], cached[3]
+
+    try:
+        with np.load(meta_path) as meta:
+            ids, dim = meta["ids"], int(meta["dim"])
+            fingerprint = tuple(meta["fingerprint"].tolist()) if "fingerprint" in meta.files else None
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+    # hnswlib needs the dimension up front to rebuild the distance space
+    index = hnswlib.Index(space="cosine", dim=dim)
+    index.load_index(str(index_path))
+
+    _HNSW[key] = (mtime_ns, index, ids, fingerprint)
+
+    return index, ids, fingerprint
+
+
+def hnsw_search(index, query_embedding: np.ndarray, k: int, ef_search: int = HNSW_DEFAULT_EF_SEARCH) -> list[int]:
+    k = min(k, index.get_current_count())
+    if k <= 0:
+        return []
+
+    # ef must be >= k
+    index.set_ef(max(ef_search, k))
+    labels, _ = index.knn_query(query_embedding.reshape(1, -1), k=k)
+
+    return labels[0].tolist()
+
+
+def remove_hnsw(index_path: Path, meta_path: Path) -> None:
+    _HNSW.pop(str(index_path), None)
+    for path in (index_path, meta_path):
+        path.unlink(missing_ok=True)
+
+
+
+
+# ---------------------------------------------
+
+# ---------------- SQLITE-VEC -----------------
+
+# ---------------------------------------------
+
+# With settings.VECTOR_BACKEND = "sqlite-vec", app.database loads the extension on every connection and
+# embeddings are mirrored into one vec0 table per (project, level, dimension), rowid = retrieval_id.
+# KNN and the retrieval_id filter then run inside SQLite instead of pulling BLOBs into Python.
+
+# sqlite-vec caps k per query
+SQLITE_VEC_MAX_K = 4096
+
+_SQLITE_VEC_LOADED = False
+
+
+def set_sqlite_vec_loaded(loaded: bool) -> None:
+    global _SQLITE_VEC_LOADED
+    _SQLITE_VEC_LOADED = loaded
+
+
+def sqlite_vec_enabled() -> bool:
+    return _SQLITE_VEC_LOADED
+
+
+def _vec_prefix(project_id: UUID, level: Optional[str] = None) -> str:
+    prefix = f"vec_{UUID(str(project_id)).hex}_"
+    if level is not None:
+        prefix += re.sub(r"\W", "_", level) + "_"
+    return prefix
+
+
+async def _vec_tables(db: AsyncSession, pattern: str) -> list[str]:
+    # vec0 shadow tables share the name prefix; only the virtual tables themselves are returned
+    result = await db.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'"))
+
+    return [name for name, in result.all() if re.fullmatch(pattern, name)]
+
+
+async def vec_delete(db: AsyncSession, project_id: UUID, level: str, retrieval_ids: Iterable) -> None:
+    """
+    Remove retrieval_ids from every vec0 table of this (project, level). Does not commit.
+    """
+    ids_json = json.dumps([int(i) for i in retrieval_ids])
+
+    for table in await _vec_tables(db, re.escape(_vec_prefix(project_id, level)) + r"\d+"):
+        await db.execute(text(f'DELETE FROM "{table}" WHERE rowid IN (SELECT value FROM json_each(:ids))'), {"ids": ids_json})
+
+
+async def vec_insert(db: AsyncSession, project_id: UUID, level: str, retrieval_ids: Iterable, matrix: np.ndarray) -> None:
+    """
+    Mirror L2-normalized float32 rows into the vec0 table of this (project, level). Does not commit.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    table = f"{_vec_prefix(project_id, level)}{matrix.shape[1]}"
+
+    await db.execute(text(f'CREATE VIRTUAL TABLE IF NOT EXISTS "{table}" USING vec0(embedding float[{matrix.shape[1]}] distance_metric=cosine)'))
+    await db.execute(
+        text(f'INSERT INTO "{table}" (rowid, embedding) VALUES (:rowid, :embedding)'),
+        [{"rowid": int(retrieval_id), "embedding": row.tobytes()} for retrieval_id, row in zip(retrieval_ids, matrix)],
+    )
+
+
+async def vec_search(db: AsyncSession, project_id: UUID, level: str, query_embedding: np.ndarray, candidate_ids: Iterable, k: int) -> Optional[list[int]]:
+    """
+    KNN over the candidate retrieval_ids. Returns None if some candidate is not mirrored
+    (e.g. exported before the backend was enabled), so the caller keeps the NumPy path.
+    """
+    query_embedding = np.ascontiguousarray(query_embedding, dtype=np.float32)
+    table = f"{_vec_prefix(project_id, level)}{query_embedding.shape[0]}"
+
+    if not await _vec_tables(db, re.escape(table)):
+        return None
+
+    candidate_ids = sorted({int(i) for i in candidate_ids})
+    ids_json = json.dumps(candidate_ids)
+
+    mirrored = await db.execute(text(f'SELECT count(*) FROM "{table}" WHERE rowid IN (SELECT value FROM json_each(:ids))'), {"ids": ids_json})
+    if mirrored.scalar() != len(candidate_ids):
+        return None
+
+    result = await db.execute(
+        text(f'SELECT rowid FROM "{table}" WHERE embedding MATCH :query AND k = :k AND rowid IN (SELECT value FROM json_each(:ids)) ORDER BY distance'),
+        {"query": query_embedding.tobytes(), "k": min(k, len(candidate_ids), SQLITE_VEC_MAX_K), "ids": ids_json},
+    )
+
+    return [row[0] for row in result.all()]
+
+
+async def vec_drop_project(db: AsyncSession, project_id: UUID) -> None:
+    for table in await _vec_tables(db, re.escape(_vec_prefix(project_id)) + r".+"):
+        await db.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
@@ -10,6 +10,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import User, get_async_session, create_db_and_tables
 from app.users import current_active_user
 from app.models import DocPipelines, ExportedPipelines, Retrieval, Paragraph, Embedding
+from app.rag_services.keyword_index import invalidate_corpus_statistics
 
 from typing import List
 
@@ -247,6 +248,7 @@ async def delete_doc(
     await Retrieval.delete_data({"user_id": user.id, "project_id": project_id, "doc_id": doc_id}, db)
     await Paragraph.delete_data({"user_id": user.id, "project_id": project_id, "doc_id": doc_id}, db)
     await Embedding.delete_data({"user_id": user.id, "project_id": project_id, "doc_id": doc_id}, db)
+    invalidate_corpus_statistics(project_id)
 
 
     # Delete filesystem artifacts
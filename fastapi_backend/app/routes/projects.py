@@ -10,6 +10,10 @@ from app.users import current_active_user
 from app.models import MainPipeline, DocPipelines, Paragraph, Retrieval, Embedding, SavedProjects, ProjectData
 
 from typing import List, Dict, Any
+from shutil import rmtree
+
+from app.rag_services.helpers import get_index_dir, delete_cached_embeddings
+from app.rag_services.vector_store import sqlite_vec_enabled, vec_drop_project
 
 
 router = APIRouter(tags=["projects"])
@@ -280,9 +284,20 @@ async def set_project(
 async def delete_project_data(db, user_id, project_id):
     where_dict = {"user_id": user_id, "project_id": project_id}
 
+    # cached vectors are keyed by content, so they go first, while the project's chunks still exist
+    await delete_cached_embeddings(user_id, project_id, db)
+    await db.commit()
+
     for model in (MainPipeline, DocPipelines, Paragraph, Retrieval, Embedding):
         await model.delete_data(db=db, where_dict=where_dict)
 
+    # persisted search indexes of the project
+    rmtree(get_index_dir(user_id, project_id), ignore_errors=True)
+
+    if sqlite_vec_enabled():
+        await vec_drop_project(db, project_id)
+        await db.commit()
+
 
 
 @router.delete("/{project_id}")
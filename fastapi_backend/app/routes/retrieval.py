@@ -18,7 +18,7 @@ import json
 from app.rag_services.helpers import load_pipeline
 
 # Retrieval service
-from app.rag_services.retrieval_service import run_doc_embeddings
+from app.rag_services.retrieval_service import run_doc_embeddings, run_router_index
 
 # Markdown generator
 from app.generate_markdown import generate_markdown_from_log, find_session_id
@@ -106,6 +106,10 @@ async def export_pipeline(
     retrieval_pipeline = json.loads(row.retrieval_pipeline)
     pipeline_valid = await run_doc_embeddings(retrieval_pipeline=retrieval_pipeline, user_id=user.id, project_id=project_id, doc_id=doc_id, db=db)
 
+    # the new embeddings dropped the router's HNSW index of their level: rebuild it, as export_all does
+    if main_pipeline:
+        await run_router_index(router_method=load_pipeline(main_pipeline.router), user_id=user.id, project_id=project_id, db=db)
+
     if pipeline_valid:
         for pipeline_method in retrieval_pipeline:
             pipeline_method.pop("color", None)
@@ -144,7 +148,8 @@ async def export_all(
 ):
     """
     1. Runs Embeddings for each doc_id where exported=0
-    2. Bundles all retrieval pipelines and exports them to the MainPipeline table
+    2. Builds the router's HNSW index if the router is a large EmbeddingRetriever
+    3. Bundles all retrieval pipelines and exports them to the MainPipeline table
 
     """
 
@@ -180,6 +185,10 @@ async def export_all(
                 row.exported = True
 
 
+    # HNSW index for an embedding router over the whole project level (large levels only), inverted indexes for a BM25 router
+    if main_pipeline:
+        await run_router_index(router_method=load_pipeline(main_pipeline.router), user_id=user.id, project_id=project_id, db=db)
+
     
     # finally update main_pipeline with the created document_pipelines dict
     if document_pipelines:
@@ -0,0 +1,93 @@
+"""
+Benchmark: block-max pruned BM25 top-k and the precomputed weight matrix vs. exhaustive scoring of the same inverted index.
+
+Run from fastapi_backend/:
+    python -m benchmarks.bench_bm25_search --rows 100000 --queries 50
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.rag_services.keyword_index import build_inverted_index, bm25_scores, bm25_top_k, bm25_matrix_scores
+
+
+def synthetic_corpus(rows: int, vocab: int, mean_len: int, rng: np.random.Generator) -> list[str]:
+    # Zipf-distributed vocabulary, like natural text
+    lengths = rng.poisson(mean_len, rows)
+    tokens = np.minimum(rng.zipf(1.2, int(lengths.sum())), vocab)
+
+    documents, start = [], 0
+    for length in lengths:
+        documents.append(" ".join(f"t{t}" for t in tokens[start:start + length]))
+        start += length
+
+    return documents
+
+
+def rank(ids: np.ndarray, scores: np.ndarray, k: int) -> list[int]:
+    # score descending, ties by retrieval_id (the candidate order of a full level)
+    return ids[np.lexsort((ids, -scores))][:k].tolist()
+
+
+def timed(fn) -> tuple[float, list]:
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--vocab", type=int, default=50_000)
+    parser.add_argument("--mean-len", type=int, default=60)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k1", type=float, default=1.5)
+    parser.add_argument("--b", type=float, default=0.75)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    documents = synthetic_corpus(args.rows, args.vocab, args.mean_len, rng)
+
+    start = time.perf_counter()
+    index = build_inverted_index(range(1, args.rows + 1), documents)
+    index.set_weights(args.k1, args.b)
+    print(f"rows={args.rows} terms={len(index.terms)} postings={len(index.post_rows)} build={time.perf_counter() - start:.1f} s")
+
+    # 2-5 tokens per query, mixing frequent and rare terms
+    queries = [
+        [f"t{t}" for t in np.minimum(rng.zipf(1.1, rng.integers(2, 6)), args.vocab)]
+        for _ in range(args.queries)
+    ]
+    blocks = [(index, np.ones(args.rows, dtype=bool))]
+
+    def matrix_top_k(scores: np.ndarray, k: int) -> list[int]:
+        matched = np.flatnonzero(scores)
+        return rank(index.ids[matched], scores[matched], k)
+
+    for k in (5, 20, 100):
+        exhaustive_time, pruned_time, matrix_time, identical = 0.0, 0.0, 0.0, True
+
+        for query in queries:
+            elapsed, expected = timed(lambda: rank(*bm25_scores(blocks, query, args.k1, args.b), k))
+            exhaustive_time += elapsed
+
+            elapsed, result = timed(lambda: rank(*bm25_top_k(blocks, query, args.k1, args.b, k), k))
+            pruned_time += elapsed
+            identical &= result == expected
+
+            elapsed, result = timed(lambda: matrix_top_k(bm25_matrix_scores(index, [query])[0], k))
+            matrix_time += elapsed
+            identical &= result == expected
+
+        print(f"k={k:<4} exhaustive: {exhaustive_time / len(queries) * 1000:8.2f} ms/query   "
+              f"block-max: {pruned_time / len(queries) * 1000:8.2f} ms/query ({exhaustive_time / pruned_time:4.1f}x)   "
+              f"weight matrix: {matrix_time / len(queries) * 1000:8.2f} ms/query ({exhaustive_time / matrix_time:4.1f}x)   "
+              f"identical: {identical}")
+
+    batch_time, batch_scores = timed(lambda: bm25_matrix_scores(index, queries))
+    print(f"batched weight matrix, {len(queries)} queries in one call: {batch_time / len(queries) * 1000:8.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
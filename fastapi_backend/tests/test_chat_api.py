@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APITimeoutError, AuthenticationError
+
+os.environ.setdefault("FERNET_SECRET_KEY", "A" * 32)
+
+from app.rag_apis import chat_api, model_health
+from app.rag_apis.chat_api import ChatOrchestrator
+from app.rag_apis.model_enums import CHAT_SUBCATEGORIES
+from app.rag_services.helpers import ExtractionError
+
+
+@pytest.fixture(autouse=True)
+def fresh_model_health(monkeypatch):
+    monkeypatch.setattr(model_health, "_MODEL_HEALTH", {})
+
+
+def fake_client(create):
+    return SimpleNamespace(api_key="key-123456", chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_the_event_loop(mocker):
+    async def create(model, messages, **kwargs):
+        await asyncio.sleep(0.2)
+        return completion(messages[-1]["content"])
+
+    mocker.patch.object(chat_api, "make_client", return_value=fake_client(create))
+    orchestrator = ChatOrchestrator(base_api="http://test", user_key_list=["key-1"])
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(orchestrator.call(label="coder", system_prompt="s", user_prompt=f"q{i}") for i in range(5)))
+
+    assert results == [f"q{i}" for i in range(5)]
+    # five 0.2 s calls in flight together, not one after the other
+    assert time.perf_counter() - start < 0.6
+
+
+@pytest.mark.asyncio
+async def test_timeout_switches_to_next_model(mocker):
+    models = []
+
+    async def create(model, messages, **kwargs):
+        models.append(model)
+        if len(models) == 1:
+            raise APITimeoutError(request=httpx.Request("POST", "http://test"))
+        return completion("ok")
+
+    mocker.patch.object(chat_api, "make_client", return_value=fake_client(create))
+    orchestrator = ChatOrchestrator(base_api="http://test", user_key_list=["key-1"])
+
+    assert await orchestrator.call(label="coder", system_prompt="s", user_prompt="q") == "ok"
+    assert models == [model.value for model in CHAT_SUBCATEGORIES["coder"][:2]]
+
+
+@pytest.mark.asyncio
+async def test_auth_failure_on_every_key_raises_401(mocker):
+    calls = []
+
+    def make_client(api_key, base_api):
+        async def create(model, messages, **kwargs):
+            calls.append(api_key)
+            raise AuthenticationError("invalid key", response=httpx.Response(401, request=httpx.Request("POST", "http://test")), body=None)
+
+        client = fake_client(create)
+        client.api_key = api_key
+        return client
+
+    mocker.patch.object(chat_api, "make_client", side_effect=make_client)
+    mocker.patch.object(chat_api.asyncio, "sleep", mocker.AsyncMock())
+    orchestrator = ChatOrchestrator(base_api="http://test", user_key_list=["key-1", "key-2"])
+
+    with pytest.raises(ExtractionError) as error:
+        await orchestrator.call(label="coder", system_prompt="s", user_prompt="q")
+
+    assert error.value.status_code == 401
+    # three attempts per key, then stop instead of cycling back to keys that already failed
+    assert sorted(calls) == ["key-1"] * 3 + ["key-2"] * 3
+
+
+@pytest.mark.asyncio
+async def test_hedge_fires_after_p90_and_cancels_the_loser(mocker, monkeypatch):
+    # the unmeasured backup must not be explored ahead of the primary
+    monkeypatch.setattr(model_health, "MODEL_EXPLORE_INTERVAL", 0)
+    primary, backup = CHAT_SUBCATEGORIES["coder"][:2]
+    for _ in range(5):
+        model_health.record_model_success("http://test", primary, 0.05)
+
+    cancelled = []
+
+    async def create(model, messages, **kwargs):
+        try:
+            await asyncio.sleep(5 if model == primary.value else 0.05)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return completion(model)
+
+    mocker.patch.object(chat_api, "make_client", return_value=fake_client(create))
+    orchestrator = ChatOrchestrator(base_api="http://test", user_key_list=["key-1"], hedge=True)
+
+    start = time.perf_counter()
+    assert await orchestrator.call(label="coder", system_prompt="s", user_prompt="q") == backup.value
+    assert time.perf_counter() - start < 1
+
+    await asyncio.sleep(0)
+    assert cancelled == [primary.value]
+    # the cancelled call still counts as a (lower-bound) latency sample for the p90, not as an answered call
+    health = model_health.get_model_health("http://test", primary)
+    assert len(health.latencies) == 6
+    assert health.latency == pytest.approx(0.05)
+    # the backup answered: its latency is its own call, not the hedging delay
+    assert model_health.get_model_health("http://test", backup).latency < 0.5
+
+
+@pytest.mark.asyncio
+async def test_hedge_not_fired_when_primary_is_fast(mocker):
+    models = []
+
+    async def create(model, messages, **kwargs):
+        models.append(model)
+        return completion("ok")
+
+    mocker.patch.object(chat_api, "make_client", return_value=fake_client(create))
+    orchestrator = ChatOrchestrator(base_api="http://test", user_key_list=["key-1", "key-2"], hedge=True)
+
+    assert await orchestrator.call(label="coder", system_prompt="s", user_prompt="q") == "ok"
+    assert models == [CHAT_SUBCATEGORIES["coder"][0].value]
@@ -106,3 +106,18 @@ async def test_session_maker_configuration():
     # Create a test session
     async with async_session_maker() as session:
         assert isinstance(session, AsyncSession)
+
+
+def test_load_sqlite_vec_falls_back_when_extension_cannot_load(mocker):
+    from app import database
+    from app.rag_services import vector_store
+
+    mocker.patch.object(database.settings, "VECTOR_BACKEND", "sqlite-vec")
+    mocker.patch.object(database.engine.dialect, "name", "sqlite")
+    dbapi_connection = mocker.Mock()
+    dbapi_connection.run_async.side_effect = AttributeError("enable_load_extension")
+
+    vector_store.set_sqlite_vec_loaded(True)
+    database.load_sqlite_vec(dbapi_connection, None)
+
+    assert vector_store.sqlite_vec_enabled() is False
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+os.environ.setdefault("FERNET_SECRET_KEY", "A" * 32)
+
+from app.rag_apis.embed_api import EmbeddingOrchestrator, split_batches
+
+
+def test_split_batches_respects_item_and_token_limits():
+    inputs = ["a" * 30, "b" * 30, "c" * 30, "d" * 300, "e" * 3]
+
+    batches = split_batches(inputs, max_items=2, max_tokens=25)
+
+    assert batches == [["a" * 30, "b" * 30], ["c" * 30], ["d" * 300], ["e" * 3]]
+
+
+@pytest.mark.asyncio
+async def test_get_embedding_reassembles_batches_in_order(mocker):
+    orchestrator = EmbeddingOrchestrator(base_api="http://test", user_key_list=["key-1", "key-2"], batch_size=2, max_concurrency=3)
+    used_keys = []
+
+    async def fake_safe_call(client, api_key, model, inputs, model_queue, failure_count, retry_num=0):
+        used_keys.append(api_key)
+        return [[float(len(text))] for text in inputs]
+
+    mocker.patch.object(orchestrator, "_safe_call", side_effect=fake_safe_call)
+
+    embeddings = await orchestrator.get_embedding(["x" * n for n in range(1, 6)], label="embeddings")
+
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert set(used_keys) == {"key-1", "key-2"}
+
+
+@pytest.mark.asyncio
+async def test_failing_batch_moves_the_whole_document_to_the_next_model(mocker):
+    from app.rag_apis.model_enums import EMBEDDING_SUBCATEGORIES
+    from app.rag_services.helpers import ExtractionError
+
+    primary, fallback = EMBEDDING_SUBCATEGORIES["embeddings"][:2]
+    orchestrator = EmbeddingOrchestrator(base_api="http://test", user_key_list=["key-1"], batch_size=1)
+    calls = []
+
+    async def fake_safe_call(client, api_key, model, inputs, model_queue, failure_count, retry_num=0):
+        calls.append((model, inputs[0]))
+        # retries are exhausted inside _safe_call: the batch must not switch the model on its own
+        assert model_queue == []
+        if model == primary and inputs == ["b"]:
+            raise ExtractionError("retries exhausted", status_code=502)
+        return [[model.value, text] for text in inputs]
+
+    mocker.patch.object(orchestrator, "_safe_call", side_effect=fake_safe_call)
+
+    embeddings, model = await orchestrator.embed_document(["a", "b", "c"], label="embeddings")
+
+    assert model == fallback.value
+    assert embeddings == [[fallback.value, "a"], [fallback.value, "b"], [fallback.value, "c"]]
+    assert sorted(text for used, text in calls if used == fallback) == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_query_embedding_cache_counts_hits_and_misses(mocker):
+    from app.rag_apis.embed_api import QUERY_EMBEDDING_CACHE
+    from app.rag_apis.model_enums import EMBEDDING_SUBCATEGORIES
+
+    QUERY_EMBEDDING_CACHE.clear()
+    orchestrator = EmbeddingOrchestrator(base_api="http://test", user_key_list=["key-1"])
+    embed_document = mocker.patch.object(orchestrator, "embed_document", side_effect=lambda inputs, label: ([[float(len(text))] for text in inputs], EMBEDDING_SUBCATEGORIES[label][0].value))
+
+    assert await orchestrator.get_query_embedding("what is rag?", label="embeddings") == [12.0]
+    assert await orchestrator.get_query_embedding("what is rag?", label="embeddings") == [12.0]
+    # keyed on the model: another label with the same first model shares the entry
+    assert await orchestrator.get_query_embedding("what is rag?", label="english") == [12.0]
+    await orchestrator.get_query_embedding("what is rag?", label="multi_lang")
+
+    assert embed_document.call_count == 2
+    assert QUERY_EMBEDDING_CACHE.stats()["hits"] == 2
+    assert QUERY_EMBEDDING_CACHE.stats()["misses"] == 2
+    QUERY_EMBEDDING_CACHE.clear()
+
+
+@pytest.mark.asyncio
+async def test_query_embedding_cache_keeps_fallback_results_under_their_model(mocker):
+    from app.rag_apis.embed_api import QUERY_EMBEDDING_CACHE
+
+    QUERY_EMBEDDING_CACHE.clear()
+    orchestrator = EmbeddingOrchestrator(base_api="http://test", user_key_list=["key-1"])
+    embed_document = mocker.patch.object(orchestrator, "embed_document", side_effect=[([[1.0] * 1024], "multilingual-e5-large-instruct"), ([[2.0] * 4096], "e5-mistral-7b-instruct")])
+
+    # the label's first model failed over: the result must not be served as an e5-mistral vector later
+    assert len(await orchestrator.get_query_embedding("what is rag?", label="embeddings")) == 1024
+    assert len(await orchestrator.get_query_embedding("what is rag?", label="embeddings")) == 4096
+
+    # but it serves the fallback model itself
+    assert len(await orchestrator.get_query_embedding("what is rag?", label="multi_lang")) == 1024
+    assert embed_document.call_count == 2
+    QUERY_EMBEDDING_CACHE.clear()
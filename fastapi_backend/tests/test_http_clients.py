@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+os.environ.setdefault("FERNET_SECRET_KEY", "A" * 32)
+
+from app.rag_apis import http_clients
+from app.rag_apis.http_clients import get_http_client, close_http_clients
+from app.rag_apis.embed_api import EmbeddingOrchestrator
+
+
+@pytest.mark.asyncio
+async def test_clients_are_pooled_per_base_api_and_key():
+    first = get_http_client("http://test/v1/", "key-1")
+
+    assert get_http_client("http://test/v1", "key-1") is first
+    assert get_http_client("http://test/v1", "key-2") is not first
+    assert get_http_client("http://other/v1", "key-1") is not first
+
+    await close_http_clients()
+
+    assert first.is_closed
+    assert http_clients._HTTP_CLIENTS == {}
+    assert get_http_client("http://test/v1", "key-1") is not first
+
+    await close_http_clients()
+
+
+@pytest.mark.asyncio
+async def test_embedding_calls_reuse_the_pooled_client(mocker):
+    orchestrator = EmbeddingOrchestrator(base_api="http://test", user_key_list=["key-1", "key-2"], batch_size=1)
+    clients = []
+
+    async def fake_safe_call(client, api_key, model, inputs, model_queue, failure_count, retry_num=0):
+        clients.append((api_key, client))
+        return [[1.0] for _ in inputs]
+
+    mocker.patch.object(orchestrator, "_safe_call", side_effect=fake_safe_call)
+
+    await orchestrator.get_embedding(["a", "b"])
+    await orchestrator.get_embedding(["c", "d"])
+
+    # four batches over two keys, served by one open client per key
+    assert {key: client for key, client in clients} == {
+        "key-1": get_http_client("http://test", "key-1"),
+        "key-2": get_http_client("http://test", "key-2"),
+    }
+    assert not any(client.is_closed for _, client in clients)
+
+    await close_http_clients()
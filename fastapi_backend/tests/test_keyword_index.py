@@ -0,0 +1,232 @@
+import math
+from collections import Counter
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.rag_services import keyword_index, retrieval_service
+from app.rag_services.helpers import get_keyword_index_path
+from app.rag_services.retrieval_service import BM25Retriever
+
+
+CHUNKS = [
+    "The quick brown fox jumps over the lazy dog",
+    "A lazy afternoon, the dog sleeps",
+    "Foxes are quick; the fox is quicker than the dog",
+    "Nothing relevant here",
+    "brown bread and brown butter",
+    "",
+]
+
+
+def test_inverted_index_roundtrip(tmp_path):
+    path = tmp_path / "p_section.bm25.npz"
+    keyword_index.write_inverted_index(path, keyword_index.build_inverted_index(range(1, 7), CHUNKS))
+    index = keyword_index.load_inverted_index(path)
+
+    rows, tf = index.postings("brown")
+    assert rows.tolist() == [0, 4]
+    assert tf.tolist() == [1, 2]
+    assert index.postings("missing")[0].tolist() == []
+    assert index.doc_lens.tolist() == [9, 6, 10, 3, 5, 0]
+    assert index.ids.tolist() == [1, 2, 3, 4, 5, 6]
+
+
+def reference_bm25(query, retrieval_ids, documents, k, k1=1.5, b=0.75):
+    # per-document scan that BM25Retriever used before the inverted index
+    tokenized_docs = [keyword_index.tokenize(doc) for doc in documents]
+    doc_lengths = [len(doc) for doc in tokenized_docs]
+    avgdl = sum(doc_lengths) / len(doc_lengths)
+    tf = [Counter(doc) for doc in tokenized_docs]
+
+    df = Counter(term for doc in tokenized_docs for term in set(doc))
+    idf = {term: math.log(1 + (len(documents) - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    scores = []
+    for i, doc_tf in enumerate(tf):
+        score = 0.0
+        for term in keyword_index.tokenize(query):
+            if term in doc_tf:
+                freq = doc_tf[term]
+                score += idf[term] * (freq * (k1 + 1) / (freq + k1 * (1 - b + b * doc_lengths[i] / avgdl)))
+        scores.append((retrieval_ids[i], score))
+
+    scores.sort(key=lambda x: x[1], reverse=True)
+    return [retrieval_id for retrieval_id, _ in scores[:k]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("k", [1, 3, 6])
+async def test_indexed_bm25_matches_content_scan(tmp_path, monkeypatch, k):
+    monkeypatch.chdir(tmp_path)
+    user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+    index_path = get_keyword_index_path(user_id, project_id, doc_id, "section")
+
+    retriever = BM25Retriever(db=None, logger=None, user_id=user_id, project_id=project_id, doc_id=doc_id, level="section", retrieval_amount=k, query_transformation_model="", query_transformation_prompt="", k1="1.5", b="0.75", statistics="candidates")
+
+    # candidates are a subset of the exported chunks, in their own order
+    candidates = {"retrieval_id": [5, 3, 1, 2, 6], "content": [CHUNKS[4], CHUNKS[2], CHUNKS[0], CHUNKS[1], CHUNKS[5]]}
+    full_level = {"retrieval_id": list(range(1, 7)), "content": CHUNKS}
+
+    exported = keyword_index.build_inverted_index(range(1, 7), CHUNKS)
+    exported.set_weights(1.5, 0.75)
+
+    for query in ("quick brown fox fox", "lazy dog", "unknown words"):
+        for retrieval_dict in (candidates, full_level):
+            expected = reference_bm25(query, retrieval_dict["retrieval_id"], retrieval_dict["content"], k)
+
+            # in-memory index of the candidates, then the exported index (weight matrix or block-max)
+            assert await retriever.run_retriever(query, retrieval_dict) == expected
+
+            keyword_index.write_inverted_index(index_path, exported)
+            assert await retriever.run_retriever(query, retrieval_dict) == expected
+            keyword_index.remove_inverted_index(index_path)
+
+
+def test_matrix_scores_match_postings(tmp_path):
+    index = keyword_index.build_inverted_index(range(1, 7), CHUNKS)
+    index.set_weights(1.2, 0.75)
+
+    path = tmp_path / "p_section.bm25.npz"
+    keyword_index.write_inverted_index(path, index)
+    index = keyword_index.load_inverted_index(path)
+    assert index.has_weights(1.2, 0.75) and not index.has_weights(1.5, 0.75)
+
+    queries = [["quick", "fox"], ["brown", "brown"], ["missing"]]
+    matrix = keyword_index.bm25_matrix_scores(index, queries)
+    full = [(index, np.ones(6, dtype=bool))]
+
+    for query, row in zip(queries, matrix):
+        ids, scores = keyword_index.bm25_scores(full, query, 1.2, 0.75)
+        expected = np.zeros(6)
+        expected[ids - 1] = scores
+        np.testing.assert_array_equal(row, expected)
+
+
+def test_block_max_top_k_matches_exhaustive(monkeypatch):
+    monkeypatch.setattr(keyword_index, "BLOCK_ROWS", 8)
+    rng = np.random.default_rng(3)
+
+    documents = [" ".join(f"t{t}" for t in rng.zipf(1.3, rng.integers(0, 30))) for _ in range(300)]
+    index = keyword_index.build_inverted_index(range(1000, 1300), documents)
+    mask = rng.random(300) < 0.7
+
+    def rank(ids, scores, k):
+        return ids[np.lexsort((ids, -scores))][:k].tolist()
+
+    for query in (["t1", "t2"], ["t3", "t3", "t9"], ["t40", "t1"], ["t999999"]):
+        for k in (1, 5, 50, 400):
+            expected = rank(*keyword_index.bm25_scores([(index, mask)], query, 1.2, 0.75), k)
+            assert rank(*keyword_index.bm25_top_k([(index, mask)], query, 1.2, 0.75, k), k) == expected
+
+
+@pytest.mark.asyncio
+async def test_corpus_statistics_shared_across_documents(db_session, mocker):
+    from app.models import Retrieval
+    from app.rag_services.indexing_service import update_chunking_results
+
+    user_id, project_id = uuid4(), uuid4()
+    doc_ids = (uuid4(), uuid4())
+    rows = [
+        await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_ids[level_id > 3], "level": "section", "level_id": level_id, "content": content}, db=db_session)
+        for level_id, content in enumerate(CHUNKS[:5], start=1)
+    ]
+    await db_session.flush()
+    retrieval_ids = {doc_id: [row.retrieval_id for row in rows if row.doc_id == doc_id] for doc_id in doc_ids}
+
+    retrievers = [
+        BM25Retriever(db=db_session, logger=None, user_id=user_id, project_id=project_id, doc_id=doc_id, level="section", retrieval_amount=3, query_transformation_model="", query_transformation_prompt="", k1="1.5", b="0.75")
+        for doc_id in doc_ids
+    ]
+
+    statistics = await retrievers[0]._corpus_statistics()
+    assert statistics.n_docs == 5
+    assert await retrievers[1]._corpus_statistics() is statistics
+
+    # a document is ranked with the idf of the whole level
+    candidates = {"retrieval_id": retrieval_ids[doc_ids[0]], "content": CHUNKS[:3]}
+    level_ranking = reference_bm25("brown dog", sum(retrieval_ids.values(), []), CHUNKS[:5], 5)
+    assert await retrievers[0].run_retriever("brown dog", candidates) == [i for i in level_ranking if i in candidates["retrieval_id"]]
+
+    await update_chunking_results(user_id, project_id, db_session, [{"level": "section", "items": [{"retrieval_id": retrieval_ids[doc_ids[1]][0], "content": "brown dog"}]}])
+    assert (project_id, "section") not in keyword_index._CORPUS_STATISTICS
+
+    updated = await retrievers[1]._corpus_statistics()
+    assert updated is not statistics and updated.idf(["dog"])["dog"] < statistics.idf(["dog"])["dog"]
+
+    # a write that never invalidated this process (another worker): the fingerprint is read once per request
+    await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_ids[0], "level": "section", "level_id": 6, "content": "dog"}, db=db_session)
+    await db_session.flush()
+
+    fingerprint = mocker.spy(retrieval_service, "retrieval_fingerprint")
+    assert (await retrievers[0]._corpus_statistics()).n_docs == 5
+
+    # the next request (new session) reads it again
+    db_session.info.clear()
+    assert (await retrievers[0]._corpus_statistics()).n_docs == 6
+    assert (await retrievers[1]._corpus_statistics()).n_docs == 6
+    assert fingerprint.call_count == 1
+
+
+def test_corpus_statistics_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(keyword_index, "CORPUS_STATISTICS_CACHE_SIZE", 2)
+    monkeypatch.setattr(keyword_index, "_CORPUS_STATISTICS", keyword_index.OrderedDict())
+    statistics = keyword_index.build_corpus_statistics(CHUNKS)
+
+    for project in ("a", "b"):
+        keyword_index.store_corpus_statistics(project, "section", (6, 6, 100), statistics)
+
+    # a hit refreshes "a", so "b" is the least recently used when "c" comes in
+    assert keyword_index.cached_corpus_statistics("a", "section", (6, 6, 100)) is statistics
+    keyword_index.store_corpus_statistics("c", "section", (6, 6, 100), statistics)
+
+    assert list(keyword_index._CORPUS_STATISTICS) == [("a", "section"), ("c", "section")]
+    assert keyword_index.cached_corpus_statistics("a", "section", (7, 7, 104)) is None
+
+
+def test_matrix_scores_with_corpus_statistics_match_postings():
+    index = keyword_index.build_inverted_index(range(1, 4), CHUNKS[:3])
+    corpus = keyword_index.build_corpus_statistics(CHUNKS)
+    full = [(index, np.ones(3, dtype=bool))]
+
+    for query in (["quick", "fox"], ["brown", "dog", "dog"], ["missing"]):
+        ids, scores = keyword_index.bm25_scores(full, query, 1.2, 0.75, corpus)
+        expected = np.zeros(3)
+        expected[ids - 1] = scores
+        np.testing.assert_array_equal(keyword_index.bm25_matrix_scores(index, [query], corpus, 1.2, 0.75)[0], expected)
+
+
+@pytest.mark.asyncio
+async def test_fts5_backend_ranks_inside_sqlite(db_session):
+    from sqlalchemy import text
+    from app.models import Retrieval
+
+    if not await keyword_index.create_fts(await db_session.connection()):
+        return
+
+    try:
+        user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+        for level_id, content in enumerate(CHUNKS[:5], start=1):
+            await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": "section", "level_id": level_id, "content": content}, db=db_session)
+        await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": uuid4(), "doc_id": doc_id, "level": "section", "level_id": 1, "content": "brown brown brown"}, db=db_session)
+        await db_session.flush()
+
+        retriever = BM25Retriever(db=db_session, logger=None, user_id=user_id, project_id=project_id, doc_id=doc_id, level="section", retrieval_amount=3, query_transformation_model="", query_transformation_prompt="", k1="1.5", b="0.75", backend="fts5")
+
+        candidates = await retriever.filter_retrieval_content()
+        assert "content" not in candidates and candidates["scope_only"]
+
+        top_ids = await retriever.run_retriever("brown fox", candidates)
+        ids = candidates["retrieval_id"]
+        assert top_ids[0] == ids[0] and set(top_ids) == {ids[0], ids[2], ids[4]}
+
+        # content updates reach the mirror through the triggers
+        await Retrieval.update_data(data_dict={"content": "unrelated"}, where_dict={"retrieval_id": ids[4]}, db=db_session)
+        assert (await retriever.run_retriever("unrelated", {"retrieval_id": ids}))[0] == ids[4]
+
+    finally:
+        for statement in keyword_index.DROP_FTS_STATEMENTS:
+            await db_session.execute(text(statement))
+        await db_session.commit()
+        keyword_index.set_fts5_available(False)
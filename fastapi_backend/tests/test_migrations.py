@@ -0,0 +1,45 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+from app.rag_services import vector_store
+
+VERSIONS = Path(__file__).resolve().parents[1] / "alembic_migrations" / "versions"
+
+
+def load_revision(filename: str):
+    spec = importlib.util.spec_from_file_location(filename.removesuffix(".py"), VERSIONS / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_normalize_migration_converts_legacy_matrices(tmp_path):
+    migration = load_revision("e5a2b8c61d07_normalize_embeddings.py")
+    assert migration.UPLOADS_DIR.is_absolute()
+
+    embedding_dir = tmp_path / "user" / "doc" / "embeddings"
+    legacy_path, ids_path = embedding_dir / "p_section.npy", embedding_dir / "p_section.ids.npy"
+    matrix = np.array([[3.0, 4.0], [0.0, 0.0], [0.0, 2.0]], dtype=np.float32)
+    vector_store.write_matrix(legacy_path, ids_path, matrix, [1, 2, 3])
+    vector_store.write_matrix(embedding_dir / "p_section.int8.npy", ids_path, vector_store.quantize_vectors(matrix, "int8")[0], [1, 2, 3])
+
+    assert migration.normalize_legacy_matrices(tmp_path) == 1
+    assert not legacy_path.exists()
+    assert not (embedding_dir / "p_section.int8.npy").exists()
+
+    unit, ids = vector_store.load_matrix(embedding_dir / "p_section.unit.npy", ids_path)
+    np.testing.assert_allclose(unit, [[0.6, 0.8], [0.0, 0.0], [0.0, 1.0]])
+    assert ids.tolist() == [1, 2, 3]
+    assert (embedding_dir / "p_section.unit.int8.npy").exists()
+
+
+def test_normalize_migration_blobs_match_vector_store():
+    migration = load_revision("e5a2b8c61d07_normalize_embeddings.py")
+    vector = np.array([3.0, -4.0, 0.5], dtype=np.float32)
+
+    for dtype in vector_store.EMBEDDING_DTYPES:
+        blob = vector_store.encode_vectors(vector[None, :], dtype)[0]
+        np.testing.assert_allclose(migration._decode(blob, dtype), vector_store.decode_vectors([blob], dtype)[0])
+        assert migration._encode(vector, dtype) == blob
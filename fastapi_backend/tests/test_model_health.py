@@ -0,0 +1,109 @@
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APITimeoutError
+
+os.environ.setdefault("FERNET_SECRET_KEY", "A" * 32)
+
+from app.rag_apis import chat_api, model_health
+from app.rag_apis.chat_api import ChatOrchestrator
+from app.rag_apis.model_enums import CHAT_SUBCATEGORIES
+from app.rag_apis.model_health import CIRCUIT_COOLDOWN, CIRCUIT_FAILURE_THRESHOLD, get_model_health, rank_models, record_model_failure, record_model_success
+
+BASE_API = "http://test"
+GENERATOR = CHAT_SUBCATEGORIES["generator"]
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    state = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(model_health, "time", SimpleNamespace(monotonic=lambda: state.now))
+    monkeypatch.setattr(model_health, "_MODEL_HEALTH", {})
+    return state
+
+
+def test_circuit_opens_then_half_opens_after_cooldown(clock):
+    first, second = GENERATOR[:2]
+
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        record_model_failure(BASE_API, first)
+
+    assert rank_models(BASE_API, [first, second]) == ([second], [first])
+
+    # cooldown over: one call probes it, the others keep skipping it; a failure reopens it at once
+    clock.now += CIRCUIT_COOLDOWN
+    assert get_model_health(BASE_API, first).state(clock.now) == "half_open"
+    assert rank_models(BASE_API, [first, second]) == ([first, second], [])
+    assert rank_models(BASE_API, [first, second]) == ([second], [first])
+
+    record_model_failure(BASE_API, first)
+    assert rank_models(BASE_API, [first, second]) == ([second], [first])
+
+    clock.now += CIRCUIT_COOLDOWN
+    record_model_success(BASE_API, first, 1.0)
+    assert get_model_health(BASE_API, first).state(clock.now) == "closed"
+
+
+def test_lost_probe_is_given_up_after_a_cooldown(clock):
+    first, second = GENERATOR[:2]
+
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        record_model_failure(BASE_API, first)
+
+    clock.now += CIRCUIT_COOLDOWN
+    assert rank_models(BASE_API, [first, second]) == ([first, second], [])
+
+    # the probe never reported back (e.g. an earlier model answered first)
+    clock.now += CIRCUIT_COOLDOWN / 2
+    assert rank_models(BASE_API, [first, second]) == ([second], [first])
+
+    clock.now += CIRCUIT_COOLDOWN / 2
+    assert get_model_health(BASE_API, first).state(clock.now) == "half_open"
+
+
+@pytest.mark.asyncio
+async def test_run_prefers_fastest_healthy_model(mocker):
+    record_model_success(BASE_API, GENERATOR[0], 4.0)
+    record_model_success(BASE_API, GENERATOR[1], 2.0)
+    record_model_success(BASE_API, GENERATOR[2], 0.5)
+    record_model_success(BASE_API, GENERATOR[3], 8.0)
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        record_model_failure(BASE_API, GENERATOR[2])
+
+    models = []
+
+    async def create(model, messages, **kwargs):
+        models.append(model)
+        if model == GENERATOR[1].value:
+            raise APITimeoutError(request=httpx.Request("POST", BASE_API))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+    client = SimpleNamespace(api_key="key-123456", chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    mocker.patch.object(chat_api, "make_client", return_value=client)
+    orchestrator = ChatOrchestrator(base_api=BASE_API, user_key_list=["key-1"])
+
+    assert await orchestrator.call(label="generator", system_prompt="s", user_prompt="q") == "ok"
+
+    # the open-circuit model is never called; the fastest healthy one goes first and its timeout falls back to the next
+    assert models == [GENERATOR[1].value, GENERATOR[0].value]
+    assert get_model_health(BASE_API, GENERATOR[1]).failures == 1
+
+
+def test_unmeasured_faster_model_is_explored_then_ranks_first(clock):
+    slow, slower, unmeasured = GENERATOR[:3]
+    record_model_success(BASE_API, slow, 2.0)
+    record_model_success(BASE_API, slower, 4.0)
+
+    # tried first once, so it gets a measurement
+    assert rank_models(BASE_API, [slow, slower, unmeasured]) == ([unmeasured, slow, slower], [])
+
+    # no measurement yet (e.g. the call was cancelled): until the next exploration it ranks at the median prior
+    assert rank_models(BASE_API, [slow, slower, unmeasured]) == ([slow, unmeasured, slower], [])
+
+    clock.now += model_health.MODEL_EXPLORE_INTERVAL
+    assert rank_models(BASE_API, [slow, slower, unmeasured])[0][0] == unmeasured
+
+    record_model_success(BASE_API, unmeasured, 0.5)
+    assert rank_models(BASE_API, [slow, slower, unmeasured]) == ([unmeasured, slow, slower], [])
@@ -0,0 +1,66 @@
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+os.environ.setdefault("FERNET_SECRET_KEY", "A" * 32)
+
+from app.rag_apis import rate_limiter
+from app.rag_apis.rate_limiter import RateLimiter, get_rate_limiter, observe_rate_limit, select_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock; asyncio.sleep advances it instead of waiting."""
+    state = SimpleNamespace(now=1000.0, slept=[])
+
+    async def fake_sleep(seconds):
+        state.slept.append(round(seconds, 3))
+        state.now += seconds
+
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=lambda: state.now))
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(rate_limiter, "_RATE_LIMITERS", {})
+    return state
+
+
+@pytest.mark.asyncio
+async def test_limiter_paces_to_learned_rate(clock):
+    limiter = RateLimiter("key-1")
+
+    # unknown limits: no throttling
+    await limiter.acquire()
+    assert clock.slept == []
+
+    # 120 / minute with 2 left: two more go out at once, then one every 0.5 s
+    limiter.observe({"X-RateLimit-Limit-Minute": "120", "X-RateLimit-Remaining-Minute": "2"})
+    for _ in range(4):
+        await limiter.acquire()
+
+    assert clock.slept == [0.5, 0.5]
+
+
+@pytest.mark.asyncio
+async def test_exhausted_key_waits_for_reset_and_is_avoided(clock):
+    hook = observe_rate_limit("http://test", "key-1")
+    await hook(httpx.Response(200, headers={"x-ratelimit-remaining-hour": "0", "x-ratelimit-reset-hour": "1800"}))
+
+    assert get_rate_limiter("http://test/", "key-1").wait_time() == pytest.approx(1800)
+    assert [select_key("http://test", ["key-1", "key-2"]) for _ in range(2)] == ["key-2", "key-2"]
+
+    # a single request never waits past MAX_RATE_LIMIT_WAIT
+    await get_rate_limiter("http://test", "key-1").acquire()
+    assert clock.slept == [rate_limiter.MAX_RATE_LIMIT_WAIT]
+
+
+@pytest.mark.asyncio
+async def test_select_key_spreads_and_honours_retry_after(clock):
+    keys = ["key-1", "key-2", "key-3"]
+    assert [select_key("http://test", keys) for _ in range(4)] == ["key-1", "key-2", "key-3", "key-1"]
+
+    get_rate_limiter("http://test", "key-2").observe({"Retry-After": "5"}, status_code=429)
+
+    assert [select_key("http://test", keys) for _ in range(2)] == ["key-3", "key-1"]
+    clock.now += 5
+    assert select_key("http://test", keys) == "key-2"
@@ -42,3 +42,471 @@ async def test_get_doc_title_normalizes_string_doc_id(mocker):
     )
 
     assert row == "Test document"
+
+
+def test_embedding_top_k_matches_full_sort():
+    import numpy as np
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+
+    rng = np.random.default_rng(1)
+    matrix = rng.standard_normal((50, 8), dtype=np.float32)
+    query = rng.standard_normal(8, dtype=np.float32)
+    blobs = [row.tobytes() for row in matrix]
+
+    scores = EmbeddingRetriever._cosine_similarity(query, EmbeddingRetriever._stack_embeddings(blobs))
+    expected = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+    np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+    top = EmbeddingRetriever.top_k_numpy({"retrieval_id": list(range(50)), "score": scores}, "score", 5)
+    assert top["retrieval_id"] == sorted(range(50), key=lambda i: expected[i], reverse=True)[:5]
+
+
+def test_embedding_stack_decodes_mixed_storage():
+    import numpy as np
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+    from app.rag_services.vector_store import encode_vectors
+
+    rng = np.random.default_rng(3)
+    matrix = rng.standard_normal((4, 8), dtype=np.float32)
+    blobs = encode_vectors(matrix[:2], "float32") + encode_vectors(matrix[2:], "int8")
+
+    stacked = EmbeddingRetriever._stack_embeddings(blobs, ["float32", "float32", "int8", "int8"])
+
+    np.testing.assert_array_equal(stacked[:2], matrix[:2])
+    np.testing.assert_allclose(stacked[2:], matrix[2:], atol=3e-2)
+
+
+def test_embedding_dot_product_matches_cosine_on_unit_rows():
+    import numpy as np
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+    from app.rag_services.vector_store import normalize_rows
+
+    rng = np.random.default_rng(4)
+    matrix = rng.standard_normal((20, 8), dtype=np.float32)
+    query = rng.standard_normal(8, dtype=np.float32)
+
+    np.testing.assert_allclose(
+        EmbeddingRetriever._similarity(query, normalize_rows(matrix)),
+        EmbeddingRetriever._cosine_similarity(query, matrix),
+        rtol=1e-5,
+    )
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_only_embeds_misses(mocker):
+    import hashlib
+    import numpy as np
+    from app.models import EmbeddingCache
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+
+    cached_vector = np.array([1.0, 0.0], dtype=np.float32)
+    cached_hash = hashlib.sha256(b"unchanged chunk").hexdigest()
+
+    mocker.patch.object(EmbeddingCache, "get_all", AsyncMock(return_value=([{"content_hash": cached_hash, "embedding": cached_vector.tobytes()}], [])))
+    insert = mocker.patch.object(EmbeddingCache, "bulk_insert_ignore_data", AsyncMock())
+
+    retriever = EmbeddingRetriever(db=object(), logger=None, user_id=uuid4(), project_id=uuid4(), level="section", retrieval_amount=1, embedding_model="embeddings", query_transformation_model="chat")
+    retriever._embed = AsyncMock(return_value=([[0.0, 3.0]], "e5-mistral-7b-instruct"))
+
+    emb_matrix = await retriever._embed_cached(["unchanged chunk", "edited chunk", "unchanged chunk"])
+
+    retriever._embed.assert_awaited_once_with(["edited chunk"])
+    assert [row["content_hash"] for row in insert.await_args.kwargs["rows"]] == [hashlib.sha256(b"edited chunk").hexdigest()]
+    np.testing.assert_array_equal(emb_matrix, [[1.0, 0.0], [0.0, 1.0], [1.0, 0.0]])
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_reembeds_document_after_model_fallback(mocker):
+    import hashlib
+    import numpy as np
+    from app.models import EmbeddingCache
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+
+    cached_hash = hashlib.sha256(b"unchanged chunk").hexdigest()
+    mocker.patch.object(EmbeddingCache, "get_all", AsyncMock(return_value=([{"content_hash": cached_hash, "embedding": np.array([1.0, 0.0], dtype=np.float32).tobytes()}], [])))
+    insert = mocker.patch.object(EmbeddingCache, "bulk_insert_ignore_data", AsyncMock())
+
+    retriever = EmbeddingRetriever(db=object(), logger=None, user_id=uuid4(), project_id=uuid4(), level="section", retrieval_amount=1, embedding_model="embeddings", query_transformation_model="chat")
+    retriever._embed = AsyncMock(side_effect=[
+        ([[0.0, 0.0, 2.0]], "multilingual-e5-large-instruct"),
+        ([[2.0, 0.0, 0.0], [0.0, 0.0, 2.0]], "multilingual-e5-large-instruct"),
+    ])
+
+    emb_matrix = await retriever._embed_cached(["unchanged chunk", "edited chunk"])
+
+    # the cached hit of the primary model is not mixed with the fallback model's vectors
+    retriever._embed.assert_awaited_with(["unchanged chunk", "edited chunk"], label="multilingual-e5-large-instruct")
+    assert {row["embedding_model"] for row in insert.await_args.kwargs["rows"]} == {"multilingual-e5-large-instruct"}
+    np.testing.assert_array_equal(emb_matrix, [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache_keeps_float32_under_compact_storage(db_session):
+    import numpy as np
+    from app.models import EmbeddingCache
+    from app.rag_services.helpers import content_hash
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+
+    user_id = uuid4()
+    retriever = EmbeddingRetriever(db=db_session, logger=None, user_id=user_id, project_id=uuid4(), level="section", retrieval_amount=1, embedding_model="embeddings", query_transformation_model="chat", storage="int8")
+    retriever._embed = AsyncMock(return_value=([[3.0, 4.0]], "e5-mistral-7b-instruct"))
+
+    emb_matrix = await retriever._embed_cached(["chunk"])
+
+    # a concurrent export of the same content: the insert is skipped, not an IntegrityError
+    await EmbeddingCache.bulk_insert_ignore_data(rows=[{"user_id": user_id, "embedding_model": "e5-mistral-7b-instruct", "content_hash": content_hash("chunk"), "embedding": b"\x00" * 8}], db=db_session)
+    await db_session.commit()
+
+    # int8 storage quantizes the Embeddings table only; the cache and the exported matrix stay exact
+    rows, _ = await EmbeddingCache.get_all(columns=["embedding"], where_dict={"user_id": user_id}, db=db_session)
+    assert [np.frombuffer(row["embedding"], dtype=np.float32).tolist() for row in rows] == [emb_matrix[0].tolist()]
+    np.testing.assert_array_equal(emb_matrix, np.array([[0.6, 0.8]], dtype=np.float32))
+
+    # cache hit: the same float32 vector, no second API call
+    np.testing.assert_array_equal(await retriever._embed_cached(["chunk"]), emb_matrix)
+    retriever._embed.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_delete_cached_embeddings_keeps_shared_content(db_session):
+    from app.models import Retrieval, EmbeddingCache
+    from app.rag_services.helpers import content_hash, delete_cached_embeddings
+
+    user_id, deleted_project, kept_project = uuid4(), uuid4(), uuid4()
+    await Retrieval.bulk_insert_data(rows=[
+        {"user_id": user_id, "project_id": deleted_project, "level": "section", "content": "own chunk"},
+        {"user_id": user_id, "project_id": deleted_project, "level": "section", "content": "shared chunk"},
+        {"user_id": user_id, "project_id": kept_project, "level": "section", "content": "shared chunk"},
+    ], db=db_session)
+    await EmbeddingCache.bulk_insert_data(rows=[
+        {"user_id": user_id, "embedding_model": "embeddings", "content_hash": content_hash(content), "embedding": b"\x00" * 8}
+        for content in ("own chunk", "shared chunk")
+    ], db=db_session)
+
+    await delete_cached_embeddings(user_id, deleted_project, db_session)
+    await db_session.commit()
+
+    rows, _ = await EmbeddingCache.get_all(columns=["content_hash"], where_dict={"user_id": user_id}, db=db_session)
+    assert [row["content_hash"] for row in rows] == [content_hash("shared chunk")]
+
+
+@pytest.mark.asyncio
+async def test_embedding_bulk_delete_and_insert(db_session):
+    from app.models import Embedding
+
+    user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+    rows = [
+        {"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": "section", "retrieval_id": retrieval_id, "embedding": b"\x00" * 8}
+        for retrieval_id in range(1, 6)
+    ]
+
+    await Embedding.bulk_insert_data(rows=rows, db=db_session)
+    await Embedding.bulk_delete_data(where_dict={"user_id": user_id, "project_id": project_id, "retrieval_id": [2, 4]}, db=db_session)
+    await db_session.commit()
+
+    remaining, _ = await Embedding.get_all(columns=["retrieval_id", "dtype", "normalized"], where_dict={"user_id": user_id}, db=db_session)
+
+    assert [row["retrieval_id"] for row in remaining] == [1, 3, 5]
+    assert all(row["dtype"] == "float32" and row["normalized"] is False for row in remaining)
+
+
+@pytest.mark.asyncio
+async def test_generate_embeddings_drops_the_router_index(db_session, tmp_path, monkeypatch, mocker):
+    import numpy as np
+    from app.rag_services.helpers import get_index_paths
+    from app.rag_services.retrieval_service import BaseRetriever, EmbeddingRetriever
+
+    monkeypatch.chdir(tmp_path)
+    user_id, project_id = uuid4(), uuid4()
+
+    index_path, meta_path = get_index_paths(user_id, project_id, "section")
+    index_path.parent.mkdir(parents=True)
+    index_path.touch()
+    meta_path.touch()
+
+    retriever = EmbeddingRetriever(db=db_session, logger=None, user_id=user_id, project_id=project_id, doc_id=uuid4(), level="section", retrieval_amount=1, embedding_model="embeddings", query_transformation_model="chat")
+    retriever.init_embedding_client = AsyncMock()
+    mocker.patch.object(BaseRetriever, "filter_retrieval_content", AsyncMock(return_value={"retrieval_id": [1, 2], "content": ["a", "b"]}))
+    retriever._embed_cached = AsyncMock(return_value=np.eye(2, dtype=np.float32))
+
+    await retriever.generate_embeddings()
+
+    # the index was built from the previous vectors of the level: the router scans exactly until it is rebuilt
+    assert not index_path.exists() and not meta_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_embedding_filter_uses_hierarchy_bitmap(tmp_path, monkeypatch, mocker):
+    import numpy as np
+    from app.models import Retrieval
+    from app.rag_services.helpers import get_embedding_paths, get_hierarchy_path
+    from app.rag_services.retrieval_service import EmbeddingRetriever
+    from app.rag_services.vector_store import write_hierarchy, write_matrix
+
+    monkeypatch.chdir(tmp_path)
+    user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+
+    write_hierarchy(
+        get_hierarchy_path(user_id, project_id, doc_id),
+        {"retrieval_id": [10, 11, 20, 21, 22], "level": ["section", "section", "paragraph", "paragraph", "paragraph"], "level_id": [1, 2, 1, 2, 3]},
+        [{"section_id": 1, "paragraph_id": 1}, {"section_id": 2, "paragraph_id": 2}, {"section_id": 2, "paragraph_id": 3}],
+    )
+    matrix = np.eye(3, dtype=np.float32)
+    write_matrix(*get_embedding_paths(user_id, project_id, doc_id, "paragraph"), matrix, [20, 21, 22])
+
+    get_all = mocker.patch.object(Retrieval, "get_all", AsyncMock())
+
+    retriever = EmbeddingRetriever(db=object(), logger=None, user_id=user_id, project_id=project_id, doc_id=doc_id, level="paragraph", retrieval_amount=1, embedding_model="embeddings", query_transformation_model="chat")
+    retrieval_dict = await retriever.filter_retrieval_content([11])
+
+    get_all.assert_not_awaited()
+    assert retrieval_dict["retrieval_id"] == [21, 22]
+
+    emb_matrix, row_ids = await retriever._load_mapped_embeddings(retrieval_dict)
+    assert row_ids == [21, 22]
+    np.testing.assert_array_equal(emb_matrix, matrix[1:])
+
+
+@pytest.mark.asyncio
+async def test_stale_hierarchy_falls_back_to_sql_filter(db_session, tmp_path, monkeypatch):
+    from app.models import Retrieval
+    from app.rag_services.helpers import get_hierarchy_path
+    from app.rag_services.retrieval_service import BM25Retriever, retrieval_fingerprint
+    from app.rag_services.vector_store import write_hierarchy
+
+    monkeypatch.chdir(tmp_path)
+    user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+
+    async def insert_chunks(level, contents):
+        rows = [
+            await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": level, "level_id": level_id, "content": content}, db=db_session)
+            for level_id, content in enumerate(contents, start=1)
+        ]
+        await db_session.flush()
+        return [row.retrieval_id for row in rows]
+
+    section_ids = await insert_chunks("section", ["s1", "s2"])
+    paragraph_ids = await insert_chunks("paragraph", ["p1", "p2", "p3"])
+    write_hierarchy(
+        get_hierarchy_path(user_id, project_id, doc_id),
+        {"retrieval_id": section_ids + paragraph_ids, "level": ["section"] * 2 + ["paragraph"] * 3, "level_id": [1, 2, 1, 2, 3]},
+        [{"section_id": 1, "paragraph_id": 1}, {"section_id": 2, "paragraph_id": 2}, {"section_id": 2, "paragraph_id": 3}],
+        await retrieval_fingerprint(db_session, user_id, project_id, doc_id=doc_id),
+    )
+
+    retriever = BM25Retriever(db=db_session, logger=None, user_id=user_id, project_id=project_id, doc_id=doc_id, level="paragraph", retrieval_amount=3, query_transformation_model="", query_transformation_prompt="", k1="1.5", b="0.75")
+    retriever._find_source_data = AsyncMock(return_value=[2, 3])
+
+    assert sorted((await retriever.filter_retrieval_content([section_ids[1]]))["content"]) == ["p2", "p3"]
+    retriever._find_source_data.assert_not_awaited()
+
+    # paragraphs re-chunked after the export (SQLite may even hand out the same retrieval_ids again)
+    await Retrieval.bulk_delete_data(where_dict={"user_id": user_id, "doc_id": doc_id, "level": "paragraph"}, db=db_session)
+    await insert_chunks("paragraph", ["new p1", "new p2", "new p3"])
+
+    assert sorted((await retriever.filter_retrieval_content([section_ids[1]]))["content"]) == ["new p2", "new p3"]
+    retriever._find_source_data.assert_awaited_once()
+
+
+
+@pytest.mark.asyncio
+async def test_router_reads_no_content_before_the_top_k(db_session, tmp_path, monkeypatch, mocker):
+    import numpy as np
+    from app.models import Embedding, Retrieval
+    from app.rag_services.keyword_index import invalidate_corpus_statistics
+    from app.rag_services.retrieval_service import EmbeddingRetriever, run_router_index
+    from app.rag_services.vector_store import hnsw_available
+
+    if not hnsw_available():
+        return
+
+    monkeypatch.chdir(tmp_path)
+    user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+    vectors = np.random.default_rng(0).standard_normal((12, 8), dtype=np.float32)
+
+    for level_id, vector in enumerate(vectors, start=1):
+        row = await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": "section", "level_id": level_id, "content": f"s{level_id}"}, db=db_session)
+        await db_session.flush()
+        await Embedding.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": "section", "retrieval_id": row.retrieval_id, "embedding": vector.tobytes()}, db=db_session)
+    await db_session.flush()
+
+    # twelve chunks: below the default threshold, indexed with a configured one
+    assert await run_router_index({"type": "EmbeddingRetriever", "level": "section"}, user_id, project_id, db_session) is False
+    assert await run_router_index({"type": "EmbeddingRetriever", "level": "section", "hnsw_min_elements": "10"}, user_id, project_id, db_session) is True
+
+    router = EmbeddingRetriever(db=db_session, logger=None, user_id=user_id, project_id=project_id, level="section", retrieval_amount=2, embedding_model="embeddings", query_transformation_model="chat")
+    get_all = mocker.spy(Retrieval, "get_all")
+
+    candidates = await router.filter_retrieval_content()
+    assert candidates["router_index"] is not None and len(candidates["retrieval_id"]) == 12
+    get_all.assert_not_called()
+
+    # a chunk added since the export (its writer invalidates): the index is stale, the SQL filter reads ids only
+    await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": "section", "level_id": 13, "content": "s13"}, db=db_session)
+    await db_session.flush()
+    invalidate_corpus_statistics(project_id, "section")
+
+    candidates = await router.filter_retrieval_content()
+    assert "router_index" not in candidates and "content" not in candidates
+    assert len(candidates["retrieval_id"]) == 13
+
+
+
+@pytest.mark.asyncio
+async def test_reasoner_map_reduces_shards_within_budget(mocker):
+    import json
+    import re
+    from app.rag_services.retrieval_service import ReasonerRetriever
+
+    retriever = ReasonerRetriever(db=None, logger=mocker.Mock(), user_id=uuid4(), project_id=uuid4(), level="section", retrieval_amount=2, reasoner_model="coder", query_transformation_model="", shard_tokens="200")
+
+    prompts = []
+
+    def fake_call(label, system_prompt, user_prompt, hedge=None):
+        prompts.append(user_prompt)
+        chunks = re.findall(r"CHUNK_ID=(\d+)\n(.*)", user_prompt)
+        # needles first, by their number, then filler
+        ranked = sorted(chunks, key=lambda chunk: (not chunk[1].startswith("needle"), chunk[1]))
+        return json.dumps({"retrieval_ids": [retrieval_id for retrieval_id, _ in ranked[:2]]})
+
+    retriever.chat_orchestrator = mocker.Mock(call=mocker.AsyncMock(side_effect=fake_call))
+
+    contents = [f"filler {i} " + "lorem ipsum " * 10 for i in range(40)]
+    contents[7], contents[31] = "needle 1", "needle 2"
+    retrieval_dict = {"retrieval_id": list(range(100, 140)), "content": contents}
+
+    assert await retriever.run_retriever("needle", retrieval_dict) == [107, 131]
+
+    # map over several shards, then the reduce call; every chunk list fits the shard budget
+    assert len(prompts) > 2
+    # shard calls of a retriever are not hedged, only those of a reranker
+    assert all(call.kwargs["hedge"] is False for call in retriever.chat_orchestrator.call.await_args_list)
+    for prompt in prompts:
+        chunk_text = prompt.split("CHUNKS:")[1]
+        assert len(chunk_text) // 3 <= 200 + 10
+
+
+@pytest.mark.asyncio
+async def test_reasoner_returns_best_ranked_when_shards_keep_everything(mocker):
+    import json
+    import re
+    from app.rag_apis.chat_api import _estimate_tokens
+    from app.rag_services.retrieval_service import ReasonerRetriever
+
+    retriever = ReasonerRetriever(db=None, logger=mocker.Mock(), user_id=uuid4(), project_id=uuid4(), level="section", retrieval_amount=2, reasoner_model="coder", query_transformation_model="", shard_tokens="200")
+
+    prompts = []
+
+    def fake_call(label, system_prompt, user_prompt, hedge=None):
+        prompts.append(user_prompt)
+        chunks = re.findall(r"CHUNK_ID=(\d+)\n(.*)", user_prompt)
+        # every chunk of the shard, needles first
+        ranked = sorted(chunks, key=lambda chunk: not chunk[1].startswith("needle"))
+        return json.dumps({"retrieval_ids": [retrieval_id for retrieval_id, _ in ranked]})
+
+    retriever.chat_orchestrator = mocker.Mock(call=mocker.AsyncMock(side_effect=fake_call))
+
+    # two chunks per shard, each needle second in its shard; the last chunk is far above the budget
+    contents = ["x" * 260, "needle 1" + "x" * 252, "x" * 260, "needle 2" + "x" * 252, "y" * 3000]
+    retrieval_dict = {"retrieval_id": list(range(100, 105)), "content": contents}
+
+    assert await retriever.run_retriever("needle", retrieval_dict) == [101, 103]
+
+    # the oversized chunk was cut to the budget by the token estimator
+    oversized = [prompt for prompt in prompts if "CHUNK_ID=5" in prompt][0]
+    assert _estimate_tokens(oversized.split("---")[3].strip("\n ")) <= 200
+
+
+
+@pytest.mark.asyncio
+async def test_reasoner_prefilter_caps_candidates(db_session, mocker):
+    import json
+    import re
+    from fastapi import HTTPException
+    from app.models import Retrieval
+    from app.rag_services.retrieval_service import ReasonerRetriever
+
+    user_id, project_id, doc_id = uuid4(), uuid4(), uuid4()
+    contents = [f"filler text number {i}" for i in range(20)]
+    contents[4], contents[15] = "the needle in the haystack", "another needle"
+    rows = [
+        await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": doc_id, "level": "section", "level_id": i, "content": content}, db=db_session)
+        for i, content in enumerate(contents, start=1)
+    ]
+    await db_session.flush()
+    retrieval_dict = {"retrieval_id": [row.retrieval_id for row in rows], "content": contents}
+
+    prompts = []
+
+    def fake_call(label, system_prompt, user_prompt, hedge=None):
+        prompts.append(user_prompt)
+        return json.dumps({"retrieval_ids": re.findall(r"CHUNK_ID=(\d+)", user_prompt)[:1]})
+
+    retriever = ReasonerRetriever(db=db_session, logger=mocker.Mock(), user_id=user_id, project_id=project_id, doc_id=doc_id, level="section", retrieval_amount=1, reasoner_model="coder", query_transformation_model="", prefilter="bm25", prefilter_amount="2")
+    retriever.chat_orchestrator = mocker.Mock(call=mocker.AsyncMock(side_effect=fake_call))
+
+    assert await retriever.run_retriever("needle", retrieval_dict) == [rows[15].retrieval_id]
+
+    # only the two BM25 hits reach the reasoner, best (shortest) first
+    assert len(prompts) == 1
+    assert re.findall(r"CHUNK_ID=(\d+)\n(.*)", prompts[0]) == [("1", contents[15]), ("2", contents[4])]
+
+    with pytest.raises(HTTPException):
+        ReasonerRetriever.prefilter_method({"level": "section", "prefilter": "embedding"})
+
+
+@pytest.mark.asyncio
+async def test_reasoner_aliases_chunk_ids(mocker):
+    import json
+    from app.rag_services.retrieval_service import ReasonerRetriever
+
+    retriever = ReasonerRetriever(db=None, logger=mocker.Mock(), user_id=uuid4(), project_id=uuid4(), level="section", retrieval_amount=3, reasoner_model="coder", query_transformation_model="")
+
+    prompts = []
+
+    def fake_call(label, system_prompt, user_prompt, hedge=None):
+        prompts.append(user_prompt)
+        # unquoted, repeated and hallucinated aliases
+        return json.dumps({"retrieval_ids": ["2", 99, "abc", 1, "2", True]})
+
+    retriever.chat_orchestrator = mocker.Mock(call=mocker.AsyncMock(side_effect=fake_call))
+
+    retrieval_dict = {"retrieval_id": [48213, 51007, 90412], "content": ["first", "second", "third"]}
+    assert await retriever.run_retriever("query", retrieval_dict) == [51007, 48213]
+
+    assert "CHUNK_ID=1\nfirst" in prompts[0] and "48213" not in prompts[0]
+
+
+@pytest.mark.asyncio
+async def test_reasoner_view_builds_compact_prompt(db_session, mocker):
+    import json
+    from fastapi import HTTPException
+    from app.models import Retrieval
+    from app.rag_services.retrieval_service import ReasonerRetriever
+
+    user_id, project_id = uuid4(), uuid4()
+    for title, content in (("Annual report", "Revenue grew. " * 100), ("", "Untitled chunk body. " * 100)):
+        await Retrieval.insert_data(data_dict={"user_id": user_id, "project_id": project_id, "doc_id": uuid4(), "level": "document", "level_id": 1, "title": title, "content": content}, db=db_session)
+    await db_session.flush()
+
+    prompts = {}
+
+    for view in ("title", "summary", "content"):
+        retriever = ReasonerRetriever(db=db_session, logger=mocker.Mock(), user_id=user_id, project_id=project_id, level="document", retrieval_amount=1, reasoner_model="coder", query_transformation_model="", view=view, view_chars="40")
+
+        def fake_call(label, system_prompt, user_prompt, hedge=None, view=view):
+            prompts[view] = user_prompt
+            return json.dumps({"retrieval_ids": ["1"]})
+
+        retriever.chat_orchestrator = mocker.Mock(call=mocker.AsyncMock(side_effect=fake_call))
+
+        retrieval_dict = await retriever.filter_retrieval_content()
+        assert len(await retriever.run_retriever("revenue", retrieval_dict)) == 1
+
+    assert "CHUNK_ID=1\nAnnual report\n\n" in prompts["title"]
+    assert "CHUNK_ID=2\nUntitled chunk body. Untitled chunk body\n\n" in prompts["title"]
+    assert "CHUNK_ID=1\nAnnual report\nRevenue grew. Revenue grew. Revenue grew" in prompts["summary"]
+    assert len(prompts["title"]) * 10 < len(prompts["content"])
+
+    with pytest.raises(HTTPException):
+        ReasonerRetriever(db=None, logger=None, user_id=user_id, project_id=project_id, level="document", retrieval_amount=1, reasoner_model="coder", query_transformation_model="", view="outline")
@@ -0,0 +1,96 @@
+import numpy as np
+
+from app.rag_services import vector_store
+
+
+def test_matrix_roundtrip_is_memory_mapped(tmp_path):
+    matrix_path, ids_path = tmp_path / "p_section.npy", tmp_path / "p_section.ids.npy"
+    matrix = np.arange(12, dtype=np.float32).reshape(4, 3)
+
+    vector_store.write_matrix(matrix_path, ids_path, matrix, [10, 11, 12, 13])
+    loaded, ids = vector_store.load_matrix(matrix_path, ids_path)
+
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, matrix)
+    assert ids.tolist() == [10, 11, 12, 13]
+
+    rows, row_ids = vector_store.select_rows(loaded, ids, np.array([13, 11]))
+    assert row_ids.tolist() == [11, 13]
+    np.testing.assert_array_equal(rows, matrix[[1, 3]])
+
+
+def test_missing_matrix_returns_none(tmp_path):
+    assert vector_store.load_matrix(tmp_path / "missing.npy", tmp_path / "missing.ids.npy") is None
+
+
+def test_hnsw_small_level_falls_back_to_exact_scan(tmp_path):
+    index_path, meta_path = tmp_path / "section.hnsw", tmp_path / "section.hnsw.meta.npz"
+    blocks = [(np.ones((3, 4), dtype=np.float32), np.array([1, 2, 3]))]
+
+    assert vector_store.build_hnsw(index_path, meta_path, blocks) is False
+    assert vector_store.load_hnsw(index_path, meta_path) is None
+
+
+def test_hnsw_search_finds_nearest(tmp_path):
+    if not vector_store.hnsw_available():
+        return
+
+    index_path, meta_path = tmp_path / "section.hnsw", tmp_path / "section.hnsw.meta.npz"
+
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((40, 8), dtype=np.float32)
+    ids = np.arange(100, 140)
+    blocks = [(matrix[:25], ids[:25]), (matrix[25:], ids[25:])]
+
+    assert vector_store.build_hnsw(index_path, meta_path, blocks) is False
+    assert vector_store.build_hnsw(index_path, meta_path, blocks, min_elements=10, fingerprint=(40, 139, 960)) is True
+
+    index, index_ids, fingerprint = vector_store.load_hnsw(index_path, meta_path)
+    assert index_ids.tolist() == ids.tolist()
+    assert fingerprint == (40, 139, 960)
+    assert vector_store.hnsw_search(index, matrix[30], k=1)[0] == 130
+
+
+def test_compact_encodings_roundtrip():
+    rng = np.random.default_rng(2)
+    matrix = rng.standard_normal((6, 16), dtype=np.float32)
+    matrix[0] = 0.0
+
+    for dtype, atol in (("float32", 0.0), ("float16", 1e-2), ("int8", 3e-2)):
+        blobs = vector_store.encode_vectors(matrix, dtype)
+        decoded = vector_store.decode_vectors(blobs, dtype)
+
+        assert decoded.dtype == np.float32
+        np.testing.assert_allclose(decoded, matrix, atol=atol)
+
+    assert len(vector_store.encode_vectors(matrix, "int8")[0]) == 4 + 16
+
+
+def test_hierarchy_bitmaps_follow_paragraph_ancestry(tmp_path):
+    path = tmp_path / "p.hierarchy.npz"
+    retrieval_columns = {
+        "retrieval_id": [1, 10, 11, 20, 21, 22],
+        "level": ["document", "section", "section", "paragraph", "paragraph", "paragraph"],
+        "level_id": [1, 1, 2, 1, 2, 3],
+    }
+    paragraph_levels = [
+        {"document_id": 1, "section_id": 1, "paragraph_id": 1},
+        {"document_id": 1, "section_id": 1, "paragraph_id": 2},
+        {"document_id": 1, "section_id": 2, "paragraph_id": 3},
+    ]
+
+    vector_store.write_hierarchy(path, retrieval_columns, paragraph_levels)
+    index = vector_store.load_hierarchy(path)
+
+    assert index.level_ids("paragraph").tolist() == [20, 21, 22]
+    assert index.children([10], "paragraph").tolist() == [True, True, False]
+    assert index.children([1], "section").tolist() == [True, True]
+    assert index.children([22], "section").tolist() == [False, True]
+
+    # ids of other documents are unknown to this index
+    assert index.children([999], "paragraph") is None
+
+    # matrix rows in export order
+    row_mask = index.row_mask("paragraph", index.children([11], "paragraph"), np.array([22, 20, 21]))
+    assert row_mask.tolist() == [True, False, False]
+    assert index.row_mask("paragraph", np.ones(3, dtype=bool), np.array([20, 21, 23])) is None